@@ -0,0 +1,155 @@
+"""
+This code checks the support modules of the parameter explorations and the fused training kernels against their reference implementations: the reward and dopa kernel (ex.reward_dopa), the result cache (helper/result_cache.py), the results store (helper/sweep_store.py), the work queue (helper/work_queue.py) and the trace recorder (helper/trace.py).
+
+usage: python check_helpers.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import hebbian_net
+import helper.external as ex
+import helper.result_cache as rc
+import helper.sweep_store as ss
+import helper.work_queue as wq
+import helper.trace as tr
+
+hebbian_net = reload(hebbian_net)
+ex = reload(ex)
+rc = reload(rc)
+ss = reload(ss)
+wq = reload(wq)
+tr = reload(tr)
+
+n_failed = 0
+
+def check(name, passed):
+	""" reports the result of a check """
+	global n_failed
+	print ('%s\t: %s' % (name, 'ok' if passed else 'FAILED')).expandtabs(50)
+	if not passed: n_failed += 1
+
+def reference_dopa(predicted_reward, reward, dopa_values, dopa_func):
+	""" vectorial implementation of the relationships between RPE and DA release, independent of ex.dopa_value """
+	dHigh, dMid, dNeut, dLow, d_noLabel = [dopa_values[k] for k in ['dHigh', 'dMid', 'dNeut', 'dLow', 'd_noLabel']]
+	RPE = reward - np.asarray(predicted_reward, dtype=float)
+	if dopa_func=='discrete':
+		dopa = np.zeros(len(reward))
+		dopa[np.logical_and(predicted_reward==0, reward==1)] = dHigh
+		dopa[np.logical_and(predicted_reward==1, reward==1)] = dMid
+		dopa[np.logical_and(predicted_reward==0, reward==0)] = dNeut
+		dopa[np.logical_and(predicted_reward==1, reward==0)] = dLow
+		dopa[reward==-1] = d_noLabel
+		return dopa
+	elif dopa_func=='linear':
+		return dHigh*RPE + dMid
+	elif dopa_func=='linear_discrete':
+		return dHigh*(RPE - 0.84953668) + 8.0
+	elif dopa_func=='exponential':
+		return np.exp(dHigh*RPE) - dMid
+	elif dopa_func=='sigmoidal':
+		return ((dHigh - dLow) / (1.0+np.exp(dMid*RPE))) + dLow
+
+""" reward and dopa kernel """
+rng = np.random.RandomState(0)
+classes = np.arange(10)
+dopa_values = {'dHigh': 4.0, 'dMid': 0.7, 'dNeut': -0.25, 'dLow': -1.0, 'd_noLabel': 0.3}
+same = {f: True for f in ex.dopa_funcs}
+for i in range(100):
+	n_trials = rng.randint(1, 60)
+	out_greedy, out_explore = rng.rand(n_trials, len(classes)), rng.rand(n_trials, len(classes))
+	if i%3 == 0: out_greedy[:, 3] = out_explore[:, 3] = 2. #greedy and taken actions agree
+	if i%5 == 0: out_explore[0, 5] = np.nan
+	labels = rng.randint(-1, len(classes), n_trials)
+	explorative = rng.rand(n_trials) < 0.5
+	greedy, explore = classes[np.argmax(out_greedy, 1)], classes[np.argmax(out_explore, 1)]
+	sorted_post = np.sort(out_explore, 1)
+	for dopa_func in ex.dopa_funcs:
+		for compare_output in [False, True]:
+			predicted_reward = ex.reward_prediction(explorative, compare_output, classes, out_greedy, out_explore, dopa_func)
+			reward = ex.reward_delivery(labels, explore)
+			dopa = ex.compute_dopa(predicted_reward, reward, dopa_values, dopa_func)
+			kernel = ex.reward_dopa(labels, classes, greedy, explore, out_greedy, out_explore, explorative, compare_output, dopa_values, dopa_func)
+			same[dopa_func] &= np.allclose(kernel[0], np.asarray(predicted_reward, dtype=float), equal_nan=True, rtol=0, atol=0)
+			same[dopa_func] &= np.array_equal(kernel[1], reward)
+			same[dopa_func] &= np.allclose(kernel[2], dopa, equal_nan=True) and np.allclose(dopa, reference_dopa(predicted_reward, reward, dopa_values, dopa_func), equal_nan=True)
+			same[dopa_func] &= np.allclose(kernel[3], sorted_post[:,-1], equal_nan=True, rtol=0, atol=0) and np.allclose(kernel[4], sorted_post[:,-2], equal_nan=True, rtol=0, atol=0)
+for dopa_func in ex.dopa_funcs:
+	check('reward_dopa, ' + dopa_func, same[dopa_func])
+
+""" network trained on a small gabor dataset """
+folder = tempfile.mkdtemp()
+np.random.seed(0)
+images_dict, labels_dict, _, images_params = ex.load_images('gabor', 1.0e3, verbose=False, gabor_params={'n_train':200, 'n_test':100, 'renew_trainset':False, 'target_ori':165., 'excentricity':90., 'noise_pixel':0.0, 'rnd_phase':False, 'rnd_freq':False, 'im_size':16, 'classes':np.array([0,1])})
+parameter_dict = dict(dHigh=4.0, dMid=0.01, dNeut=-0.25, dLow=-1.0, d_noLabel=0.0, protocol='gabor', name='check', n_runs=1, n_epi_crit=1, n_epi_fine=0, n_epi_perc=1, n_epi_post=0, t_hid=1.0, t_out=0.1, A=1.0e3, lr_hid=5e-3, batch_size=50, shuffle_datasets=False, n_hid_neurons=8, weight_init='input', init_file=None, lim_weights=True, epsilon_xplr=1.0, noise_xplr_hid=0.3, exploration=True, compare_output=True, noise_activ=0.0, classifier='neural_prob', RF_classifier='data', test_each_epi=True, early_stop=False, verbose=False, seed=976)
+net = hebbian_net.Network(**parameter_dict)
+key = rc.config_key(net, images_params, images_dict, labels_dict)
+check('config_key, same configuration', key == rc.config_key(hebbian_net.Network(**parameter_dict), images_params, images_dict, labels_dict))
+check('config_key, ignores the name', key == rc.config_key(hebbian_net.Network(**dict(parameter_dict, name='other')), images_params, images_dict, labels_dict))
+check('config_key, other parameter', key != rc.config_key(hebbian_net.Network(**dict(parameter_dict, dLow=-2.0)), images_params, images_dict, labels_dict))
+check('config_key, other dataset', key != rc.config_key(net, images_params, dict(images_dict, train=images_dict['train'][::-1]), labels_dict))
+check('config_key, no seed', rc.config_key(hebbian_net.Network(**dict(parameter_dict, seed=None)), images_params, images_dict, labels_dict) is None)
+net.train(images_dict, labels_dict, images_params)
+
+""" result cache """
+cache_folder = os.path.join(folder, 'cache')
+check('result cache, empty', not rc.has_result(key, cache_folder))
+rc.store(key, net, cache_folder)
+cached = rc.load_net(key, 'renamed', folder=cache_folder)
+check('result cache, copy', rc.has_result(key, cache_folder) and cached.name == 'renamed' and np.allclose(cached.hid_W_trained, net.hid_W_trained, equal_nan=True, rtol=0, atol=0) and np.array_equal(cached.perf_all, net.perf_all))
+store_folder = os.path.join(folder, 'store')
+ss.save_net(store_folder, net)
+ref_key = key[::-1]
+rc.store(ref_key, net, cache_folder, ref=store_folder)
+cached = rc.load_net(ref_key, 'renamed', folder=cache_folder)
+check('result cache, reference', sorted(os.listdir(os.path.join(cache_folder, ref_key))) == ['entry.pkl'] and np.allclose(cached.hid_W_trained, net.hid_W_trained, equal_nan=True, rtol=0, atol=0))
+rc.store(key[1:], net, cache_folder, ref=store_folder, weights_dtype='float16')
+check('result cache, reference precision', rc.has_result(key[1:], cache_folder, weights_dtype='float16') and not rc.has_result(key[1:], cache_folder))
+os.utime(os.path.join(store_folder, ss.networks_folder, net.name), (0, 0))
+check('result cache, stale reference', not rc.has_result(ref_key, cache_folder))
+
+""" results store """
+records = [{'index': i, 'name': 'check_%d' % i, 'params': parameter_dict, 'explored': {'dLow': -float(i)}, 'test_perf': np.arange(i+1)/10., 'stat_diff': None, 'n_epi_trained': None, 'runtime': float(i), 'error': None if i != 1 else 'error'} for i in range(3)]
+for record in records:
+	ss.write_row(store_folder, record)
+loaded_rows = ss.load_records(store_folder)
+ss.compact(store_folder)
+loaded_table = ss.load_records(store_folder)
+for name, loaded in [('rows', loaded_rows), ('table', loaded_table)]:
+	check('results store, ' + name, [r['index'] for r in loaded] == range(3) and all(np.array_equal(r['test_perf'], record['test_perf']) and r['explored'] == record['explored'] and r['error'] == record['error'] for r, record in zip(loaded, records)))
+
+""" work queue """
+queue_folder = os.path.join(folder, 'queue')
+n_jobs = wq.submit_sweep(dict(parameter_dict, n_epi_perc=2), {'dMid': [0.0, 0.1, 0.2], 'dLow': [-1.0, -2.0]}, images_dict, labels_dict, images_params, queue_folder, cache=False)
+job, lease_path = wq.claim(queue_folder, 'dead_worker')
+check('work queue, lease', wq.queue_status(queue_folder) == {'pending': n_jobs-1, 'leased': 1, 'done': 0})
+check('work queue, requeue expired lease', wq.requeue_expired(queue_folder, lease_timeout=-1.) == 1 and not wq.complete(lease_path))
+claimed = []
+while True:
+	job, lease_path = wq.claim(queue_folder, 'worker')
+	if job is None: break
+	claimed.append((job['index'], job['params']['dMid'], job['params']['dLow']))
+	wq.complete(lease_path)
+check('work queue, every job claimed once', sorted(i for i, _, _ in claimed) == range(n_jobs) and len(set((m, l) for _, m, l in claimed)) == n_jobs)
+check('work queue, done', wq.queue_status(queue_folder) == {'pending': 0, 'leased': 0, 'done': n_jobs})
+
+""" trace recorder """
+signals = ['dopa', 'label', 'posterior_greedy']
+values = {'dopa': rng.rand(230), 'label': rng.randint(0, 10, 230), 'posterior_greedy': rng.rand(230, 10)}
+recorders = [tr.TraceRecorder(signals, every=3, chunk_size=20), tr.TraceRecorder(signals, every=3, chunk_size=20, folder=os.path.join(folder, 'trace'))]
+for recorder in recorders:
+	for start in range(0, 230, 50):
+		recorder.record(0, 1, start, **{s: v[start:start+50] for s, v in values.items()})
+	recorder.flush()
+trace = tr.load_trace(os.path.join(folder, 'trace'))
+check('trace, subsampled trials', np.array_equal(recorders[0]['trial'], np.arange(0, 230, 3)))
+check('trace, memory', all(np.array_equal(recorders[0][s], values[s][::3]) for s in signals))
+check('trace, disk', all(np.array_equal(trace[s], recorders[0][s]) for s in signals + tr.index_signals))
+
+shutil.rmtree(folder, ignore_errors=True)
+print '\n%d check(s) failed' % n_failed
+sys.exit(n_failed > 0)
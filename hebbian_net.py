@@ -15,6 +15,7 @@ import time
 import pickle
 import scipy.special
 import os
+import copy
 from pdb import set_trace
 
 ex = reload(ex)
@@ -25,7 +26,9 @@ an = reload(an)
 class Network:
 	""" Hebbian neural network with dopamine-inspired learning """
 
-	def __init__(self, dHigh, dMid, dNeut, dLow, d_noLabel, dopa_func='discrete', dopa_out_same=True, train_out_dopa=False, dHigh_out=0.0, dMid_out=0.2, dNeut_out=-0.3, dLow_out=-0.5, ach_1=1.0, ach_2=0.0, ach_3=0.0, ach_4=0.0, ach_func='sigmoidal', ach_avg=20, ach_stim=False, ach_uncertainty=True, ach_BvSB=False, ach_approx_class=False, protocol='digit', name='net', dopa_release=True, ach_release=False, n_runs=1, n_epi_crit=20, n_epi_fine=0, n_epi_perc=20, n_epi_post=0, t_hid=1.0, t_out=1.0, A=940., lr_hid=5e-3, lr_out=5e-7, batch_size=50, block_feedback=False, shuffle_datasets=True, cross_validate=False, n_hid_neurons=49, weight_init='input', init_file=None, lim_weights=False, log_weights='log', epsilon_xplr=0.5, noise_xplr_hid=0.2, noise_xplr_out=2e4, noise_activ=0.2, exploration=True, compare_output=False, pdf_method='fit', classifier='neural_prob', RF_classifier='svm', pairing_class=None, test_each_epi=False, early_stop=True, verbose=True, save_light=True, seed=None, pypet=False, pypet_name=''):
+	perc_params = ['dHigh', 'dMid', 'dNeut', 'dLow', 'd_noLabel', 'ach_1', 'ach_2', 'ach_3', 'ach_4', 'ach_func'] #parameters only used from the perceptual learning period on (see update_params)
+
+	def __init__(self, dHigh, dMid, dNeut, dLow, d_noLabel, dopa_func='discrete', dopa_out_same=True, train_out_dopa=False, dHigh_out=0.0, dMid_out=0.2, dNeut_out=-0.3, dLow_out=-0.5, ach_1=1.0, ach_2=0.0, ach_3=0.0, ach_4=0.0, ach_func='sigmoidal', ach_avg=20, ach_stim=False, ach_uncertainty=True, ach_BvSB=False, ach_approx_class=False, protocol='digit', name='net', dopa_release=True, ach_release=False, n_runs=1, n_epi_crit=20, n_epi_fine=0, n_epi_perc=20, n_epi_post=0, t_hid=1.0, t_out=1.0, A=940., lr_hid=5e-3, lr_out=5e-7, batch_size=50, block_feedback=False, shuffle_datasets=True, cross_validate=False, n_hid_neurons=49, weight_init='input', init_file=None, lim_weights=False, log_weights='log', epsilon_xplr=0.5, noise_xplr_hid=0.2, noise_xplr_out=2e4, noise_activ=0.2, exploration=True, compare_output=False, pdf_method='fit', classifier='neural_prob', RF_classifier='svm', RF_probing='dense', pairing_class=None, test_each_epi=False, early_stop=True, verbose=True, save_light=True, seed=None, pypet=False, pypet_name=''):
 
 		"""
 		Sets network parameters 
@@ -81,9 +84,10 @@ class Network:
 				noise_activ (float, optional): standard deviation of additive noise corrupting the activation of hidden neurons. Default: 0.2
 				exploration (bool, optional): whether to take take explorative decisions (True) or not (False). Default: True
 				compare_output (bool, optional): whether to compare the value of greedy and taken action to determine if the trial is exploratory. Default: False
-				pdf_method (str, optional): method used to approximate the pdf; valid: 'fit', 'subsample', 'full'. Default: 'fit'
+				pdf_method (str, optional): method used to approximate the pdf; valid: 'fit', 'subsample', 'full' (kernel density estimation) and 'gaussian' (one gaussian per class; fast). Default: 'fit'
 				classifier (str, optional): which classifier to use for performance assessment. Possible values are: 'neural_prob', 'neural_dopa', 'bayesian'. Default: 'neural_prob'
 				RF_classifier (str, optional): which classifier to use to classifier RFs. Possible values are: 'data', 'svm', 'knn'. Default: 'svm'
+				RF_probing (str, optional): how the orientations are probed to find the preferred orientation of the hidden neurons when checking out_W after each episode (gabor protocol). Possible values are: 'dense', 'adaptive' (much faster; the preferred orientations are those of the dense sweep except for neurons whose tuning curve has two peaks, see gr.tuning_curves). Default: 'dense'
 				pairing_class (int, optional): which class to pair with modulator release. None is no pairing. Pairing strength is from dHigh. Default: None
 				test_each_epi (bool, optional): whether to test the network's performance at each episode with test data. Default: False
 				early_stop (bool, optional): whether to stop training when performance saturates. Default: True
@@ -94,6 +98,7 @@ class Network:
 				pypet_name (str, optional): name of the directory in which data is saved when doing pypet exploration. Default: ''
 		"""
 		
+		self._init_args 		= {k: v for k, v in locals().items() if k != 'self'} #arguments of the constructor, used to identify the network's results (see result_cache)
 		self.dopa_values 		= {'dHigh': dHigh, 'dMid':dMid, 'dNeut':dNeut, 'dLow':dLow, 'd_noLabel':d_noLabel}
 		self.dopa_func 			= dopa_func
 		self.dopa_out_same 		= dopa_out_same
@@ -137,6 +142,7 @@ class Network:
 		self.pdf_method 		= pdf_method
 		self.classifier			= classifier
 		self.RF_classifier 		= RF_classifier
+		self.RF_probing 		= RF_probing
 		self.pairing_class 		= pairing_class
 		self.test_each_epi		= test_each_epi
 		self.early_stop 		= early_stop
@@ -146,7 +152,8 @@ class Network:
 		self.pypet 				= pypet
 		self.pypet_name 		= pypet_name if pypet_name != '' else name
 		self._early_stop_cond 	= []
-		self.ach_func 			= {'linear':ex.ach_linear, 'exponential':ex.ach_exponential, 'polynomial':ex.ach_polynomial, 'sigmoidal':ex.ach_sigmoidal, 'handmade':ex.ach_handmade, 'preset':'preset', 'labels':'labels', 'labels_reverse':'labels_reverse'}[ach_func]
+		self.recorder 			= None #records signals of the trials during training if set to a trace.TraceRecorder
+		self.ach_func 			= self._ach_func(ach_func)
 
 		np.random.seed(self.seed)
 		self._check_parameters()
@@ -155,7 +162,50 @@ class Network:
 
 		if noise_activ!=0.0: raise NotImplementedError('corruptove noise is commented-out') ##
 
-	def train(self, images_dict, labels_dict, images_params={}):
+	def update_params(self, **params):
+		"""
+		Changes parameters of the perceptual learning period (see perc_params) and the name of the network, e.g. to continue with different parameters a network paused before the perceptual learning period (see train)
+
+			Args:
+				params: new values of parameters in perc_params, 'name' or 'pypet_name'
+		"""
+		for k in params.keys():
+			if k not in self.perc_params + ['name', 'pypet_name']:
+				raise ValueError('\'' + k + '\' is not a parameter of the perceptual learning period')
+		n_epi_pre = self.n_epi_crit + self.n_epi_fine
+		if hasattr(self, '_runs_done') and (any([np.sum(self.perf_train_prog[r]!=-1) > n_epi_pre for r in self._runs_done]) or any([run.e > n_epi_pre for run in self._run_states.values()])):
+			raise RuntimeError('parameters of the perceptual learning period cannot be changed once it has started')
+
+		self._init_args.update(params)
+		args = self._init_args
+		self.dopa_values 		= {'dHigh': args['dHigh'], 'dMid':args['dMid'], 'dNeut':args['dNeut'], 'dLow':args['dLow'], 'd_noLabel':args['d_noLabel']}
+		self.dopa_values_out 	= {'dHigh': args['dHigh_out'], 'dMid':args['dMid_out'], 'dNeut':args['dNeut_out'], 'dLow':args['dLow_out']} if not self.dopa_out_same else self.dopa_values.copy()
+		self.ach_values 		= {'ach_1': args['ach_1'], 'ach_2': args['ach_2'], 'ach_3': args['ach_3'], 'ach_4': args['ach_4']}
+		self.ach_func 			= self._ach_func(args['ach_func'])
+		self.name 				= args['name']
+		self.pypet_name 		= args['pypet_name'] if args['pypet_name'] != '' else args['name']
+
+	def keep_runs(self, n_runs):
+		"""
+		Keeps the results of the first n_runs runs only, e.g. to end the training of a network whose other runs are not needed (see train); these runs must be completed
+
+			Args:
+				n_runs (int): number of runs to keep
+		"""
+		if not set(range(n_runs)).issubset(self._runs_done):
+			raise RuntimeError('only completed runs can be kept')
+		for k in ['hid_W_naive', 'hid_W_trained', 'out_W_naive', 'out_W_trained', '_idx_shuffle_saved', 'CM_all', 'perf_all', 'perf_train_prog', 'perf_test_prog', 'log_likelihood_prog', 'stim_perf_saved', 'stim_perf_labels_saved']:
+			if isinstance(getattr(self, k), np.ndarray) and len(getattr(self, k))==self.n_runs:
+				setattr(self, k, getattr(self, k)[:n_runs])
+		self._runs_done = range(n_runs)
+		self._run_states = {}
+		self.n_runs = n_runs
+
+	def _ach_func(self, ach_func):
+		""" returns the ACh release function named ach_func """
+		return {'linear':ex.ach_linear, 'exponential':ex.ach_exponential, 'polynomial':ex.ach_polynomial, 'sigmoidal':ex.ach_sigmoidal, 'handmade':ex.ach_handmade, 'preset':'preset', 'labels':'labels', 'labels_reverse':'labels_reverse'}[ach_func]
+
+	def train(self, images_dict, labels_dict, images_params={}, runs=None, stop_epi=None):
 		""" 
 		Train Hebbian neural network
 
@@ -163,9 +213,12 @@ class Network:
 				images_dict (dict): dictionary of 2D image arrays to test the Network on, with keys: 'train', 'test'.
 				labels_dict (dict): dictionary of label arrays of the images.
 				images_params (dict, optional): parameters used to create the images
+				runs (list, optional): runs to train, in increasing order; all runs if None. Runs already completed are skipped. Default: None
+				stop_epi (int, optional): episode before which to pause the runs; their state is saved and a later call to train resumes them from there (and continues the training of a network with runs not completed). Runs are trained to the end if None. Default: None
 		"""
 
 		self._train_start = time.time()
+		resume = hasattr(self, '_runs_done') and len(self._runs_done) < self.n_runs #continue a network paused by a previous call
 
 		images_train, images_test, images_task = images_dict['train'], images_dict['test'], images_dict['task']
 		labels_train, labels_test, labels_task = labels_dict['train'], labels_dict['test'], labels_dict['task']
@@ -180,66 +233,57 @@ class Network:
 		self.n_out_neurons = len(self.classes)
 		self.n_inp_neurons = np.size(images_train,1)
 		self.n_epi_tot = self.n_epi_crit + self.n_epi_fine + self.n_epi_perc + self.n_epi_post
-		self.hid_W_naive = np.zeros((self.n_runs, self.n_inp_neurons, self.n_hid_neurons))
-		self.hid_W_trained = np.zeros((self.n_runs, self.n_inp_neurons, self.n_hid_neurons))
-		self.out_W_naive = np.zeros((self.n_runs, self.n_hid_neurons, self.n_out_neurons))
-		self.out_W_trained = np.zeros((self.n_runs, self.n_hid_neurons, self.n_out_neurons))
-		self._idx_shuffle = None
-		self._idx_shuffle_saved = np.zeros((self.n_runs, images_train.shape[0] + images_test.shape[0]), dtype=int) if not self.save_light or self.ach_release else None
-		self.CM_all = np.zeros((self.n_runs, self.n_classes, self.n_classes))
-		self.perf_all = np.zeros(self.n_runs)
-		self.perf_train_prog = np.ones((self.n_runs, self.n_epi_tot))*-1
-		self.perf_test_prog = np.ones((self.n_runs, self.n_epi_tot))*-1 if self.test_each_epi else None
-		self.log_likelihood_prog = np.ones((self.n_runs, self.n_epi_tot))*-1 if self.test_each_epi else None
 		self._labels2idx = ex.set_labels2idx(self.classes)
 		self._train_class_layer = True if self.classifier=='neural_dopa'  else False
 		self._n_batches = int(np.ceil(float(self.n_images)/self.batch_size))
 		self._saved_perf_size = (self.n_images, self.ach_avg) if self.ach_stim else (self.n_classes, self.ach_avg)
-		self.stim_perf_saved = np.ones((self.n_runs, self._saved_perf_size[0], self._saved_perf_size[1]))*np.nan
-		self.stim_perf_labels_saved = np.ones((self.n_runs, self.n_images))*np.nan if not self.save_light else np.zeros(1)
-		self.ach_tracker = np.ones((self.n_images, self.n_epi_tot))*np.nan if not self.save_light else np.zeros(self.n_images)
-		# self.dopa_tracker = np.array([])
-		# self.RP_tracker = np.array([])
-		# self.RPE_tracker = np.array([])
-		# self.decision_tracker_greedy = np.zeros((self.n_epi_perc, self.n_images), dtype=int) ###
-		# self.decision_tracker_explore = np.zeros((self.n_epi_perc, self.n_images), dtype=int) ###
-		# self.posterior_tracker_greedy = np.zeros((self.n_epi_perc, self.n_images, self.n_classes)) ###
-		# self.posterior_tracker_explore = np.ones((self.n_epi_perc, self.n_images, self.n_classes))*np.nan
-		# self.activ_tracker = np.zeros((0, self.n_hid_neurons))
+		self._stim_perf_range = ((0., 1.) if self.ach_uncertainty else (-1., 1.)) if self.ach_stim else None #per-stimulus performance is quantized (see ex.PerfTracker)
+		if not resume: #results of all runs
+			self.hid_W_naive = np.zeros((self.n_runs, self.n_inp_neurons, self.n_hid_neurons))
+			self.hid_W_trained = np.zeros((self.n_runs, self.n_inp_neurons, self.n_hid_neurons))
+			self.out_W_naive = np.zeros((self.n_runs, self.n_hid_neurons, self.n_out_neurons))
+			self.out_W_trained = np.zeros((self.n_runs, self.n_hid_neurons, self.n_out_neurons))
+			self._idx_shuffle = None
+			self._idx_shuffle_saved = np.zeros((self.n_runs, images_train.shape[0] + images_test.shape[0]), dtype=int) if not self.save_light or self.ach_release else None
+			self.CM_all = np.zeros((self.n_runs, self.n_classes, self.n_classes))
+			self.perf_all = np.zeros(self.n_runs)
+			self.perf_train_prog = np.ones((self.n_runs, self.n_epi_tot))*-1
+			self.perf_test_prog = np.ones((self.n_runs, self.n_epi_tot))*-1 if self.test_each_epi else None
+			self.log_likelihood_prog = np.ones((self.n_runs, self.n_epi_tot))*-1 if self.test_each_epi else None
+			self.stim_perf_saved = np.full((self.n_runs, self._saved_perf_size[0], self._saved_perf_size[1]), np.nan, dtype=np.float16 if self.ach_stim else float) #float16 only approximates the quantized per-stimulus performance; the round trip is lossless because PerfTracker._encode re-rounds to the nearest code
+			self.stim_perf_labels_saved = np.ones((self.n_runs, self.n_images))*np.nan if not self.save_light else np.zeros(1)
+			self.ach_tracker = ex.column_memmap((self.n_images, self.n_epi_tot), None if self.pypet else os.path.join('output', self.name, 'weights', 'ach_tracker.npy')) if not self.save_light else np.zeros(self.n_images) #ACh of each stimulus (in the order of the training set) and episode
+			self._runs_done = []
+			self._run_states = {} #runs paused or prepared by a previous call (see _Run)
 
 		if self.verbose: 
 			print 'seed: ' + str(self.seed) + '\n'
 			print 'run:  ' + self.name
 			print '\ntraining network...'
+		if self.cross_validate: #disjoint folds of the training set, one per run
+			cv_folds = ex.cross_validation_folds(len(labels_dict['train']), self.n_runs, seed=self.seed)
+
 		""" execute multiple training runs """
-		for r in range(self.n_runs):
+		prev_r = None #last run set up by this call
+		images_init = images_train #training images set up by the previous run
+		for r in (range(self.n_runs) if runs is None else runs):
+			if r in self._runs_done: continue
 			self._r = r
 			if self.verbose: print '\nrun: %d' %r
-			np.random.seed(self.seed+r)
-			self._init_weights(images_train)
-			self._W_in_since_update = np.copy(self.hid_W)
-			if self.protocol=='digit' and self.shuffle_datasets and self.images_params['labels_subs']==1: #shuffle train and test datasets for each independent run
-				images_train, images_test, labels_train, labels_test, idx_train, idx_test = ex.shuffle_datasets(images_dict, labels_dict, self._idx_shuffle)
-			elif self.cross_validate:
-				images_train, images_test, labels_train, labels_test = ex.cross_validate_split(images_dict, labels_dict, self.n_runs, self._r)
-				self.n_images = images_train.shape[0]
-				self._n_batches = int(np.ceil(float(self.n_images)/self.batch_size))
-			elif self.protocol=='gabor':
-				if r != 0: #reload new training gabor filter
-					images_dict_new, labels_dict_new, _, _ = ex.load_images(self.protocol, self.A, self.verbose, gabor_params=self.images_params)
-					images_train, images_task = images_dict_new['train'], images_dict_new['task']
-					labels_train, labels_task = labels_dict_new['train'], labels_dict_new['task']
-				if self.images_params['noise_pixel'] > 0.0:
-					gaussian_noise = np.random.normal(0.0, self.images_params['noise_pixel'], size=np.shape(images_train))
-				else:
-					gaussian_noise = np.zeros(np.shape(images_train))
-			elif self.protocol=='toy_data' and not self.pypet:
-				images_train, images_test, labels_train, labels_test, idx_train, idx_test = ex.shuffle_datasets(images_dict, labels_dict, self._idx_shuffle)
-				an.assess_toy_data(self, images_train, labels_train, os.path.join('.', 'output', self.name, 'result_init'))
-			images_rndm, labels_rndm = images_train, labels_train
+			#the weights of a run are initialized with the images set up by the previous run; if it was set up by a previous call, with the statistics of its images
+			run = self._run_states.pop(r) if r in self._run_states else _Run(r)
+			self._set_up_run(run, images_dict, labels_dict, images_init, stats=run.init_stats if prev_r != r-1 else None, cv_folds=cv_folds if self.cross_validate else None)
+			if run.saved is not None: #resume a paused run (its set-up is replayed identically and then overwritten with its saved state)
+				run.resume(self)
+			prev_r = r
+			images_init = run.images_train
 
 			""" train network """
-			for e in range(self.n_epi_tot):
+			for e in range(run.e, self.n_epi_tot):
+				if stop_epi is not None and e >= stop_epi: #pause the run before episode e
+					run.pause(self, e)
+					self._run_states[r] = run
+					break
 				self._e = e
 				stim_perf_epi = np.empty(0)
 
@@ -255,22 +299,24 @@ class Network:
 				
 				#shuffle or create new input images
 				if self.protocol=='gabor' and e >= self.n_epi_crit:
-					if self.images_params['renew_trainset']: #create new training images
-						rnd_orientations= np.random.random(self.images_params['n_train'])*self.images_params['excentricity']*2 + self.images_params['target_ori'] - self.images_params['excentricity']
-						images_rndm, labels_rndm = ex.generate_gabors(rnd_orientations, self.images_params['target_ori'], self.images_params['im_size'])
+					if self.images_params['renew_trainset']: #get new training images and start creating those of the next episode
+						run.images_src, run.labels_rndm = run.trainset_producer.get(e, e_next=e+1 if e+1 < self.n_epi_tot else None)
+						run.order = np.arange(len(run.labels_rndm))
 					else: 
-						images_rndm, labels_rndm = ex.shuffle([images_task, labels_task])
+						run.images_src = run.images_task
+						run.order, run.labels_rndm = ex.shuffle([np.arange(len(run.labels_task)), run.labels_task])
+					run.stim_ids = np.arange(len(run.order))
 				else:
 					if not self.ach_stim:
-						images_rndm, labels_rndm, self.ach_tracker = ex.shuffle([images_rndm, labels_rndm, self.ach_tracker])
+						run.order, run.labels_rndm, run.stim_ids = ex.shuffle([run.order, run.labels_rndm, run.stim_ids])
 					else:
-						images_rndm, labels_rndm, self._stim_perf, idx_train, self.ach_tracker = ex.shuffle([images_rndm, labels_rndm, self._stim_perf, idx_train, self.ach_tracker])
+						shuffled = ex.shuffle([run.order, run.labels_rndm, self._stim_perf.rows, run.stim_ids] + ([run.idx_train] if run.idx_train is not None else []))
+						run.order, run.labels_rndm, self._stim_perf.rows, run.stim_ids = shuffled[:4]
+						if run.idx_train is not None: run.idx_train = shuffled[4]
 
-				#add noise to gabor filter images
+				#assign noise to gabor filter images (noise is added and images normalized when batches are fetched)
 				if self.protocol=='gabor':
-					np.random.shuffle(gaussian_noise)
-					images_rndm += gaussian_noise
-					images_rndm = ex.normalize(images_rndm, self.A)
+					run.noise_bank.new_episode(len(run.order))
 
 				#train network with mini-batches
 				correct = 0.
@@ -278,37 +324,26 @@ class Network:
 				for b in range(self._n_batches):
 					self._b = b
 					#update pdf for bayesian inference
-					self._update_pdf(images_rndm, labels_rndm)
+					self._update_pdf(run.images_src, run.labels_rndm, run.order)
 				
 					#select training images for the current batch
-					batch_images = images_rndm[b*self.batch_size:(b+1)*self.batch_size,:]
-					batch_labels = labels_rndm[b*self.batch_size:(b+1)*self.batch_size]
+					if self.protocol=='gabor':
+						batch_images = run.noise_bank.fetch(run.images_src, b*self.batch_size, (b+1)*self.batch_size, idx=run.order)
+					else:
+						batch_images = run.images_src[run.order[b*self.batch_size:(b+1)*self.batch_size],:]
+					batch_labels = run.labels_rndm[b*self.batch_size:(b+1)*self.batch_size]
 					
 					#propagate images through the network
 					greedy, explore_hid, explore_out, posterior, explorative = self._propagate(batch_images)
 					greedy_all = np.append(greedy_all, greedy)
 
-					###
-					# self.decision_tracker_greedy[self._e, b*self.batch_size:(b+1)*self.batch_size] = np.argmax(self.out_neurons_greedy,1)
-					# self.decision_tracker_explore[self._e, b*self.batch_size:(b+1)*self.batch_size] = np.argmax(self.out_neurons_explore,1)
-					# self.posterior_tracker_greedy[self._e, b*self.batch_size:(b+1)*self.batch_size, :] = np.copy(self.out_neurons_greedy)
-					# self.posterior_tracker_explore[self._e, b*self.batch_size:(b+1)*self.batch_size, :] = np.copy(self.out_neurons_explore)
-					###
-
-					#compute reward prediction
-					predicted_reward_hid = ex.reward_prediction(explorative, self.compare_output, self.classes, self.out_neurons_greedy, self.out_neurons_explore, self.dopa_func)
+					#compute reward prediction, reward, dopa value and confidence of the output posteriors in a single pass
+					predicted_reward_hid, reward_hid, dopa_rpe_hid, best_post, second_post = ex.reward_dopa(batch_labels, self.classes, greedy, explore_hid, self.out_neurons_greedy, self.out_neurons_explore, explorative, self.compare_output, self.dopa_values, self.dopa_func)
 					predicted_reward_out = ex.reward_prediction(explorative, self.compare_output, self.classes, self.out_neurons_greedy, self.out_neurons_explore_hid_out, self.dopa_func) if self._train_class_layer else None
-
-					#compute reward
-					reward_hid = ex.reward_delivery(batch_labels, explore_hid)
 					reward_out = ex.reward_delivery(batch_labels, explore_out) if self._train_class_layer else None
 
-					# self.RP_tracker = np.append(self.RP_tracker, predicted_reward_hid)
-					# self.RPE_tracker = np.append(self.RPE_tracker, reward_hid-predicted_reward_hid)
-					# self.RPE_tracker = np.append(self.RPE_tracker, reward_hid-ex.reward_prediction(explorative, self.compare_output, self.classes, self.out_neurons_greedy, self.out_neurons_explore, 'linear'))
-
 					#compute dopa signal
-					dopa_hid, dopa_out = self._dopa_release_func(predicted_reward_hid, predicted_reward_out, reward_hid, reward_out)
+					dopa_hid, dopa_out = self._dopa_release_func(predicted_reward_hid, predicted_reward_out, reward_hid, reward_out, dopa_rpe_hid)
 					if not self.dopa_release: dopa_hid = np.ones(len(batch_labels))
 
 					# pairing protocol
@@ -332,15 +367,12 @@ class Network:
 					# set_trace()
 					###
 
-					# self.dopa_tracker = np.append(self.dopa_tracker, dopa_hid)
-
 					#compute ACh signal
 					if self.ach_uncertainty:
-						sorted_post = np.sort(self.out_neurons_explore, axis=1)
 						if self.ach_BvSB:
-							stim_perf_epi = np.append(stim_perf_epi, sorted_post[:,-1]-sorted_post[:,-2])
+							stim_perf_epi = np.append(stim_perf_epi, best_post-second_post)
 						else:
-							stim_perf_epi = np.append(stim_perf_epi, sorted_post[:,-1])
+							stim_perf_epi = np.append(stim_perf_epi, best_post)
 					else:
 						stim_perf_epi = np.append(stim_perf_epi, reward_hid)
 					ach_hid = self._ach_release_func(batch_labels) if self.ach_release else np.ones(self.batch_size) ##<-----actual labels
@@ -357,55 +389,114 @@ class Network:
 						lr_hid = self.lr_hid
 						lr_out = self.lr_out
 			
-					self.hid_W = self._learning_step(batch_images, self.hid_neurons_explore, self.hid_W, lr=lr_hid, dopa=dopa_hid, ach=ach_hid)
+					self.hid_W = self._learning_step(batch_images, self.hid_neurons_explore, self.hid_W, lr=lr_hid, dopa=dopa_hid, ach=ach_hid, drift=self._W_drift if self.classifier=='bayesian' and lr_hid > 0 else None)
 					if self._train_class_layer:
 						self.out_W = self._learning_step(self.hid_neurons_greedy, self.out_neurons_explore_out, self.out_W, lr=lr_out, dopa=dopa_out)
 					#update weights of probabilistic neural classifier
 					if self.classifier=='neural_prob' and self._b%100==0:
-						self.out_W = self._learn_out_proba(images_train, labels_train)
+						self.out_W = self._learn_out_proba(run.images_train, run.labels_train, idx=run.fold_train)
 
 					#keep track of training performance
 					correct += np.sum(greedy[batch_labels!=-1]==batch_labels[batch_labels!=-1])
 					
 					#track ACh release
-					if self.ach_release and not self.save_light: self.ach_tracker[b*self.batch_size:(b+1)*self.batch_size, self._e] = ach_hid
+					if self.ach_release and not self.save_light: self.ach_tracker[run.stim_ids[b*self.batch_size:(b+1)*self.batch_size], self._e] = ach_hid
 
-					# self.activ_tracker = np.append(self.activ_tracker, self.hid_neurons_greedy, axis=0)
+					#record traces of the batch
+					if self.recorder is not None:
+						self.recorder.record(r, e, b*self.batch_size, dopa=dopa_hid, RP=predicted_reward_hid, RPE=reward_hid-predicted_reward_hid, reward=reward_hid, ach=ach_hid[:len(batch_labels)], label=batch_labels, decision_greedy=greedy, decision_explore=explore_hid, posterior_greedy=self.out_neurons_greedy, posterior_explore=self.out_neurons_explore, activ=self.hid_neurons_greedy)
 
 				#assess performance
-				self._assess_perf_progress(correct/np.sum(labels_train!=-1), images_train, labels_train, images_test, labels_test)
+				self._assess_perf_progress(correct/np.sum(run.labels_train!=-1), run.images_train, run.labels_train, run.images_test, run.labels_test, idx_train=run.fold_train, idx_test=run.fold_test)
 
 				#update tracking of performance for ach release
 				if self.ach_approx_class:
 					self._update_ach_perf_track(stim_perf_epi, greedy_all)
 				else:
-					self._update_ach_perf_track(stim_perf_epi, labels_rndm)
+					self._update_ach_perf_track(stim_perf_epi, run.labels_rndm)
 
 				#assess early stop
 				if self._assess_early_stop(): break
 
 				if (self.protocol=='toy_data' and e%50==0) and not self.pypet:
-					an.assess_toy_data(self, images_train, labels_train, os.path.join('.', 'output', self.name, 'results_'+str(e)))
+					an.assess_toy_data(self, run.images_train if run.fold_train is None else run.images_train[run.fold_train], run.labels_train, os.path.join('.', 'output', self.name, 'results_'+str(e)))
+
+			if r in self._run_states: continue
+			run.close()
 
 			#save data
 			if self.protocol=='toy_data' and self.pypet:
-				an.assess_toy_data(self, images_train, labels_train, os.path.join('.', 'output', self.pypet_name, 'results_final_'+self.name+'_run_'+str(r)))
+				an.assess_toy_data(self, run.images_train if run.fold_train is None else run.images_train[run.fold_train], run.labels_train, os.path.join('.', 'output', self.pypet_name, 'results_final_'+self.name+'_run_'+str(r)))
 			elif self.protocol=='toy_data':
-				an.assess_toy_data(self, images_train, labels_train, os.path.join('.', 'output', self.name, 'results_final_'+str(r)))
+				an.assess_toy_data(self, run.images_train if run.fold_train is None else run.images_train[run.fold_train], run.labels_train, os.path.join('.', 'output', self.name, 'results_final_'+str(r)))
 			self.hid_W_trained[r,:,:] = np.copy(self.hid_W)
 			self.out_W_trained[r,:,:] = np.copy(self.out_W)
-			self.stim_perf_saved[r,:,:] = np.copy(self._stim_perf)
-			if 'labels_rndm' in locals() and not self.save_light: self.stim_perf_labels_saved[r,:] = np.copy(labels_rndm)
-			if (not self.save_light or self.ach_release) and self.shuffle_datasets: self._idx_shuffle_saved[r,:] = np.concatenate((idx_train, idx_test))
-			self.test(images_test, labels_test, end_of_run=True)
+			self.stim_perf_saved[r,:,:] = self._stim_perf.as_array()
+			if not self.save_light: self.stim_perf_labels_saved[r,:] = np.copy(run.labels_rndm)
+			if (not self.save_light or self.ach_release) and self.shuffle_datasets: self._idx_shuffle_saved[r,:] = np.concatenate((run.idx_train, run.idx_test))
+			self.test(run.images_test, run.labels_test, end_of_run=True, idx=run.fold_test)
+			self._runs_done.append(r)
 			if not self.pypet: ex.save_net(self)
 
+		#keep the statistics of the images set up by the last run, to initialize the next run if it is trained by a later call
+		if prev_r is not None and prev_r+1 < self.n_runs and prev_r+1 not in self._runs_done and self.weight_init == 'input':
+			self._run_states.setdefault(prev_r+1, _Run(prev_r+1)).init_stats = ex.input_statistics(images_init)
+
+		if self.recorder is not None: self.recorder.flush()
 		self._train_stop = time.time()
-		self.runtime = self._train_stop - self._train_start
+		self.runtime = (self.runtime if resume else 0.) + self._train_stop - self._train_start
 
 		# set_trace()
 
-	def test(self, images, labels, during_training=False, end_of_run=False):
+	def _set_up_run(self, run, images_dict, labels_dict, images_init, stats=None, cv_folds=None):
+		""" 
+		Sets up a training run: seeds the random number generator, initializes the weights and prepares the datasets and the image order of the first episode of the run. A paused run is set up again identically when it is resumed, to recreate its datasets
+
+			Args:
+				run (_Run): run to set up
+				images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+				labels_dict (dict): dictionary of label arrays of the images
+				images_init (numpy array): images whose statistics initialize the weights (see _init_weights)
+				stats (tuple, optional): mean and variance of each pixel, replaces the statistics of images_init. Default: None
+				cv_folds (list, optional): disjoint folds of the training set, one per run, for cross-validation (see ex.cross_validation_folds). Default: None
+		"""
+		r = run.r
+		np.random.seed(self.seed+r)
+		run.images_train, run.images_test, run.images_task = images_dict['train'], images_dict['test'], images_dict['task']
+		run.labels_train, run.labels_test, run.labels_task = labels_dict['train'], labels_dict['test'], labels_dict['task']
+		run.fold_train, run.fold_test = None, None
+		run.idx_train, run.idx_test = None, None
+		run.noise_bank, run.trainset_producer = None, None
+		if cv_folds is not None and not (self.protocol=='digit' and self.shuffle_datasets and self.images_params['labels_subs']==1):
+			run.fold_train, run.fold_test = cv_folds[r]
+		self._init_weights(images_init, idx=run.fold_train, stats=stats if run.fold_train is None else None) #with cross-validation folds, images_init is the training set and the statistics are those of the run's fold
+		self._W_drift = np.zeros(self.n_hid_neurons)
+		if self.protocol=='digit' and self.shuffle_datasets and self.images_params['labels_subs']==1: #shuffle train and test datasets for each independent run
+			run.images_train, run.images_test, run.labels_train, run.labels_test, run.idx_train, run.idx_test = ex.shuffle_datasets(images_dict, labels_dict, self._idx_shuffle)
+		elif cv_folds is not None: #train and validate on index arrays into the training set, without copying images
+			run.images_test = images_dict['train']
+			run.labels_train, run.labels_test = labels_dict['train'][run.fold_train], labels_dict['train'][run.fold_test]
+			self.n_images = len(run.fold_train)
+			self._n_batches = int(np.ceil(float(self.n_images)/self.batch_size))
+		elif self.protocol=='gabor':
+			if r != 0: #reload new training gabor filter
+				images_dict_new, labels_dict_new, _, _ = ex.load_images(self.protocol, self.A, self.verbose, gabor_params=self.images_params)
+				run.images_train, run.images_task = images_dict_new['train'], images_dict_new['task']
+				run.labels_train, run.labels_task = labels_dict_new['train'], labels_dict_new['task']
+			run.noise_bank = gr.NoiseBank(self.n_inp_neurons, self.images_params['noise_pixel'], self.A, n_bank=self.images_params.get('noise_bank', len(run.images_train)), seed=[self.seed, r])
+			if self.images_params['renew_trainset']: #prepare new training images of the first episode after the critical period in the background
+				run.trainset_producer = gr.TrainsetProducer(self.images_params, seed=[self.seed, r], prefetch=self.images_params.get('prefetch_trainset', True))
+				run.trainset_producer.request(self.n_epi_crit)
+		elif self.protocol=='toy_data' and not self.pypet:
+			run.images_train, run.images_test, run.labels_train, run.labels_test, run.idx_train, run.idx_test = ex.shuffle_datasets(images_dict, labels_dict, self._idx_shuffle)
+			an.assess_toy_data(self, run.images_train, run.labels_train, os.path.join('.', 'output', self.name, 'result_init'))
+
+		#images of an episode are images_src[order]; only the order is shuffled, images are gathered batch by batch
+		run.images_src, run.labels_rndm = run.images_train, run.labels_train
+		run.order = np.arange(len(run.labels_train)) if run.fold_train is None else run.fold_train
+		run.stim_ids = np.arange(len(run.order)) #position of the episode's images in the training set, for tracking
+
+	def test(self, images, labels, during_training=False, end_of_run=False, idx=None):
 		""" 
 		Test Hebbian convolutional neural network
 
@@ -414,18 +505,11 @@ class Network:
 				labels (numpy array): corresponding labels of the images.
 				during_training (bool, optional): whether testing error is assessed during training of the network (is True, less information is computed)
 				end_of_run (bool, optional): whether this is the last testing of a run (if True, perf results are saved)
+				idx (numpy array, optional): indices of the images to test on, in the order of the labels (e.g. a validation fold); all images if None
 
 			returns:
 				(dict): confusion matrix and performance of the network for all runs
 		"""
-		#add noise to gabor filter images
-		if self.protocol=='gabor':
-			if self.images_params['noise_pixel']>0.0:
-				images += np.random.normal(0.0, self.images_params['noise_pixel'], size=np.shape(images)) #add Gaussian noise
-				# if self.classifier=='bayesian':
-				# 	images_train += np.random.normal(0.0, self.images_params['noise_pixel'], size=np.shape(images_train)) #add Gaussian noise
-			images = ex.normalize(images, self.A)
-
 		if self.verbose and not during_training: print "\ntesting network..."
 
 		""" variable initialization """
@@ -433,42 +517,29 @@ class Network:
 		if not during_training and not end_of_run: 
 			CM_all=np.zeros((self.n_runs, self.n_classes, self.n_classes))
 			perf_all=np.zeros(self.n_runs)
+		if during_training or end_of_run:
+			W_all = [(self.hid_W, self.out_W)]
+		else:
+			W_all = [(self.hid_W_trained[iw,:,:], self.out_W_trained[iw,:,:]) for iw in range(n_runs)]
 
-		for iw in range(n_runs):
-			if during_training or end_of_run:
-				hid_W = np.copy(self.hid_W)
-				out_W = np.copy(self.out_W)
+		""" testing of the classifier, chunk by chunk; noise is added to gabor filter images and images normalized as they are fetched """
+		if self.protocol=='gabor':
+			noise_bank = gr.NoiseBank(np.size(images,1), self.images_params['noise_pixel'], self.A, rng=np.random)
+		chunk_size = 10000
+		classResults_all = np.empty((n_runs, len(labels)), dtype=self.classes.dtype)
+		for start in range(0, len(labels), chunk_size):
+			if self.protocol=='gabor':
+				chunk_images = noise_bank.fetch(images, start, start+chunk_size, idx=idx)
+			elif idx is not None:
+				chunk_images = images[idx[start:start+chunk_size]]
 			else:
-				if self.verbose: print 'run: ' + str(iw+1)
-				hid_W = self.hid_W_trained[iw,:,:]
-				out_W = self.out_W_trained[iw,:,:]
-
-			""" testing of the classifier """
-			if self.classifier=='neural_dopa':
-				hidNeurons = ex.propagate_layerwise(images, hid_W, SM=False, log_weights=self.log_weights) 
-				# hidNeurons += np.random.normal(0, self.noise_activ, np.shape(hidNeurons))## corruptive noise
-				hidNeurons = ex.softmax(hidNeurons, t=self.t_hid)
-
-				actNeurons = ex.propagate_layerwise(hidNeurons, out_W, log_weights=self.log_weights)
-				classIdx = np.argmax(actNeurons, 1)
-				classResults = self.classes[classIdx]
-			elif self.classifier=='neural_prob':
-				hidNeurons = ex.propagate_layerwise(images, hid_W, SM=False, log_weights=self.log_weights) 
-				# hidNeurons += np.random.normal(0, self.noise_activ, np.shape(hidNeurons))## corruptive noise
-				hidNeurons = ex.softmax(hidNeurons, t=self.t_hid)
-
-				out_W_normed = out_W/np.sum(out_W, 1)[:,np.newaxis]
-				actNeurons = np.einsum('ij,jk', hidNeurons, out_W_normed)
-				# actNeurons = np.dot(hidNeurons, out_W_normed)
-				classIdx = np.argmax(actNeurons, 1)
-				classResults = self.classes[classIdx]
-			elif self.classifier=='bayesian':
-				raise NotImplementedError('bayesian classifier not implemented')
-				# pdf_marginals, pdf_evidence, pdf_labels = bc.pdf_estimate(images_train, labels_train, hid_W, self.pdf_method, self.t_hid)
-				# hidNeurons = ex.propagate_layerwise(images, hid_W, t=self.t_hid, log_weights=self.log_weights)
-				# posterior = bc.bayesian_decoder(hidNeurons, pdf_marginals, pdf_evidence, pdf_labels, self.pdf_method)
-				# classIdx = np.argmax(posterior, 1)
-				# classResults = self.classes[classIdx]
+				chunk_images = images[start:start+chunk_size]
+			for iw in range(n_runs):
+				classResults_all[iw, start:start+chunk_size] = self._classify(chunk_images, W_all[iw][0], W_all[iw][1])
+
+		for iw in range(n_runs):
+			if not during_training and not end_of_run and self.verbose: print 'run: ' + str(iw+1)
+			classResults = classResults_all[iw]
 			correct_classif = float(np.sum(classResults==labels))/len(labels)
 			
 			""" compute classification matrix """
@@ -494,8 +565,35 @@ class Network:
 		elif not during_training and not end_of_run: 
 			return CM_all, perf_all
 		
-	def _init_weights(self, images=None):
-		""" initialize weights of the network, either by loading saved weights from file or by random initialization """
+	def _classify(self, images, hid_W, out_W):
+		""" returns the class assigned by the classifier to each of the images """
+		if self.classifier=='neural_dopa':
+			hidNeurons = ex.propagate_layerwise(images, hid_W, SM=False, log_weights=self.log_weights) 
+			# hidNeurons += np.random.normal(0, self.noise_activ, np.shape(hidNeurons))## corruptive noise
+			hidNeurons = ex.softmax(hidNeurons, t=self.t_hid)
+
+			actNeurons = ex.propagate_layerwise(hidNeurons, out_W, log_weights=self.log_weights)
+			classIdx = np.argmax(actNeurons, 1)
+		elif self.classifier=='neural_prob':
+			hidNeurons = ex.propagate_layerwise(images, hid_W, SM=False, log_weights=self.log_weights) 
+			# hidNeurons += np.random.normal(0, self.noise_activ, np.shape(hidNeurons))## corruptive noise
+			hidNeurons = ex.softmax(hidNeurons, t=self.t_hid)
+
+			out_W_normed = out_W/np.sum(out_W, 1)[:,np.newaxis]
+			actNeurons = np.einsum('ij,jk', hidNeurons, out_W_normed)
+			# actNeurons = np.dot(hidNeurons, out_W_normed)
+			classIdx = np.argmax(actNeurons, 1)
+		elif self.classifier=='bayesian': #uses the pdf last estimated during training (see _update_pdf), re-fitted to the sample of training images if it was not kept (e.g. by a loaded Network)
+			if not hasattr(self, '_pdf_marginals'): self._fit_pdf()
+			hidNeurons = ex.propagate_layerwise(images, hid_W, SM=False, log_weights=self.log_weights)
+			hidNeurons = ex.softmax(hidNeurons, t=self.t_hid)
+			posterior = bc.bayesian_decoder(hidNeurons, self._pdf_marginals, self._pdf_evidence, self._pdf_labels, self.pdf_method)
+			classIdx = np.argmax(posterior, 1)
+
+		return self.classes[classIdx]
+
+	def _init_weights(self, images=None, idx=None, stats=None):
+		""" initialize weights of the network, either by loading saved weights from file or by random initialization; idx selects the images used for input statistics, stats (mean and variance of each pixel) replaces the statistics of images """
 		if self.init_file == 'NO_INIT':
 			pass
 		if self.init_file != '' and self.init_file != None:
@@ -503,46 +601,40 @@ class Network:
 		elif self.weight_init == 'random':
 			self._init_weights_random()
 		elif self.weight_init == 'input' and images is not None:
-			self._init_weights_input(images)
+			self._init_weights_input(images, idx, stats)
 		elif self.weight_init == 'naive':
 			self._init_weights_file()
 		else:
 			raise ValueError ('wrong weitgh initialization method: %s' % self.weight_init)
 
 	def _init_weights_file(self):
-		""" initialize weights of the network by loading saved weights from file """
-		if not os.path.exists(os.path.join('output', self.init_file)):
-			raise IOError, "weight file \'%s\' not found" % self.init_file
-		f_net = open(os.path.join('output', self.init_file, 'Network'), 'r')
-		saved_net = pickle.load(f_net)
+		""" initialize weights of the network by loading saved weights from file; only the arrays of the run to load are read (see ex.load_init_run) """
+		init_run = ex.load_init_run(self.init_file, self._r)
 
 		#randomly choose weights from one of the saved runs
-		run_to_load = self._r % saved_net.n_runs 
 		if self.weight_init=='naive':
-			saved_hid_W = saved_net.hid_W_naive[run_to_load, :, :] # saved_net.hid_W_trained[run_to_load, :, :]
-			saved_out_W = saved_net.out_W_naive[run_to_load, :, :] # saved_net.out_W_trained[run_to_load, :, :]
+			saved_hid_W = init_run['hid_W_naive'] # init_run['hid_W_trained']
+			saved_out_W = init_run['out_W_naive'] # init_run['out_W_trained']
 		else:
-			saved_hid_W = saved_net.hid_W_trained[run_to_load, :, :]
-			saved_out_W = saved_net.out_W_trained[run_to_load, :, :]
+			saved_hid_W = init_run['hid_W_trained']
+			saved_out_W = init_run['out_W_trained']
 
 		if (self.n_inp_neurons, self.n_hid_neurons) != np.shape(saved_hid_W):
 			raise ValueError, "Hidden weights loaded from file are not of the same shape as those of the current network"
 		if (self.n_hid_neurons, self.n_out_neurons) != np.shape(saved_out_W):
 			raise ValueError, "Output weights loaded from file are not of the same shape as those of the current network"
 
-		self.hid_W = np.copy(saved_hid_W)
-		self.out_W = np.copy(saved_out_W)
-		if not self.save_light: self._idx_shuffle = np.copy(saved_net._idx_shuffle_saved[run_to_load, :]).astype(int)
-		if saved_net.stim_perf_saved[run_to_load, :, :].shape != self._saved_perf_size:
+		self.hid_W = saved_hid_W
+		self.out_W = saved_out_W
+		if not self.save_light: self._idx_shuffle = init_run['_idx_shuffle_saved'].astype(int)
+		if init_run['stim_perf_saved'].shape != self._saved_perf_size:
 			warnings.warn('loaded stim_perf_saved not the same size as current network\'s; empty initialization', UserWarning)
-			self._stim_perf = np.ones(self._saved_perf_size)*np.nan
-			min_size = np.min([saved_net.stim_perf_saved.shape[-1], self._saved_perf_size[-1]])
-			self._stim_perf[:, :min_size] = np.copy(saved_net.stim_perf_saved[run_to_load, :, :min_size])
+			stim_perf = np.ones(self._saved_perf_size)*np.nan
+			min_size = np.min([init_run['stim_perf_saved'].shape[-1], self._saved_perf_size[-1]])
+			stim_perf[:, :min_size] = init_run['stim_perf_saved'][:, :min_size]
 		else:
-			self._stim_perf = np.copy(saved_net.stim_perf_saved[run_to_load, :, :])
-		self._stim_perf_weights = (np.arange(self.ach_avg, dtype=float)+1)[::-1]
-		self._stim_perf_avg = ex.weighted_sum(self._stim_perf, self._stim_perf_weights)
-		f_net.close()
+			stim_perf = init_run['stim_perf_saved']
+		self._stim_perf = ex.PerfTracker.from_array(stim_perf, self._stim_perf_range)
 
 	def _init_weights_random(self):
 		""" initialize weights of the network randomly or by loading saved weights from file """
@@ -560,35 +652,22 @@ class Network:
 		# self.out_W *= 1./np.sum(self.out_W,0) * 2.0
 		###
 	
-		self._stim_perf = np.ones(self._saved_perf_size)*np.nan
-		self._stim_perf_weights = (np.arange(self._saved_perf_size[1], dtype=float)+1)[::-1]
-		self._stim_perf_avg = np.ones(self._saved_perf_size[0])
+		self._stim_perf = ex.PerfTracker(self._saved_perf_size[0], self._saved_perf_size[1], self._stim_perf_range)
 
-	def _init_weights_input(self, images):
+	def _init_weights_input(self, images, idx=None, stats=None):
 		""" initialize weights by using the input statistics """
 
-		m_d = np.zeros_like(images[0])
-		for i in xrange(images.shape[0]):
-			m_d += images[i]
-		m_d /= images.shape[0]
-    
-		v_d = np.zeros_like(images[0])
-		for i in xrange(images.shape[0]):
-			v_d += (images[i] - m_d) ** 2
-		v_d /= images.shape[0]
+		m_d, v_d = ex.input_statistics(images, idx=idx) if stats is None else stats
 
-		self.hid_W = np.zeros(shape=(self.n_inp_neurons, self.n_hid_neurons), dtype=float)
-		for i in xrange(self.n_hid_neurons):
-			self.hid_W[:,i] = m_d + 2.*v_d*np.random.random_sample(self.n_inp_neurons)
+		#column i of hid_W is drawn from the i-th row of random samples
+		self.hid_W = np.ascontiguousarray(m_d[:,np.newaxis] + 2.*v_d[:,np.newaxis]*np.random.random_sample(size=(self.n_hid_neurons, self.n_inp_neurons)).T)
 
 		self.out_W = (np.random.random_sample(size=(self.n_hid_neurons, self.n_out_neurons))/1000+1.0)/self.n_hid_neurons
 
 		# self.out_W = np.random.random_sample(size=(self.n_hid_neurons, self.n_out_neurons))
 		# self.out_W *= 1./np.sum(self.out_W,0) * 2.0
 
-		self._stim_perf = np.ones(self._saved_perf_size)*np.nan
-		self._stim_perf_weights = (np.arange(self._saved_perf_size[1], dtype=float)+1)[::-1]
-		self._stim_perf_avg = np.ones(self._saved_perf_size[0])
+		self._stim_perf = ex.PerfTracker(self._saved_perf_size[0], self._saved_perf_size[1], self._stim_perf_range)
 
 	def _check_parameters(self):
 		""" checks if parameters of the Network object are correct """
@@ -598,16 +677,52 @@ class Network:
 			raise ValueError( '\'' + self.classifier +  '\' not a legal classifier value. Legal values are: \'neural_dopa\', \'neural_prob\' and \'bayesian\'.')
 		if self.protocol not in ['digit', 'gabor', 'toy_data']:
 			raise ValueError( '\'' + self.protocol +  '\' not a legal protocol value. Legal values are: \'digit\' and \'gabor\'.')
-		if self.pdf_method not in ['fit', 'subsample', 'full']:
-			raise ValueError( '\'' + self.pdf_method +  '\' not a legal pdf_method value. Legal values are: \'fit\', \'subsample\' and \'full\'.')
+		if self.pdf_method not in ['fit', 'subsample', 'full', 'gaussian']:
+			raise ValueError( '\'' + self.pdf_method +  '\' not a legal pdf_method value. Legal values are: \'fit\', \'subsample\', \'full\' and \'gaussian\'.')
+		if self.RF_probing not in ['dense', 'adaptive']:
+			raise ValueError( '\'' + self.RF_probing +  '\' not a legal RF_probing value. Legal values are: \'dense\' and \'adaptive\'.')
 
-	def _update_pdf(self, images_rndm, labels_rndm, threshold=0.01):
-		""" re-compute the pdf for bayesian inference if any weights have changed more than a threshold """
-		if self.classifier=='bayesian' and (self._e >= self.n_epi_crit + self.n_epi_fine or self.test_each_epi):
-			W_mschange = np.sum((self._W_in_since_update - self.hid_W)**2, 0)
-			if (W_mschange/940 > threshold).any() or (self._e==0 and self._b==0):
-				self._W_in_since_update = np.copy(self.hid_W)
-				self._pdf_marginals, self._pdf_evidence, self._pdf_labels = bc.pdf_estimate(images_rndm, labels_rndm, self.hid_W, self.pdf_method, self.t_hid)
+	def _update_pdf(self, images, labels, idx=None, threshold=0.01, n_pdf_images=1000):
+		""" 
+		Re-computes the pdf for bayesian inference from a sample of the training images, after the critical period (or after each episode if the Network is tested after each episode). The sample is drawn at the start of each episode; within an episode, the activation of the hidden neurons whose weights may have changed more than a threshold since the last update is recomputed and the pdf re-fitted (see _fit_pdf)
+
+			Args:
+				images (numpy array): training images (not normalized for gabor filters)
+				labels (numpy array): labels of the images
+				idx (numpy array, optional): indices of the images in the order of the labels; all images if None. Default: None
+				threshold (float, optional): squared change of the weights of a hidden neuron, per input neuron, above which its activation is recomputed. Default: 0.01
+				n_pdf_images (int, optional): number of images in the sample ('full' pdf_method: all images). Default: 1000
+		"""
+		if self.classifier!='bayesian': return
+		if self._b==0 or not hasattr(self, '_pdf_images'): #new sample of images
+			labelled = np.argwhere(labels!=-1)[:,0]
+			rng = np.random.RandomState(None if self.seed is None else [self.seed, self._r, self._e]) #does not affect the random numbers of training
+			sample = labelled if self.pdf_method=='full' else rng.choice(labelled, size=min(n_pdf_images, len(labelled)), replace=False)
+			self._pdf_images = images[sample] if idx is None else images[idx[sample]]
+			if self.protocol=='gabor': self._pdf_images = ex.normalize(self._pdf_images, self.A)
+			self._pdf_images_labels = labels[sample]
+			self._pdf_hid_activ = None
+		if self._e >= self.n_epi_crit + self.n_epi_fine or self.test_each_epi:
+			self._fit_pdf(threshold)
+
+	def _fit_pdf(self, threshold=None):
+		"""
+		Fits the pdf for bayesian inference to the activation of the hidden neurons for the sample of training images drawn by _update_pdf. Once computed for a sample, only the activation of the hidden neurons whose weights may have changed more than threshold is recomputed; the change of the weights of a neuron is bounded by the sum of the norms of its learning steps, accumulated by _learning_step in self._W_drift. The 'gaussian' pdf_method is re-fitted in closed form from the activation; the other methods re-fit their kernel density estimates on every change
+
+			Args:
+				threshold (float, optional): squared change of the weights of a hidden neuron, per input neuron, above which its activation is recomputed; recomputed for all neurons if None. Default: None
+		"""
+		if not hasattr(self, '_pdf_images'):
+			raise RuntimeError('no sample of training images to estimate the pdf of the bayesian classifier; the Network must be trained first')
+		if threshold is None or getattr(self, '_pdf_hid_activ', None) is None:
+			self._pdf_hid_activ = ex.propagate_layerwise(self._pdf_images, self.hid_W, SM=False, log_weights=self.log_weights)
+			self._W_drift = np.zeros(self.n_hid_neurons)
+		else:
+			changed = self._W_drift**2/self.n_inp_neurons > threshold
+			if not changed.any(): return
+			self._pdf_hid_activ[:, changed] = ex.propagate_layerwise(self._pdf_images, self.hid_W[:, changed], SM=False, log_weights=self.log_weights)
+			self._W_drift[changed] = 0.
+		self._pdf_marginals, self._pdf_evidence, self._pdf_labels = bc.pdf_estimate(None, self._pdf_images_labels, None, self.pdf_method, self.t_hid, activ=ex.softmax(self._pdf_hid_activ, t=self.t_hid))
 
 	def _propagate(self, batch_images):
 		""" propagate input images through the network, either with a layer of neurons on top or with a bayesian decoder """
@@ -701,10 +816,13 @@ class Network:
 
 		return greedy, explore, None, None, self.batch_explorative
 
-	def _learn_out_proba(self, images, labels):
-		""" learn output weights """
+	def _learn_out_proba(self, images, labels, idx=None, chunk_size=10000):
+		""" learn output weights; idx are the indices of the images in the order of the labels (all images if None) """
 
-		hid_activ = ex.propagate_layerwise(images, self.hid_W, SM=True, t=self.t_hid, log_weights=self.log_weights)
+		hid_activ = np.empty((len(labels), self.n_hid_neurons))
+		for start in range(0, len(labels), chunk_size):
+			chunk_images = images[start:start+chunk_size] if idx is None else images[idx[start:start+chunk_size]]
+			hid_activ[start:start+chunk_size] = ex.propagate_layerwise(chunk_images, self.hid_W, SM=True, t=self.t_hid, log_weights=self.log_weights)
 		for ic, c in enumerate(self.classes):
 			self.out_W[:,ic] = np.mean(hid_activ[labels==c,:],0)
 
@@ -712,41 +830,38 @@ class Network:
 
 	def _propagate_bayesian(self, batch_images):
 		""" propagate input images through the network with a bayesian decoder on top """
-		raise NotImplementedError('bayesian method out of date since compare_output')
-		# #reset activity (important for cases in which no noise is added)
-		# self.hid_neurons_greedy = None
-		# self.hid_neurons_explore = None
+		self.hid_neurons_explore = None
 
-		# #compute activation of hidden neurons
-		# hid_activ = ex.propagate_layerwise(batch_images, self.hid_W, SM=False, log_weights=self.log_weights)
-		
-		# #add noise to activation of hidden neurons (exploration)
-		# if self.exploration and self._e >= self.n_epi_crit + self.n_epi_fine:
-		# 	self.hid_neurons_explore = hid_activ + np.random.normal(0, np.std(hid_activ)*self.noise_xplr_hid, np.shape(hid_activ))
-		# 	self.hid_neurons_explore = ex.softmax(self.hid_neurons_explore, t=self.t_hid)
+		#determine which trial will be explorative (e-greedy)
+		self.batch_explorative = ex.exploration(self.epsilon_xplr, batch_images.shape[0])
 
-		# #softmax hidden neurons
-		# self.hid_neurons_greedy = ex.softmax(hid_activ, t=self.t_hid)
-		
-		# #set activation values for neurons when no exploration
-		# if self.hid_neurons_explore is None: self.hid_neurons_explore = np.copy(self.hid_neurons_greedy)
+		#compute activation of hidden neurons
+		hid_activ = ex.propagate_layerwise(batch_images, self.hid_W, SM=False, log_weights=self.log_weights)
+		hid_activ_std = np.std(hid_activ)
 
-		# #compute posteriors of the bayesian decoder in greedy and explorative cases
-		# if self._e >= self.n_epi_crit + self.n_epi_fine:
-		# 	posterior_greedy = bc.bayesian_decoder(self.hid_neurons_greedy, self._pdf_marginals, self._pdf_evidence, self._pdf_labels, self.pdf_method)
-		# 	greedy = self.classes[np.argmax(posterior_greedy,1)]
-			
-		# 	posterior_explore = bc.bayesian_decoder(self.hid_neurons_explore, self._pdf_marginals, self._pdf_evidence, self._pdf_labels, self.pdf_method)
-		# 	explore = self.classes[np.argmax(posterior_explore,1)]
-		# else:
-		# 	posterior_greedy = None
-		# 	greedy = None
-		# 	explore = None		
+		#add noise to activation of hidden neurons for exploration
+		if self.exploration and self._e >= self.n_epi_crit + self.n_epi_fine and self._e < self.n_epi_crit + self.n_epi_fine + self.n_epi_perc and self.dopa_release:
+			self.hid_neurons_explore = hid_activ + np.random.normal(0, hid_activ_std*self.noise_xplr_hid, np.shape(hid_activ))*self.batch_explorative[:,np.newaxis]
+			self.hid_neurons_explore = ex.softmax(self.hid_neurons_explore, t=self.t_hid)
 
-		# return greedy, explore, None, posterior_greedy
+		#softmax and normalize hidden neurons
+		self.hid_neurons_greedy = ex.softmax(hid_activ, t=self.t_hid)
+
+		if self.hid_neurons_explore is None: self.hid_neurons_explore = np.copy(self.hid_neurons_greedy)
 
-	def _dopa_release_func(self, predicted_reward_hid, predicted_reward_out, reward_hid, reward_out):
-		""" compute dopa release based on predicted and delivered reward """
+		#compute posteriors of the bayesian decoder in greedy and explorative cases
+		if not hasattr(self, '_pdf_marginals'): self._fit_pdf()
+		self.out_neurons_greedy = bc.bayesian_decoder(self.hid_neurons_greedy, self._pdf_marginals, self._pdf_evidence, self._pdf_labels, self.pdf_method)
+		self.out_neurons_explore = bc.bayesian_decoder(self.hid_neurons_explore, self._pdf_marginals, self._pdf_evidence, self._pdf_labels, self.pdf_method)
+
+		#set return variables
+		greedy = self.classes[np.argmax(self.out_neurons_greedy,1)]
+		explore = self.classes[np.argmax(self.out_neurons_explore,1)]
+
+		return greedy, explore, None, self.out_neurons_greedy, self.batch_explorative
+
+	def _dopa_release_func(self, predicted_reward_hid, predicted_reward_out, reward_hid, reward_out, dopa_rpe_hid=None):
+		""" compute dopa release based on predicted and delivered reward; dopa_rpe_hid is the dopa value of the hidden layer if already computed (see ex.reward_dopa) """
 		if (self._e < self.n_epi_crit + self.n_epi_fine or self._e >= self.n_epi_crit + self.n_epi_fine + self.n_epi_perc) and self._train_class_layer:
 			""" Critical and Post period """
 			dopa_hid = np.ones(len(reward_hid))
@@ -754,7 +869,7 @@ class Network:
 	
 		elif self._e >= self.n_epi_crit + self.n_epi_fine and self._e < self.n_epi_crit + self.n_epi_fine + self.n_epi_perc: 
 			""" Perceptual learning period """
-			dopa_hid = ex.compute_dopa(predicted_reward_hid, reward_hid, self.dopa_values, self.dopa_func)
+			dopa_hid = dopa_rpe_hid if dopa_rpe_hid is not None else ex.compute_dopa(predicted_reward_hid, reward_hid, self.dopa_values, self.dopa_func)
 			## add parallel out training here
 			dopa_out = np.zeros(len(reward_hid))
 		else:
@@ -768,9 +883,7 @@ class Network:
 		if self._e >= self.n_epi_crit + self.n_epi_fine and self._e < self.n_epi_crit + self.n_epi_fine + self.n_epi_perc and self.ach_release: #ACh starts at perc
 		# if self.ach_release: #ACh starts at crit
 			if hasattr(self, 'ach_stim') and (self.ach_stim and self.ach_uncertainty):
-				self._stim_perf_avg = 0.80 ##np.nanmean(self._stim_perf) ##<--------set mean perf; only to speed-up computations
-			else:
-				self._stim_perf_avg = ex.weighted_sum(self._stim_perf, self._stim_perf_weights)
+				self._stim_perf_avg = self._stim_perf.mean_all()
 
 			if self.ach_func=='preset': #uses preset values (only valid of 1-4-9)
 				ach = np.ones_like(labels, dtype=float)
@@ -788,13 +901,14 @@ class Network:
 			else:
 				if self.ach_stim: #average over stimuli
 					if self.ach_uncertainty: #uses uncertainty of current stimulus
-						rel_perf = np.nanmean(self._stim_perf[self._b*self.batch_size:(self._b+1)*self.batch_size, :],1)/self._stim_perf_avg ##averaged over 20 episodes
+						rel_perf = self._stim_perf.mean(slice(self._b*self.batch_size, (self._b+1)*self.batch_size))/self._stim_perf_avg ##averaged over 20 episodes
 						# rel_perf = np.max(self.out_neurons_explore, axis=1)/self._stim_perf_avg ##single stimuli
 					else:
-						perf_avg = self._stim_perf_avg[self._b*self.batch_size:(self._b+1)*self.batch_size]
-						rel_perf = perf_avg/np.mean(self._stim_perf_avg)
+						perf_avg = self._stim_perf.weighted_avg(slice(self._b*self.batch_size, (self._b+1)*self.batch_size))
+						rel_perf = perf_avg/self._stim_perf.mean_weighted_avg()
 				else: #average over classes
-					rel_perf_classes = self._stim_perf_avg/np.mean(self._stim_perf_avg)
+					stim_perf_avg = self._stim_perf.weighted_avg()
+					rel_perf_classes = stim_perf_avg/np.mean(stim_perf_avg)
 					rel_perf = rel_perf_classes[self._labels2idx[labels]]
 				ach = self.ach_func(rel_perf, **self.ach_values)
 
@@ -804,18 +918,16 @@ class Network:
 
 	def _update_ach_perf_track(self, stim_perf_epi, labels):
 		""" updates the tracking of performance for ACh release """
-		self._stim_perf = np.roll(self._stim_perf, 1, axis=1)
 		#average over stimuli
 		if self._saved_perf_size[0]==self.n_images: 
-			self._stim_perf[:,0] = stim_perf_epi
+			self._stim_perf.push(stim_perf_epi)
 		#average over classes
 		elif self._saved_perf_size[0]==self.n_classes: 
-			for c in range(self.n_classes):
-				self._stim_perf[c,0] = np.mean(stim_perf_epi[labels==self.classes[c]])
+			self._stim_perf.push([np.mean(stim_perf_epi[labels==self.classes[c]]) for c in range(self.n_classes)])
 		else:
 			raise ValueError('save performance matrix of wrong shape')
 
-	def _learning_step(self, pre_neurons, post_neurons, W, lr, dopa=None, ach=None, numba=True):
+	def _learning_step(self, pre_neurons, post_neurons, W, lr, dopa=None, ach=None, drift=None, numba=True):
 		"""
 		One learning step for the hebbian network
 
@@ -825,6 +937,7 @@ class Network:
 			W (numpy array): weight matrix
 			lr (float): learning rate
 			dopa (numpy array, optional): learning rate increase for the effect of acetylcholine and dopamine
+			drift (numpy array, optional): running sum of the norms of the weight changes of each post-synaptic neuron, updated in place. Default: None
 
 		returns:
 			numpy array: change in weight; must be added to the weight matrix W
@@ -848,6 +961,7 @@ class Network:
 			mask = np.ones(np.size(W,1), dtype=bool)
 
 		W[:,mask] += dW[:,mask]
+		if drift is not None: drift += np.sqrt(np.einsum('ij,ij->j', dW, dW))*mask
 		# W = np.clip(W, 1e-10, np.inf) ##no clipping
 		
 		return W
@@ -913,12 +1027,12 @@ class Network:
 						return True
 		return False
 
-	def _assess_perf_progress(self, perf_train, images_train, labels_train, images_test, labels_test):
-		""" assesses progression of performance of network as it is being trained """
+	def _assess_perf_progress(self, perf_train, images_train, labels_train, images_test, labels_test, idx_train=None, idx_test=None):
+		""" assesses progression of performance of network as it is being trained; idx_train and idx_test are the indices of the images in the order of the labels (all images if None) """
 		
 		print_perf = 'epi ' + str(self._e) + ': '
 		if self.test_each_epi and self._train_class_layer: ##remove neural_prob... 
-			correct_out_W = self._check_out_W(images_train, labels_train)
+			correct_out_W = self._check_out_W(images_train if idx_train is None else images_train[idx_train], labels_train)
 			print_perf += 'correct out weights: %d/%d ; ' %(correct_out_W, self.n_hid_neurons)
 		if self.test_each_epi and False: ## remove bool flag to measure likelihood at each episode
 			log_likelihood = self._assess_loglikelihood(images_train[::1,:], labels_train[::1]) ##<--
@@ -929,7 +1043,7 @@ class Network:
 		else:
 			print_perf += 'train performance: ' + '-N/A-'
 		if self.test_each_epi:
-			perf_test = self.test(images_test, labels_test, during_training=True)
+			perf_test = self.test(images_test, labels_test, during_training=True, idx=idx_test)
 			print_perf += ' ; test performance: %.2f%%' %(perf_test*100)
 			self.perf_test_prog[self._r, self._e] = perf_test
 		if self.verbose: print print_perf
@@ -980,7 +1094,7 @@ class Network:
 			if self.protocol=='digit':
 				RFproba = an.hist(self, images, labels, verbose=False)['RFproba']
 			elif self.protocol=='gabor':
-				_, pref_ori = gr.tuning_curves(self.hid_W[np.newaxis,:,:], self.t_hid, self.A, self.images_params, self.name, curve_method='no_softmax', plot=False, log_weights=self.log_weights)
+				_, pref_ori = gr.tuning_curves(self.hid_W[np.newaxis,:,:], self.t_hid, self.A, self.images_params, self.name, curve_method='no_softmax', plot=False, log_weights=self.log_weights, probing=self.RF_probing)
 				RFproba = np.zeros((1, self.n_hid_neurons, self.n_out_neurons), dtype=int)
 				RFproba[0,:,:][pref_ori[0,:] <= 0] = [1,0]
 				RFproba[0,:,:][pref_ori[0,:] > 0] = [0,1]
@@ -997,3 +1111,55 @@ class Network:
 
 
 
+
+class _Run(object):
+	""" 
+	Training run of a Network (see Network.train): its datasets, set up by Network._set_up_run, and its progress through the episodes. The Network keeps its paused runs, without their datasets; a paused run is set up again when it is resumed and the state of the Network saved when it was paused is then restored
+	"""
+	datasets = ['images_train', 'images_test', 'images_task', 'labels_train', 'labels_test', 'labels_task', 'fold_train', 'fold_test', 'idx_test', 'images_src', 'noise_bank', 'trainset_producer']
+
+	def __init__(self, r):
+		"""
+		Args:
+			r (int): index of the run
+		"""
+		self.r = r
+		self.e = 0 				#episode from which to train the run
+		self.saved = None 		#state of the Network and image order of the episode, saved when the run is paused
+		self.init_stats = None 	#statistics of the images set up by the previous run, if it was set up by a previous call to Network.train (see Network._set_up_run)
+		for k in _Run.datasets: setattr(self, k, None)
+
+	def pause(self, net, e):
+		""" saves the state of net and the image order of the run before episode e, and releases its datasets """
+		self.e = e
+		self.saved = {	'hid_W' 			: np.copy(net.hid_W),
+						'out_W' 			: np.copy(net.out_W),
+						'W_drift' 			: np.copy(net._W_drift),
+						'stim_perf' 		: copy.deepcopy(net._stim_perf),
+						'order' 			: self.order,
+						'labels_rndm' 		: self.labels_rndm,
+						'idx_train' 		: self.idx_train,
+						'stim_ids' 			: self.stim_ids,
+						'random_state' 		: np.random.get_state(),
+						'noise_bank' 		: (self.noise_bank.rng.get_state(), self.noise_bank._assigned) if self.noise_bank is not None else None
+						}
+		self.close()
+		for k in _Run.datasets + ['order', 'labels_rndm', 'idx_train', 'stim_ids']: setattr(self, k, None)
+
+	def resume(self, net):
+		""" restores the state of net and the image order of the run saved when it was paused; the run must have been set up again """
+		saved = self.saved
+		net.hid_W = saved['hid_W']
+		net.out_W = saved['out_W']
+		net._W_drift = saved['W_drift']
+		net._stim_perf = saved['stim_perf']
+		self.order, self.labels_rndm, self.idx_train, self.stim_ids = saved['order'], saved['labels_rndm'], saved['idx_train'], saved['stim_ids']
+		np.random.set_state(saved['random_state'])
+		if self.noise_bank is not None:
+			self.noise_bank.rng.set_state(saved['noise_bank'][0])
+			self.noise_bank._assigned = saved['noise_bank'][1]
+		self.saved = None
+
+	def close(self):
+		""" stops the creation of training images in the background, if any """
+		if self.trainset_producer is not None: self.trainset_producer.close()
@@ -259,12 +259,13 @@ def plot_2D(net, images, labels, save_path=''):
 def hist_gabor(name, hid_W_naive, hid_W_trained, t, A, images_params, save_data, verbose, save_path='', curve_method='basic', log_weights=False):
 	""" Computes the distribution of orientation preference of neurons in the network. """
 	
+	#compute tuning curves of the naive and trained networks together
+	[curves_naive, curves], [pref_ori_naive, pref_ori] = gr.tuning_curves([hid_W_naive, hid_W_trained], t, A, images_params, name, curve_method=curve_method, plot=save_data, save_path=save_path, log_weights=log_weights)#no_softmax
+
 	#compute RFs info for the naive network
-	curves_naive, pref_ori_naive = gr.tuning_curves(hid_W_naive, t, A, images_params, name, curve_method=curve_method, plot=False, save_path=save_path, log_weights=log_weights)#no_softmax
 	slopes_naive = gr.slopes(hid_W_naive, curves_naive, pref_ori_naive, t, images_params['target_ori'], name, plot=False, save_path=save_path)
 
 	#compute RFs info for the trained network
-	curves, pref_ori = gr.tuning_curves(hid_W_trained, t, A, images_params, name, curve_method=curve_method, plot=save_data, save_path=save_path, log_weights=log_weights)
 	slopes = gr.slopes(hid_W_trained, curves, pref_ori, t, images_params['target_ori'], name, plot=False, save_path=save_path)
 
 	RFproba = gabor_RFproba(hid_W_trained, pref_ori)
@@ -2,14 +2,64 @@
 
 import numpy as np
 import external as ex
+from scipy.special import logsumexp
 from sklearn.neighbors import KernelDensity
 from sklearn.neighbors import KNeighborsRegressor
 
 ex = reload(ex)
 
-def pdf_estimate(images, labels, W, method, t):
+class GaussianPdf(object):
 	"""
-	Uses kernel density extimation to the compute the pdf of neural activation data.
+	Mixture of gaussians with diagonal covariance in the space of neural activation; a fast alternative to kernel density estimation, fitted in a single pass from the mean and variance of the data. Densities are evaluated as with sklearn's KernelDensity, with score_samples()
+	"""
+
+	def __init__(self, means, variances, weights):
+		"""
+		Args:
+			means (numpy array): mean of each component (components x neurons)
+			variances (numpy array): variance of each component (components x neurons)
+			weights (numpy array): weight of each component; must sum to 1
+		"""
+		self.means = np.atleast_2d(means)
+		self.variances = np.atleast_2d(variances)
+		self.log_weights = np.log(weights)
+		self._precisions = 1./self.variances
+		self._log_norm = -0.5*np.sum(np.log(2*np.pi*self.variances), 1)
+
+	def score_components(self, X):
+		""" log of the weighted density of each component at X (samples x neurons); returns an array of samples x components """
+		sq_dist = np.dot(X**2, self._precisions.T) - 2*np.dot(X, (self.means*self._precisions).T) + np.sum(self.means**2*self._precisions, 1)
+		return self.log_weights + self._log_norm - 0.5*sq_dist
+
+	def score_samples(self, X):
+		""" log density at X (samples x neurons) """
+		return logsumexp(self.score_components(X), axis=1)
+
+def gaussian_pdf(activ, labels, classes, reg_covar=1e-6):
+	"""
+	Fits a gaussian with diagonal covariance to the neural activation of each class
+
+	Args:
+		activ (numpy array): activation of the hidden neurons (n_trials x n_neurons)
+		labels (numpy array): labels associated with the neuron activations
+		classes (numpy array): classes for which to fit a pdf
+		reg_covar (float, optional): value added to the variances, so that they are strictly positive. Default: 1e-6
+
+	returns:
+		(list of GaussianPdf): pdf of each class
+		(GaussianPdf): pdf of all data, the mixture of the pdfs of the classes weighted by their frequency
+	"""
+	means = np.array([np.mean(activ[labels==c], 0) for c in classes])
+	variances = np.array([np.var(activ[labels==c], 0) for c in classes]) + reg_covar
+	priors = np.array([np.sum(labels==c) for c in classes], dtype=float)/len(labels)
+	pdf_marginals = [GaussianPdf(means[i], variances[i], [1.]) for i in range(len(classes))]
+	pdf_evidence = GaussianPdf(means, variances, priors)
+
+	return pdf_marginals, pdf_evidence
+
+def pdf_estimate(images, labels, W, method, t, activ=None):
+	"""
+	Uses kernel density extimation (or gaussians, with method 'gaussian') to the compute the pdf of neural activation data.
 
 	Args:
 		images (numpy array): input images
@@ -17,6 +67,7 @@ def pdf_estimate(images, labels, W, method, t):
 		W (numpy array): weights of the hidden neurons
 		method (str): method to approximate the pdf
 		t (float): temperature of the softmax when then network was trained
+		activ (numpy array, optional): activation of the hidden neurons for the input images, if already computed; images and W are then not used. Default: None
 
 	returns:
 		(list of regressor or kde objects): list of marginal pdfs
@@ -29,13 +80,19 @@ def pdf_estimate(images, labels, W, method, t):
 	n_trials = len(labels)
 
 	""" computes the activation of the hidden neurons for the given input images """
-	activ = ex.propagate_layerwise(images, W, t=t)
+	if activ is None:
+		activ = ex.propagate_layerwise(images, W, t=t)
+
+	if method=='gaussian': #uses all data points
+		pdf_labels = np.copy(labels)
+		pdf_marginals, pdf_evidence = gaussian_pdf(activ, labels, classes)
+		return pdf_marginals, pdf_evidence, pdf_labels
 
-	n_subsample = 1000 #number of data points to use to compute the pdf in the 'subsample' and 'fit' methods
+	n_subsample = min(1000, n_trials) #number of data points to use to compute the pdf in the 'subsample' and 'fit' methods
 	subsample_idx = np.random.choice(n_trials, size=n_subsample, replace=False)
 	activ_subs = activ[subsample_idx, :]
 
-	n_train_fit = 500 #number of data point to use to fit the pdf in the 'fit' method
+	n_train_fit = min(500, n_trials) #number of data point to use to fit the pdf in the 'fit' method
 	train_fit_idx = np.random.choice(n_trials, size=n_train_fit, replace=False)
 	activ_fit = activ[train_fit_idx, :]
 
@@ -64,75 +121,44 @@ def pdf_estimate(images, labels, W, method, t):
 
 	return pdf_marginals, pdf_evidence, pdf_labels
 
-def bayesian_decoder(activ, pdf_marginals, pdf_evidence, pdf_labels, method):
+def bayesian_decoder(activ, pdf_marginals, pdf_evidence, pdf_labels, method, chunk_size=10000, log=False):
 	"""
-	Computes the posterior probability of the input classes for a given population neural activity vector
+	Computes the posterior probability of the input classes for a given population neural activity vector. The computation is done in log space throughout (marginals times priors divided by the evidence), so that it does not underflow for high-dimensional activations
 
 	Args:
 		activ (numpy array): activation of hidden neurons to decode (n_trials x n_neurons)
 		pdf_marginals (list of regressor or kde objects): list of marginal pdfs
-		pdf_evidence (regressor or kde object): pdf of neural activation
+		pdf_evidence (regressor or kde object): pdf of neural activation; for the 'gaussian' method, the densities of all classes are evaluated in a single call with it
 		pdf_labels (numpy array): labels of the data used to compute the pdf
 		method (str): method used to approximate the pdf in pdf_estimate()
+		chunk_size (int, optional): number of trials decoded at once. Default: 10000
+		log (bool, optional): whether to return the log of the posterior. Default: False
+
+	returns:
+		(numpy array): posterior probability of each class (n_trials x n_classes)
 	"""
 
-	classes = np.unique(pdf_labels)
-	n_classes = len(classes)
-	n_activ = np.size(activ,0)
-	n_labels = float(len(pdf_labels))
+	classes, counts = np.unique(pdf_labels, return_counts=True)
+	log_priors = np.log(counts/float(len(pdf_labels)))
 
-	""" computes the prior distribution for all input classes """
-	priors = np.zeros(n_classes)
-	for i, c in enumerate(classes):
-		priors[i] = np.sum(pdf_labels==c)/n_labels
+	log_posterior = np.empty((np.size(activ,0), len(classes)))
+	for start in range(0, np.size(activ,0), chunk_size):
+		chunk = activ[start:start+chunk_size]
 
-	""" computes the evidence """
-	if method=='fit':
-		evidence = np.exp(pdf_evidence.predict(activ))
-	else:
-		evidence = np.exp(pdf_evidence.score_samples(activ))
-
-	""" computes the marginals (conditional probability) for all input classes  """
-	marginals = np.zeros((n_activ, n_classes))
-	for i, pdf_m in enumerate(pdf_marginals):
-		if method=='fit':
-			marginals[:, i] = np.exp(pdf_m.predict(activ))
+		""" computes the log of the marginals (conditional probability) times the prior for all input classes """
+		if method=='gaussian' and isinstance(pdf_evidence, GaussianPdf):
+			log_joint = pdf_evidence.score_components(chunk) #components of the evidence are the classes, weighted by their prior
 		else:
-			marginals[:, i] = np.exp(pdf_m.score_samples(activ))
-	
-	""" computes the posterior probability """
-	posterior = (marginals*priors)/evidence[:, np.newaxis]
-	
-	return posterior
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+			log_joint = np.empty((len(chunk), len(classes)))
+			for i, pdf_m in enumerate(pdf_marginals):
+				log_joint[:, i] = pdf_m.predict(chunk) if method=='fit' else pdf_m.score_samples(chunk)
+			log_joint += log_priors
+
+		""" divides by the evidence """
+		if method=='gaussian' and isinstance(pdf_evidence, GaussianPdf):
+			log_evidence = logsumexp(log_joint, axis=1) #same as pdf_evidence.score_samples(chunk)
+		else:
+			log_evidence = pdf_evidence.predict(chunk) if method=='fit' else pdf_evidence.score_samples(chunk)
+		log_posterior[start:start+chunk_size] = log_joint - log_evidence[:, np.newaxis]
 
+	return log_posterior if log else np.exp(log_posterior)
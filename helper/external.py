@@ -15,6 +15,10 @@ import grating as gr
 import time
 import datetime
 import struct
+import hashlib
+import weakref
+import warnings
+import tempfile
 from array import array
 from pdb import set_trace
 
@@ -40,6 +44,9 @@ def load_images(protocol, A, verbose=True, digit_params={}, gabor_params={}, toy
 				noise_pixel (float): noise injected in the pixels of gabor filter
 				rnd_phase (bool): whether to use random phase (True) or use set phase
 				im_size (int): side of the gabor filter image (total pixels = im_size * im_size)
+				dtype (str, optional): data type of the gabor images, e.g. 'float32' to halve memory. Default: 'float64'
+				prefetch_trainset (bool, optional): with renew_trainset, whether to create the training images of the next episode in the background while the current episode trains. Default: True
+				noise_bank (int, optional): number of pixel noise vectors drawn once per run and reassigned to the training images every episode; noise is drawn afresh for each batch if 0. Default: n_train
 			load_test (bool, optional): whether to load test images (True) or not (False). Default: True
 			normalize_im (bool, optional): whether to normalize images. Default: True
 
@@ -137,17 +144,18 @@ def load_images(protocol, A, verbose=True, digit_params={}, gabor_params={}, toy
 								}
 		if verbose: print 'creating gabor training images...'
 		gabor_params['target_ori'] %= 180.
+		dtype = gabor_params.get('dtype', 'float64')
 
 		orientations = np.random.random(gabor_params['n_train'])*180 #orientations of gratings (in degrees)
 		phase = np.random.random(gabor_params['n_train']) if gabor_params['rnd_phase'] else 0.25
 		freq = np.random.random(gabor_params['n_train'])*0.1+5. if gabor_params['rnd_freq'] else 5.
-		images, labels = generate_gabors(orientations, gabor_params['target_ori'], gabor_params['im_size'], phase=phase, freq=freq)
+		images, labels = generate_gabors(orientations, gabor_params['target_ori'], gabor_params['im_size'], phase=phase, freq=freq, dtype=dtype)
 
 		if not gabor_params['renew_trainset']:
 			orientations_task = np.random.random(gabor_params['n_train'])*gabor_params['excentricity']*2 + gabor_params['target_ori'] - gabor_params['excentricity'] 
 			phase_task = np.random.random(gabor_params['n_train']) if gabor_params['rnd_phase'] else 0.25
 			freq_task = np.random.random(gabor_params['n_train'])*5.+2. if gabor_params['rnd_freq'] else 5.
-			images_task, labels_task = generate_gabors(orientations_task, gabor_params['target_ori'], gabor_params['im_size'], phase=phase_task, freq=freq_task)
+			images_task, labels_task = generate_gabors(orientations_task, gabor_params['target_ori'], gabor_params['im_size'], phase=phase_task, freq=freq_task, dtype=dtype)
 		else:
 			orientations_task, images_task, labels_task = None, None, None
 
@@ -155,7 +163,7 @@ def load_images(protocol, A, verbose=True, digit_params={}, gabor_params={}, toy
 			orientations_test = np.random.random(gabor_params['n_test'])*gabor_params['excentricity']*2 + gabor_params['target_ori'] - gabor_params['excentricity']
 			phase_test = np.random.random(gabor_params['n_test']) if gabor_params['rnd_phase'] else 0.25
 			freq_test = np.random.random(gabor_params['n_test'])*5.+2. if gabor_params['rnd_freq'] else 5.
-			images_test, labels_test = generate_gabors(orientations_test, gabor_params['target_ori'], gabor_params['im_size'], phase=phase_test, freq=freq_test)
+			images_test, labels_test = generate_gabors(orientations_test, gabor_params['target_ori'], gabor_params['im_size'], phase=phase_test, freq=freq_test, dtype=dtype)
 		else:
 			orientations_test, images_test, labels_test = None, None, None
 
@@ -298,6 +306,52 @@ def checkdir(name, protocol, overwrite=True):
 
 	return name
 
+def publish_datasets(images_dict, labels_dict, folder):
+	"""
+	Writes the datasets once to .npy files, so that worker processes can memory-map them (see load_shared_datasets) instead of each receiving a pickled copy. The files are written to folder as given, usually in the results folder on disk; the processes that map them share the pages of the operating system's file cache, so the images are held in memory only once per machine
+
+	Args:
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		folder (str): folder in which to write the datasets
+
+	returns:
+		(str): folder containing the datasets
+	"""
+	if not os.path.isdir(folder):
+		os.makedirs(folder)
+	for prefix, datasets in [('images', images_dict), ('labels', labels_dict)]:
+		for k, v in datasets.items():
+			if v is not None:
+				np.save(os.path.join(folder, prefix + '_' + k + '.npy'), np.ascontiguousarray(v))
+
+	return folder
+
+_shared_datasets = {}
+
+def load_shared_datasets(folder):
+	"""
+	Returns read-only, memory-mapped views of the datasets written by publish_datasets; pages are shared between all processes mapping the same files, and the views are opened only once per process
+
+	Args:
+		folder (str): folder containing the datasets
+
+	returns:
+		(dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task' (None if not published)
+		(dict): dictionary of label arrays of the images
+	"""
+	folder = os.path.abspath(folder)
+	if folder not in _shared_datasets:
+		images_dict, labels_dict = {'train':None, 'test':None, 'task':None}, {'train':None, 'test':None, 'task':None}
+		for f in sorted(os.listdir(folder)):
+			prefix, _, k = f[:-len('.npy')].partition('_')
+			if f.endswith('.npy') and prefix in ['images', 'labels']:
+				datasets = images_dict if prefix=='images' else labels_dict
+				datasets[k] = np.load(os.path.join(folder, f), mmap_mode='r')
+		_shared_datasets[folder] = (images_dict, labels_dict)
+
+	return _shared_datasets[folder]
+
 def shuffle_datasets(images_dict, labels_dict, idx_shuffle=None):
 	""" shuffle test & train datasets """
 
@@ -342,26 +396,30 @@ def shuffle(arrays):
 
 	return shuffled_arrays
 
-def cross_validate_split(images_dict, labels_dict, n_runs, r):
-	"""
-	Splits the training dataset into training and validation sets
+def cross_validation_folds(n_images, n_folds, seed=None):
 	"""
+	Plans disjoint K-fold splits of a dataset from a single seeded permutation; each fold's training and validation sets are index arrays into the dataset, so no images are copied
 
-	images, labels = shuffle([images_dict['train'], labels_dict['train']])
+	Args:
+		n_images (int): number of images in the dataset
+		n_folds (int): number of folds; each image is in the validation set of at most one fold (the n_images % n_folds remaining images are always used for training)
+		seed (int or list of int, optional): seed of the permutation. Default: None
 
-	mask_test = np.zeros(len(labels), dtype=bool)
-	n_stim_split = len(labels)/n_runs
-	mask_test[r*n_stim_split:(r+1)*n_stim_split] = True
-	
-	labels_test = labels[mask_test]
-	images_test = images[mask_test,:]
-	
-	labels_train = labels[~mask_test]
-	images_train = images[~mask_test,:]
+	returns:
+		(list): (training indices, validation indices) of each fold, both sorted
+	"""
+	idx_permuted = np.random.RandomState(seed).permutation(n_images)
+	n_val = n_images/n_folds
+
+	folds = []
+	for k in range(n_folds):
+		idx_val = np.sort(idx_permuted[k*n_val:(k+1)*n_val])
+		idx_train = np.sort(np.concatenate((idx_permuted[:k*n_val], idx_permuted[(k+1)*n_val:])))
+		folds.append((idx_train, idx_val))
 
-	return images_train, images_test, labels_train, labels_test
+	return folds
 
-def generate_gabors(orientations, target_ori, im_size, noise_pixel=0., phase=0.25, freq=5.):
+def generate_gabors(orientations, target_ori, im_size, noise_pixel=0., phase=0.25, freq=5., dtype=np.float64):
 	"""
 	Calling function to generate gabor filters
 
@@ -369,15 +427,17 @@ def generate_gabors(orientations, target_ori, im_size, noise_pixel=0., phase=0.2
 		orientations (numpy array): 1-D array of orientations of gratings (in degrees) (one grating is created for each orientation provided)
 		target_ori (float): target orientation around which to discriminate clock-wise vs. counter clock-wise
 		im_size (int): side of the gabor filter image (total pixels = im_size * im_size)
-		noise_pixel (int,optional): noise level to add to the pixels of Gabor patch; represents the standard deviation of the Gaussian distribution from which noise is drawn; range: (0, inf
+		noise_pixel (float or numpy array, optional): noise level to add to the pixels of Gabor patch; represents the standard deviation of the Gaussian distribution from which noise is drawn; range: (0, inf
 		phase (float, list or numpy array, optional): phase of the filter; range: [0, 1)
+		freq (float, list or numpy array, optional): spatial frequency of the filter (cycles per image)
+		dtype (numpy dtype, optional): data type of the gabor filters. Default: np.float64
 
 	returns:
 		numpy array: gabor filters of size: (len(orientations), im_size*im_size)
 		numpy array: labels (clock-wise / counter clock-wise) of each gabor filter
 	"""
 
-	images = gr.gabor(size=im_size, freq=freq, theta=orientations, sigma=0.2, phase=phase, noise_pixel=noise_pixel)
+	images = gr.gabor(size=im_size, freq=freq, theta=orientations, sigma=0.2, phase=phase, noise_pixel=noise_pixel, dtype=dtype)
 
 	if type(orientations) is not np.ndarray and type(orientations) is not list:
 		orientations = np.array([orientations])		
@@ -399,13 +459,36 @@ def relative_orientations(orientations, target_ori):
 
 	return orientations
 
+init_arrays = ['hid_W_trained', 'out_W_trained', 'hid_W_naive', 'out_W_naive', 'stim_perf_saved', '_idx_shuffle_saved'] #arrays of a saved Network used to initialize other networks (see load_init_run)
+
 def save_net(net):
 	""" Print parameters of Network object to human-readable file and save Network to disk """
 		
-	""" save network to file """
-	n_file = open(os.path.join('output', net.name, 'Network'), 'w')
-	pickle.dump(net, n_file)
-	n_file.close()
+	weights_path = os.path.join('output', net.name, 'weights')
+	if not os.path.isdir(weights_path):
+		os.makedirs(weights_path)
+
+	""" save network to file; arrays on disk (memory-mapped) are saved in the weights folder and pickled as a reference to their file """
+	memmaps = {k: v for k, v in vars(net).items() if isinstance(v, np.memmap)}
+	for k, v in memmaps.items():
+		path = os.path.join(weights_path, k + '.npy')
+		if v.filename is not None and os.path.abspath(v.filename) == os.path.abspath(path):
+			v.flush()
+		else:
+			np.save(path, v)
+		setattr(net, k, ArrayFile(path))
+	try:
+		n_file = open(os.path.join('output', net.name, 'Network'), 'w')
+		pickle.dump(net, n_file)
+		n_file.close()
+	finally:
+		for k, v in memmaps.items():
+			setattr(net, k, v)
+
+	""" save the arrays used for initialization as memory-mappable files """
+	for k in init_arrays:
+		if isinstance(getattr(net, k, None), np.ndarray):
+			np.save(os.path.join(weights_path, k + '.npy'), getattr(net, k))
 
 	save_file = os.path.join('output', net.name, net.name + '_params.txt')
 	if hasattr(net, 'runtime'):
@@ -413,11 +496,94 @@ def save_net(net):
 	else:
 		print_params(vars(net), save_file)
 
+class ArrayFile(object):
+	""" reference to an array saved as a .npy file, pickled in place of a memory-mapped array of a Network (see save_net) """
+
+	def __init__(self, path):
+		"""
+		Args:
+			path (str): .npy file of the array
+		"""
+		self.path = path
+
+	def load(self, mmap_mode='r'):
+		""" loads the array; memory-mapped with mmap_mode (see np.load), or into memory if None """
+		return np.load(self.path, mmap_mode=mmap_mode)
+
+	def __repr__(self):
+		return 'ArrayFile(%r)' % self.path
+
+def column_memmap(shape, path=None, fill=np.nan, dtype=float):
+	"""
+	Creates a memory-mapped array on disk, stored column by column (Fortran order) so that writing one column, e.g. one episode of a tracker, touches a contiguous part of the file
+
+	Args:
+		shape (tuple): shape of the array
+		path (str, optional): .npy file of the array; a temporary file, removed from the file system right away (its content stays available to the memory map), if None. Default: None
+		fill (float, optional): initial value of the elements. Default: NaN
+		dtype (type, optional): data type of the array. Default: float
+
+	returns:
+		(numpy memmap): the array
+	"""
+	if path is None:
+		fd, file_path = tempfile.mkstemp(suffix='.npy')
+		os.close(fd)
+	else:
+		file_path = path
+		if os.path.dirname(path) != '' and not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+	array = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=shape, fortran_order=True)
+	array[:] = fill
+	if path is None:
+		os.remove(file_path)
+
+	return array
+
+_init_nets = {}
+
+def load_init_run(init_file, run):
+	"""
+	Loads the weights and stimulus performance of one run of a saved Network to initialize another network; the arrays are memory-mapped from the weights folder of the saved Network (see save_net) and only the requested run is read. Networks saved without this folder are unpickled once per process. The arrays are cached per process.
+
+		Args:
+			init_file (str): name of the saved Network, in the 'output' folder
+			run (int): run to load; taken modulo the number of runs of the saved Network
+
+		returns:
+			(dict): arrays of the run (copies), with keys in init_arrays (missing if not saved), and 'n_runs' and 'run' (run loaded)
+	"""
+	net_file = os.path.join('output', init_file, 'Network')
+	if not os.path.exists(os.path.join('output', init_file)):
+		raise IOError, "weight file \'%s\' not found" % init_file
+	key = (init_file, os.path.getmtime(net_file))
+	if key not in _init_nets:
+		weights_path = os.path.join('output', init_file, 'weights')
+		if os.path.isdir(weights_path):
+			arrays = {k: np.load(os.path.join(weights_path, k + '.npy'), mmap_mode='r') for k in init_arrays if os.path.isfile(os.path.join(weights_path, k + '.npy'))}
+		else:
+			f_net = open(net_file, 'r')
+			saved_net = pickle.load(f_net)
+			f_net.close()
+			arrays = {k: getattr(saved_net, k) for k in init_arrays if isinstance(getattr(saved_net, k, None), np.ndarray)}
+		for k_old in [k_old for k_old in _init_nets.keys() if k_old[0]==init_file]: #saved Network was overwritten
+			del _init_nets[k_old]
+		_init_nets[key] = arrays
+
+	arrays = _init_nets[key]
+	n_runs = len(arrays['hid_W_trained'])
+	run_to_load = run % n_runs
+	init_run = {k: np.array(v[run_to_load]) for k, v in arrays.items()}
+	init_run['n_runs'] = n_runs
+	init_run['run'] = run_to_load
+
+	return init_run
+
 def print_params(param_dict, save_file, runtime=None):
 	""" print parameters """
 	tab_length = 25
 
-	params_to_print = ['dHigh', 'dMid', 'dNeut', 'dLow', 'dopa_values', 'dopa_func', 'dopa_out_same', 'train_out_dopa', 'dopa_values_out', 'dHigh_out', 'dMid_out', 'dNeut_out', 'dLow_out', 'ach_values', 'ach_1', 'ach_2', 'ach_3', 'ach_4', 'ach_func', 'ach_avg', 'ach_stim', 'ach_uncertainty', 'ach_BvSB', 'ach_approx_class', 'protocol', 'name', 'dopa_release', 'ach_release', 'n_runs', 'n_epi_crit', 'n_epi_fine', 'n_epi_perc', 'n_epi_post', 't_hid', 't_out', 'A','lr_hid', 'lr_out', 'batch_size', 'block_feedback', 'shuffle_datasets', 'n_hid_neurons', 'weight_init', 'init_file', 'lim_weights', 'log_weights', 'epsilon_xplr', 'noise_xplr_hid', 'noise_xplr_out', 'exploration', 'compare_output', 'noise_activ', 'pdf_method', 'classifier', 'RF_classifier','test_each_epi', 'early_stop', 'verbose', 'save_light', 'seed', 'images_params']
+	params_to_print = ['dHigh', 'dMid', 'dNeut', 'dLow', 'dopa_values', 'dopa_func', 'dopa_out_same', 'train_out_dopa', 'dopa_values_out', 'dHigh_out', 'dMid_out', 'dNeut_out', 'dLow_out', 'ach_values', 'ach_1', 'ach_2', 'ach_3', 'ach_4', 'ach_func', 'ach_avg', 'ach_stim', 'ach_uncertainty', 'ach_BvSB', 'ach_approx_class', 'protocol', 'name', 'dopa_release', 'ach_release', 'n_runs', 'n_epi_crit', 'n_epi_fine', 'n_epi_perc', 'n_epi_post', 't_hid', 't_out', 'A','lr_hid', 'lr_out', 'batch_size', 'block_feedback', 'shuffle_datasets', 'n_hid_neurons', 'weight_init', 'init_file', 'lim_weights', 'log_weights', 'epsilon_xplr', 'noise_xplr_hid', 'noise_xplr_out', 'exploration', 'compare_output', 'noise_activ', 'pdf_method', 'classifier', 'RF_classifier', 'RF_probing', 'test_each_epi', 'early_stop', 'verbose', 'save_light', 'seed', 'images_params']
 
 	
 	param_file = open(save_file, 'w')
@@ -461,6 +627,97 @@ def normalize(images, A):
 
 	return (A-images.shape[1])*images/np.sum(images,1)[:,np.newaxis] + 1.
 
+_input_stats_cache = {}
+_fingerprint_memo = {}
+
+def _memmap_position(images):
+	""" position (in bytes) in its file of the first element of a memory-mapped array; slices of a memmap keep the offset of the full array, so their position is found from their address relative to that of the full array """
+	root = images
+	while isinstance(root.base, np.ndarray):
+		root = root.base
+	return images.__array_interface__['data'][0] - root.__array_interface__['data'][0] + root.offset
+
+def dataset_fingerprint(images, chunk_size=10000, content=False):
+	"""
+	Computes a fingerprint identifying the content of a dataset. Memory-mapped arrays are identified by their file, position in the file, shape, strides and modification time; other arrays by a hash of their shape, data type and content (the hash is remembered for as long as the array exists, so arrays should not be modified in place after being fingerprinted)
+
+	Args:
+		images (numpy array or memmap): dataset to fingerprint
+		chunk_size (int, optional): number of images hashed at a time. Default: 10000
+		content (bool, optional): whether to hash the content of memory-mapped arrays too, for a fingerprint that does not depend on the file holding the data. Default: False
+
+	returns:
+		(str): fingerprint of the dataset
+	"""
+	if isinstance(images, np.memmap) and getattr(images, 'filename', None) is not None and not content:
+		return 'memmap:%s:%d:%s:%s:%s:%f' % (images.filename, _memmap_position(images), images.shape, images.strides, images.dtype, os.path.getmtime(images.filename))
+
+	memo = _fingerprint_memo.get(id(images))
+	if memo is not None and memo[0]() is images:
+		return memo[1]
+
+	sha = hashlib.sha1(str((images.shape, images.dtype.str)))
+	for start in range(0, len(images), chunk_size):
+		sha.update(np.ascontiguousarray(images[start:start+chunk_size]).data)
+	fingerprint = sha.hexdigest()
+	try:
+		_fingerprint_memo[id(images)] = (weakref.ref(images, lambda _, key=id(images): _fingerprint_memo.pop(key, None)), fingerprint)
+	except TypeError: #object does not support weak references
+		pass
+
+	return fingerprint
+
+def input_statistics(images, chunk_size=10000, cache=True, idx=None):
+	"""
+	Computes the mean and variance of each pixel over a dataset, chunk by chunk (chunk statistics are merged with Chan's parallel form of Welford's algorithm), so that memory-mapped or streamed datasets never need to be loaded whole
+
+	Args:
+		images (numpy array, memmap or iterable of 2D numpy arrays): dataset, either as a single array or as an iterable of chunks of images
+		chunk_size (int, optional): number of images processed at a time when images is an array. Default: 10000
+		cache (bool, optional): whether to remember the statistics of arrays by their fingerprint (see dataset_fingerprint), so that they are computed only once per dataset. Default: True
+		idx (numpy array, optional): indices of the images of an array to include (e.g. a cross-validation fold); all images if None. Default: None
+
+	returns:
+		(numpy array): mean of each pixel
+		(numpy array): variance of each pixel
+	"""
+	is_array = isinstance(images, np.ndarray)
+	if is_array and cache:
+		fingerprint = dataset_fingerprint(images, chunk_size)
+		if idx is not None:
+			fingerprint += ':' + hashlib.sha1(np.ascontiguousarray(idx, dtype=np.int64).data).hexdigest()
+		if fingerprint in _input_stats_cache:
+			mean, var = _input_stats_cache[fingerprint]
+			return np.copy(mean), np.copy(var)
+
+	if is_array and idx is not None:
+		chunks = (images[idx[start:start+chunk_size]] for start in range(0, len(idx), chunk_size))
+	elif is_array:
+		chunks = (images[start:start+chunk_size] for start in range(0, len(images), chunk_size))
+	else:
+		chunks = images
+
+	n, mean, M2 = 0, 0., 0.
+	for chunk in chunks:
+		chunk = np.asarray(chunk, dtype=float)
+		n_chunk = chunk.shape[0]
+		if n_chunk == 0: continue
+		mean_chunk = np.mean(chunk, 0)
+		M2_chunk = np.sum((chunk - mean_chunk)**2, 0)
+		delta = mean_chunk - mean
+		n_tot = n + n_chunk
+		mean = mean + delta*n_chunk/n_tot
+		M2 = M2 + M2_chunk + delta**2*n*n_chunk/n_tot
+		n = n_tot
+	if n == 0:
+		raise ValueError('cannot compute input statistics of an empty dataset')
+	var = M2/n
+
+	if is_array and cache:
+		_input_stats_cache[fingerprint] = (np.copy(mean), np.copy(var))
+
+	return mean, var
+
 def softmax(activ, implementation='numba', t=1.):
 	"""
 	Softmax function (equivalent to lateral inhibition, or winner-take-all)
@@ -533,20 +790,32 @@ def propagate_layerwise(X, W, SM=True, t=1., log_weights='log'):
 		numpy array: the activation of the hidden neurons
 	"""
 
+	# activ = np.dot(X, transfer_weights(W, log_weights))
+	activ = np.einsum('ij,jk', X, transfer_weights(W, log_weights))
+	if SM: activ = softmax(activ, t=t)
+	return activ
+
+def transfer_weights(W, log_weights='log'):
+	"""
+	Applies the transfer function of the weights used for propagation (see propagate_layerwise)
+
+	Args:
+		W (numpy array): weight matrix or stack of weight matrices
+		log_weights (str, optional): transfer function of the weights; possible values: 'lin', 'log', 'linlog'. Default: 'log'
+
+	returns:
+		numpy array: the transferred weights
+	"""
+
 	if log_weights=='lin':
-		# activ = np.dot(X, W)
-		activ = np.einsum('ij,jk', X, W)
+		return W
 	elif log_weights=='log' or log_weights:
-		# activ = np.dot(X, np.log(W))
-		activ = np.einsum('ij,jk', X, np.log(W))
+		return np.log(W)
 	elif log_weights=='linlog':
 		mask_W = W>1.
 		_W = np.copy(W)							#W<1
 		_W[mask_W] = np.log(W[mask_W]) + 1. 	#W>1
-		# activ = np.dot(X, _W)
-		activ = np.einsum('ij,jk', X, _W)
-	if SM: activ = softmax(activ, t=t)
-	return activ
+		return _W
 
 @numba.njit
 def disinhibition(post_neurons, lr, dopa, ach, post_neurons_lr):
@@ -620,6 +889,8 @@ def reward_prediction(explorative, compare_output, classes, out_neurons_greedy=N
 	else:
 		return ~explorative
 
+dopa_funcs = ['discrete', 'linear', 'linear_discrete', 'exponential', 'sigmoidal'] #relationships between RPE and DA release implemented in dopa_value(), by index
+
 def compute_dopa(predicted_reward, reward, dopa_values, dopa_func):
 	"""
 	Computes the dopa signal based on the actual and predicted rewards
@@ -628,24 +899,141 @@ def compute_dopa(predicted_reward, reward, dopa_values, dopa_func):
 		predicted_reward (numpy array, bool): predicted reward (True, False)
 		reward (numpy array, int): reward received (0, 1)
 		dopa_values (dict): dopa value for unpredicted reward, must includes keys: 'dHigh', 'dMid', 'dNeut' and 'dLow'
+		dopa_func (str): relationship between RPE and DA release, from dopa_funcs
 
 	returns:
 		numpy array: array of dopamine release value
 	"""
 
-	if dopa_func=='discrete':
-		return dopa_discrete(predicted_reward, reward, dopa_values)
-	elif dopa_func=='sigmoidal':
-		return dopa_sigmoidal(predicted_reward, reward, dopa_values)
-	elif dopa_func=='linear':
-		return dopa_linear(predicted_reward, reward, dopa_values)
-	elif dopa_func=='linear_discrete':
-		return dopa_linear_discrete(predicted_reward, reward, dopa_values)
-	elif dopa_func=='exponential':
-		return dopa_exponential(predicted_reward, reward, dopa_values)
-	else:
+	if dopa_func not in dopa_funcs:
 		raise ValueError("Unrecognised dopa_func value")
 
+	reward = np.asarray(reward, dtype=float)
+	dopa = np.empty(len(reward))
+	dopa_numba(np.asarray(predicted_reward, dtype=float), reward, _dopa_array(dopa_values), dopa_funcs.index(dopa_func), dopa)
+
+	return dopa
+
+def _dopa_array(dopa_values):
+	""" dopa values in the format of dopa_value(): array of dHigh, dMid, dNeut, dLow and d_noLabel (0 if not given) """
+	return np.array([dopa_values['dHigh'], dopa_values['dMid'], dopa_values['dNeut'], dopa_values['dLow'], dopa_values.get('d_noLabel', 0.)], dtype=float)
+
+@numba.njit
+def dopa_numba(predicted_reward, reward, dopa_values, dopa_func, dopa):
+	"""
+	support function for numba implementation of compute_dopa()
+	"""
+	for b in range(len(reward)):
+		dopa[b] = dopa_value(predicted_reward[b], reward[b], dopa_values, dopa_func)
+
+	return dopa
+
+@numba.njit
+def dopa_value(predicted_reward, reward, dopa_values, dopa_func):
+	"""
+	DA release of a single trial; dopa_func is the index of the function in dopa_funcs and dopa_values holds dHigh, dMid, dNeut, dLow and d_noLabel (see _dopa_array)
+	"""
+	dHigh, dMid, dNeut, dLow, d_noLabel = dopa_values[0], dopa_values[1], dopa_values[2], dopa_values[3], dopa_values[4]
+	RPE = reward - predicted_reward
+	if dopa_func==0: #discrete, based on explorative of exploitative classification decision
+		if reward==-1: 								return d_noLabel 	#no label provided
+		elif predicted_reward==0 and reward==1: 	return dHigh 		#unpredicted reward
+		elif predicted_reward==1 and reward==1: 	return dMid 		#correct reward prediction
+		elif predicted_reward==0 and reward==0: 	return dNeut 		#correct no reward prediction
+		elif predicted_reward==1 and reward==0: 	return dLow 		#incorrect reward prediction
+		else: 										return 0.
+	elif dopa_func==1: #linear
+		return dHigh*RPE + dMid
+	elif dopa_func==2: #linear_discrete
+		return dHigh*(RPE - 0.84953668) + 8.0 # dHigh linear
+		# return dHigh  # dHigh discrete
+		# return dLow*(RPE + 0.84088919) - 1.0 # dLow linear
+		# return dLow  # dLow discrete
+	elif dopa_func==3: #exponential
+		return np.exp(dHigh*RPE) - dMid
+		# return (np.exp(dHigh*RPE)-1.0)*(5.0/dHigh) + dMid
+	else: #sigmoidal
+		return ((dHigh - dLow) / (1.0+np.exp(dMid*RPE))) + dLow
+
+def reward_dopa(labels, classes, greedy, explore, out_neurons_greedy, out_neurons_explore, explorative, compare_output, dopa_values, dopa_func):
+	"""
+	Computes in a single pass over the output posteriors the reward, reward prediction, dopa signal and confidence of a batch; equivalent to reward_prediction(), reward_delivery(), compute_dopa() and a sort of the explorative posteriors
+
+	Args:
+		labels (numpy array): image labels
+		classes (numpy array): all classes of the model
+		greedy (numpy array): greedy action, the class of the highest greedy posterior
+		explore (numpy array): action taken
+		out_neurons_greedy (numpy array): greedy activation of the output neurons
+		out_neurons_explore (numpy array): explorative activation of the output neurons
+		explorative (numpy array): contains 1s for trials where noise is injected (exploratory) and 0s otherwise
+		compare_output (bool): whether to compare the value of greedy and taken action to determine if the trial is exploratory
+		dopa_values (dict): dopa values, must includes keys: 'dHigh', 'dMid', 'dNeut' and 'dLow' ('d_noLabel' is 0 if not given)
+		dopa_func (str): relationship between RPE and DA release, from dopa_funcs
+
+	returns:
+		numpy array: reward prediction
+		numpy array: reward received (1: reward, 0: no reward, -1: no label)
+		numpy array: dopa release value
+		numpy array: best explorative posterior
+		numpy array: second-best explorative posterior
+	"""
+	if dopa_func not in dopa_funcs:
+		raise ValueError("Unrecognised dopa_func value")
+
+	n = len(labels)
+	predicted_reward = np.empty(n)
+	reward = np.empty(n, dtype=int)
+	dopa = np.empty(n)
+	best_post = np.empty(n)
+	second_post = np.empty(n)
+	reward_dopa_numba(np.asarray(labels), classes, np.asarray(greedy), np.asarray(explore), out_neurons_greedy, out_neurons_explore, np.asarray(explorative, dtype=bool), compare_output, dopa_funcs.index(dopa_func), _dopa_array(dopa_values), predicted_reward, reward, dopa, best_post, second_post)
+
+	return predicted_reward, reward, dopa, best_post, second_post
+
+@numba.njit
+def _greater(a, b):
+	""" a > b, with NaN greater than any number """
+	return (np.isnan(a) and not np.isnan(b)) or a > b
+
+@numba.njit
+def reward_dopa_numba(labels, classes, greedy, explore, out_greedy, out_explore, explorative, compare_output, dopa_func, dopa_values, predicted_reward, reward, dopa, best_post, second_post):
+	"""
+	support function for numba implementation of reward_dopa(); dopa_func is the index of the function in dopa_funcs and dopa_values holds dHigh, dMid, dNeut, dLow and d_noLabel
+	"""
+	for b in range(out_explore.shape[0]):
+		#argmax, best and second-best of explorative posteriors (NaN ranks highest, as in np.argmax and np.sort)
+		i_explore = 0
+		best = -np.inf
+		second = -np.inf
+		for i in range(out_explore.shape[1]):
+			if _greater(out_explore[b,i], best):
+				second = best
+				best = out_explore[b,i]
+				i_explore = i
+			elif _greater(out_explore[b,i], second):
+				second = out_explore[b,i]
+		best_post[b] = best
+		second_post[b] = second
+
+		#reward prediction and reward
+		if not compare_output:
+			predicted_reward[b] = 0. if explorative[b] else 1.
+		elif dopa_func==0:
+			predicted_reward[b] = 1. if greedy[b]==classes[i_explore] else 0.
+		else:
+			predicted_reward[b] = out_greedy[b,i_explore]
+		if labels[b]==-1:
+			reward[b] = -1
+		elif labels[b]==explore[b]:
+			reward[b] = 1
+		else:
+			reward[b] = 0
+
+		dopa[b] = dopa_value(predicted_reward[b], reward[b], dopa_values, dopa_func)
+
+	return dopa
+
 def no_difference(best, alte, diff_tol=0.005, confidence='0.95'):
 	""" 
 	test that there are no statistical difference in the performance of models with different VTA values 
@@ -693,6 +1081,143 @@ def weighted_sum(array_to_sum, weigths):
 	result = np.nansum(array_to_sum*weigths, axis=1)
 	return result/norma
 
+class PerfTracker(object):
+	"""
+	Tracks the performance on each stimulus (or class) over the last episodes, for the release of ACh. Episodes are stored in a ring buffer and the sums needed by the release (weighted sum of each row as in weighted_sum(), with weights decreasing linearly with the age of the episode, and plain sum and count of each row) are updated incrementally: adding an episode costs O(n_tracked) and reading the sums of a batch O(batch size), instead of rolling the whole array every episode and summing it every batch. 
+	Rows are accessed through an index (rows), so that they can be shuffled by shuffling the index only. The sums are recomputed exactly once per full turn of the buffer, so that rounding errors do not accumulate.
+	When a value range is given, performances are quantized to 255 levels of the range and stored as uint8, with NaN encoded as nan_code; the sums are those of the quantized values.
+	"""
+
+	nan_code = 255
+
+	def __init__(self, n_tracked, n_epi, value_range=None):
+		"""
+		Args:
+			n_tracked (int): number of stimuli (or classes) tracked
+			n_epi (int): number of episodes over which performance is tracked
+			value_range (tuple, optional): (low, high) range of the performances, to store them quantized; stored as float if None. Default: None
+		"""
+		self.n_tracked 	= n_tracked
+		self.n_epi 		= n_epi
+		self.value_range = value_range
+		if value_range is None:
+			self.buffer = np.ones((n_tracked, n_epi))*np.nan
+		else:
+			self.buffer = np.ones((n_tracked, n_epi), dtype=np.uint8)*self.nan_code
+			self._levels = np.append(np.linspace(value_range[0], value_range[1], self.nan_code), np.nan) #value of each code
+		self.rows 		= np.arange(n_tracked)
+		self.head 		= 0 #column of the buffer holding the last episode
+		self._col_valid = np.zeros(n_epi) #normalization factor of each column, as in weighted_sum(); 0 for empty columns
+		self._n_pushed 	= 0
+		self._recompute()
+
+	@classmethod
+	def from_array(cls, array, value_range=None):
+		""" creates a tracker from a performance array (stimuli x episodes, last episode first), e.g. as returned by as_array() """
+		tracker = cls(np.shape(array)[0], np.shape(array)[1], value_range)
+		tracker.buffer = tracker._encode(array)
+		tracker._col_valid = np.array([tracker._column_valid(tracker._decode(tracker.buffer[:,c])) for c in range(tracker.n_epi)])
+		tracker._recompute()
+		return tracker
+
+	def as_array(self):
+		""" returns the performance array (stimuli x episodes, last episode first) """
+		return self._decode(self.buffer[self.rows][:, (self.head + np.arange(self.n_epi)) % self.n_epi])
+
+	def _encode(self, values):
+		""" converts performances to the storage format of the buffer """
+		values = np.array(values, dtype=float)
+		if self.value_range is None: 
+			return values
+		low, high = self.value_range
+		codes = np.clip(np.round((np.where(np.isnan(values), low, values) - low)/(high - low)*(self.nan_code-1)), 0, self.nan_code-1).astype(np.uint8)
+		codes[np.isnan(values)] = self.nan_code
+		return codes
+
+	def _decode(self, stored):
+		""" converts content of the buffer to performances """
+		return stored if self.value_range is None else self._levels[stored]
+
+	def _column_valid(self, column):
+		""" normalization factor of a column, as in weighted_sum() """
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', RuntimeWarning)
+			valid = np.ceil(np.nanmean(column))
+		return 0. if np.isnan(valid) else valid
+
+	def _weights(self):
+		""" weight of each column of the buffer: n_epi for the last episode down to 1 for the oldest """
+		weights = np.empty(self.n_epi)
+		weights[(self.head + np.arange(self.n_epi)) % self.n_epi] = np.arange(self.n_epi, 0, -1)
+		return weights
+
+	def _recompute(self):
+		""" computes the sums from the content of the buffer """
+		weights = self._weights()
+		buffer = self._decode(self.buffer)
+		values = np.where(np.isnan(buffer), 0., buffer)
+		self._sum 			= np.sum(values, 1)
+		self._count 		= np.sum(~np.isnan(buffer), 1)
+		self._weighted 		= np.dot(values, weights)
+		self._total 		= np.sum(self._sum)
+		self._total_count 	= np.sum(self._count)
+		self._total_weighted = np.sum(self._weighted)
+		self._norm 			= np.sum(self._col_valid*weights)
+		self._norm_total 	= np.sum(self._col_valid)
+
+	def push(self, perf):
+		"""
+		Adds the performance of an episode, dropping the oldest episode
+
+		Args:
+			perf (numpy array): performance on each tracked stimulus (or class), in the order of rows; NaN if not measured
+		"""
+		self.head = (self.head - 1) % self.n_epi
+		old = self._decode(self.buffer[:, self.head])
+		old_values = np.where(np.isnan(old), 0., old)
+		new_stored = np.empty(self.n_tracked, dtype=self.buffer.dtype)
+		new_stored[self.rows] = self._encode(perf)
+		new = self._decode(new_stored)
+		new_values = np.where(np.isnan(new), 0., new)
+
+		#weights of all episodes decrease by 1: the oldest episode (weight 1) drops out, the new episode gets weight n_epi
+		self._weighted += self.n_epi*new_values - self._sum
+		self._total_weighted += self.n_epi*np.sum(new_values) - self._total
+		self._sum += new_values - old_values
+		self._total += np.sum(new_values) - np.sum(old_values)
+		self._count += np.isnan(old).astype(int) - np.isnan(new)
+		self._total_count += np.sum(np.isnan(old)) - np.sum(np.isnan(new))
+		new_valid = self._column_valid(new)
+		self._norm += self.n_epi*new_valid - self._norm_total
+		self._norm_total += new_valid - self._col_valid[self.head]
+
+		self.buffer[:, self.head] = new_stored
+		self._col_valid[self.head] = new_valid
+		self._n_pushed += 1
+		if self._n_pushed % self.n_epi == 0:
+			self._recompute()
+
+	def weighted_avg(self, idx=slice(None)):
+		""" weighted average performance of the rows idx, as weighted_sum(as_array(), weights) with weights decreasing linearly with the age of the episode """
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self._weighted[self.rows[idx]]/self._norm
+
+	def mean_weighted_avg(self):
+		""" mean over rows of the weighted average performance """
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self._total_weighted/self._norm/self.n_tracked
+
+	def mean_all(self):
+		""" average performance over all rows and tracked episodes, ignoring NaN, as np.nanmean(as_array()) """
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self._total/self._total_count
+
+	def mean(self, idx=slice(None)):
+		""" average performance of the rows idx over the tracked episodes, ignoring NaN, as np.nanmean(as_array()[idx], 1) """
+		rows = self.rows[idx]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self._sum[rows]/self._count[rows]
+
 def generate_toy_data(protocol, A, toy_data_params):
 	""" generate 2D and 3D toy data to test model """
 
@@ -853,46 +1378,29 @@ def ach_handmade(rel_perf, ach_1=None, ach_2=None, ach_3=None, ach_4=None):
 
 def dopa_discrete(predicted_reward, reward, dopa_values):
 	""" discrete release value of DA, based on explorative of exploitative classification decision """
-	dopa = np.zeros(len(reward))
 
-	dopa[np.logical_and(predicted_reward==0, reward==1)] = dopa_values['dHigh']		#unpredicted reward
-	dopa[np.logical_and(predicted_reward==1, reward==1)] = dopa_values['dMid']		#correct reward prediction
-	dopa[np.logical_and(predicted_reward==0, reward==0)] = dopa_values['dNeut']		#correct no reward prediction
-	dopa[np.logical_and(predicted_reward==1, reward==0)] = dopa_values['dLow']		#incorrect reward prediction
-
-	dopa[reward==-1] = dopa_values['d_noLabel'] 									#no label provided
-
-	return dopa
-	# return np.zeros(len(reward)) ##
+	return compute_dopa(predicted_reward, reward, dopa_values, 'discrete')
 
 def dopa_linear(predicted_reward, reward, dopa_values):
 	""" linear relation between RPE and DA release """
 
-	RPE = reward - predicted_reward
-	return dopa_values['dHigh']*RPE + dopa_values['dMid']
+	return compute_dopa(predicted_reward, reward, dopa_values, 'linear')
 
 def dopa_linear_discrete(predicted_reward, reward, dopa_values):
 	""" linear relation between RPE and DA release """
 
-	RPE = reward - predicted_reward
-	return dopa_values['dHigh']*(RPE - 0.84953668) + 8.0 # dHigh linear
-	# return np.ones_like(RPE)*dopa_values['dHigh']  # dHigh discrete
-	# return dopa_values['dLow']*(RPE + 0.84088919) - 1.0 # dLow linear
-	# return np.ones_like(RPE)*dopa_values['dLow']  # dLow discrete
+	return compute_dopa(predicted_reward, reward, dopa_values, 'linear_discrete')
 
 def dopa_exponential(predicted_reward, reward, dopa_values):
 	""" exponential relation between RPE and DA release """
 
-	RPE = reward - predicted_reward
-	return np.exp(dopa_values['dHigh']*RPE) - dopa_values['dMid']
-	# return (np.exp(dopa_values['dHigh']*RPE)-1.0)*(5.0/dopa_values['dHigh']) + dopa_values['dMid']
+	return compute_dopa(predicted_reward, reward, dopa_values, 'exponential')
 
 def dopa_sigmoidal(predicted_reward, reward, dopa_values):
 	""" sigmoidal relation between RPE and DA release """
 
-	RPE = reward - predicted_reward
-	return ((dopa_values['dHigh'] - dopa_values['dLow']) / (1.0+np.exp(dopa_values['dMid']*RPE))) + dopa_values['dLow']
-	# return np.zeros(len(reward)) ##
+	return compute_dopa(predicted_reward, reward, dopa_values, 'sigmoidal')
+
 
 
 
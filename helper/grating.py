@@ -1,6 +1,9 @@
 """ Support functions for the gabor experimental protocol.  """
 
 import os
+import sys
+import threading
+import collections
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
@@ -9,84 +12,446 @@ from scipy import stats
 
 ex = reload(ex)
 
-def gabor(size=28, freq=5., theta=0., sigma=0.2, phase=0.25, noise_pixel=0.):
+_gabor_grids = {}
+
+def _gabor_grid(size, sigma):
+	""" returns the (cached) base grid and Gaussian envelope of a Gabor patch """
+	key = (size, float(sigma))
+	if key not in _gabor_grids:
+		# make linear ramp
+		X0 = (np.linspace(1, size, size) / size) - .5
+		Xm, Ym = np.meshgrid(X0, X0)
+
+		# 2D Gaussian distribution
+		gauss = np.exp(-((Xm ** 2) + (Ym ** 2)) / (2 * sigma ** 2)) #independent of image size
+		# gauss = np.exp(-((Xm ** 2) + (Ym ** 2)) / (2 * (sigma / float(size)) ** 2)) #relative to image size
+
+		_gabor_grids[key] = (X0[np.newaxis, np.newaxis, :], X0[np.newaxis, :, np.newaxis], gauss)
+	return _gabor_grids[key]
+
+def gabor(size=28, freq=5., theta=0., sigma=0.2, phase=0.25, noise_pixel=0., dtype=np.float64, chunk_size=None, out=None, rng=None, offset=None):
 	"""
 	Creates a Gabor patch
 
 	Args:
 
 		size (int): image side
-		freq (int or float): spatial frequency (cycles per image) 
+		freq (int, float, list or numpy array): spatial frequency (cycles per image) 
 		theta (int, float, list or numpy array): grating orientation in degrees (if list or array, a patch is created for each value)
 		sigma (int or float): gaussian standard deviation (in pixels)
 		phase (float, list or numpy array): phase of the filter; range: [0, 1)
-		noise_pixel (int): noise level to add to the pixel values of Gabor patches; represents the standard deviation of the Gaussian distribution from which noise_pixel is drawn; range: (0, inf
+		noise_pixel (float, list or numpy array): noise level to add to the pixel values of Gabor patches; represents the standard deviation of the Gaussian distribution from which noise_pixel is drawn; range: (0, inf
+		dtype (numpy dtype, optional): data type of the returned patches (e.g. np.float32 to halve memory). Default: np.float64
+		chunk_size (int, optional): number of patches computed at once; bounds the size of temporary arrays. Default: None (~4M pixels per chunk)
+		out (numpy array, optional): preallocated output array of shape (n images, size*size) in which to write the patches. Default: None
+		rng (numpy RandomState, optional): random number generator used to draw pixel noise. Default: None (global numpy generator)
+		offset (float, optional): value subtracted from the patches to make their pixel values positive. Default: None (minimum pixel value of the patches)
 
 	Returns:
 		(1D or 2D numpy array): 1D or 2D Gabor patch (n images * n pixels)
 	"""
 	#normalize input parameters
-	if type(theta) == int or type(theta) == float: theta = np.array([theta])
-	elif type(theta) == list: theta = np.array(theta)
-	if type(phase)==float or type(phase)==int: phase = np.array([phase])
-	if type(freq)==float or type(freq)==int: freq = np.array([freq])
-	n_gratings = np.max([len(freq), len(theta), len(phase)])
+	theta, freq, phase = np.broadcast_arrays(np.atleast_1d(np.asarray(theta, dtype=float)), np.atleast_1d(np.asarray(freq, dtype=float)), np.atleast_1d(np.asarray(phase, dtype=float)))
+	n_gratings = len(theta)
+	if np.ndim(noise_pixel)!=0: 
+		noise_pixel = np.broadcast_to(np.asarray(noise_pixel, dtype=float), (n_gratings,))
+	add_noise = np.any(noise_pixel!=0.0)
+	if rng is None: rng = np.random
+	if chunk_size is None: chunk_size = int(np.clip(2**22 / size**2, 1, n_gratings))
+
+	if out is None:
+		out = np.empty((n_gratings, size**2), dtype=dtype)
+	elif out.shape != (n_gratings, size**2):
+		raise ValueError('output array of wrong shape: %s; expected: %s' % (str(out.shape), str((n_gratings, size**2))))
+	out_3D = out.reshape(n_gratings, size, size)
+
+	# cached 2D grid and Gaussian envelope
+	X_row, Y_col, gauss = _gabor_grid(size, sigma)
 
-	# make linear ramp
-	X0 = (np.linspace(1, size, size) / size) - .5
+	# Change orientation by adding Xm and Ym together in different proportions
+	thetaRad = (theta / 360.) * 2 * np.pi
+	cos_theta = np.cos(thetaRad)[:,np.newaxis,np.newaxis]
+	sin_theta = np.sin(thetaRad)[:,np.newaxis,np.newaxis]
 
 	# Set wavelength and phase
 	# freq = size / float(freq) #relative to image size
-	phaseRad = phase * 2 * np.pi
+	freq = freq[:,np.newaxis,np.newaxis]
+	phaseRad = (phase * 2 * np.pi)[:,np.newaxis,np.newaxis]
+
+	# Make 2D gratings chunk by chunk, directly into the output array
+	grating_min = np.inf
+	for start in range(0, n_gratings, chunk_size):
+		c = slice(start, start+chunk_size)
+		gratings = X_row * cos_theta[c] + Y_col * sin_theta[c]
+		gratings *= freq[c]
+		gratings *= 2
+		gratings *= np.pi
+		gratings += phaseRad[c]
+		np.sin(gratings, out=gratings)
+		gratings *= gauss #add Gaussian
+		if add_noise:
+			sigma_noise = noise_pixel if np.ndim(noise_pixel)==0 else noise_pixel[c,np.newaxis,np.newaxis]
+			gratings += rng.normal(0.0, sigma_noise, size=np.shape(gratings)) #add Gaussian noise_pixel
+		grating_min = min(grating_min, np.min(gratings))
+		out_3D[c] = gratings
+	out -= grating_min if offset is None else offset
+
+	return out
+
+def gabor_factors(size=28, freq=5., theta=0., sigma=0.2, phase=0.25):
+	"""
+	Rank-2 factors of noiseless Gabor patches, as created by gabor() before the offset is subtracted: the grating sin(a+b) splits into sin(a)cos(b) + cos(a)sin(b) along columns (a) and rows (b), and the Gaussian envelope is separable
 
-	# Make 2D grating
-	Xm, Ym = np.meshgrid(X0, X0)
-	Xm = np.tile(Xm, (n_gratings, 1, 1))
-	Ym = np.tile(Ym, (n_gratings, 1, 1))
+	Args:
+		size (int): image side
+		freq (int, float, list or numpy array): spatial frequency (cycles per image)
+		theta (int, float, list or numpy array): grating orientation in degrees
+		sigma (int or float): gaussian standard deviation
+		phase (float, list or numpy array): phase of the filter; range: [0, 1)
+
+	Returns:
+		(3D numpy array): row factors (n patches x 2 x size)
+		(3D numpy array): column factors (n patches x 2 x size); patch n is the sum over k of np.outer(rows[n,k], cols[n,k])
+	"""
+	theta, freq, phase = np.broadcast_arrays(np.atleast_1d(np.asarray(theta, dtype=float)), np.atleast_1d(np.asarray(freq, dtype=float)), np.atleast_1d(np.asarray(phase, dtype=float)))
+	X0 = _gabor_grid(size, sigma)[0].ravel()
+	envelope = np.exp(-(X0 ** 2) / (2 * sigma ** 2))
 
-	# Change orientation by adding Xm and Ym together in different proportions
 	thetaRad = (theta / 360.) * 2 * np.pi
-	Xt = Xm * np.cos(thetaRad)[:,np.newaxis,np.newaxis]
-	Yt = Ym * np.sin(thetaRad)[:,np.newaxis,np.newaxis]
+	a = (X0 * np.cos(thetaRad)[:,np.newaxis]) * freq[:,np.newaxis] * 2 * np.pi + (phase * 2 * np.pi)[:,np.newaxis]
+	b = (X0 * np.sin(thetaRad)[:,np.newaxis]) * freq[:,np.newaxis] * 2 * np.pi
+	rows = np.stack([envelope * np.cos(b), envelope * np.sin(b)], 1)
+	cols = np.stack([envelope * np.sin(a), envelope * np.cos(a)], 1)
+
+	return rows, cols
+
+def _factors_min(rows, cols, chunk_size=None):
+	""" minimum pixel value of the patches of rank-2 factors (see gabor_factors), computed chunk by chunk """
+	n_patches, size = np.size(rows,0), np.size(rows,2)
+	if chunk_size is None: chunk_size = int(np.clip(2**22 / size**2, 1, n_patches))
+	return min([np.min(np.einsum('nki,nkj->nij', rows[c:c+chunk_size], cols[c:c+chunk_size])) for c in range(0, n_patches, chunk_size)])
+
+def propagate_gabor(W, theta, A, size=28, freq=5., sigma=0.2, phase=0.25, SM=False, t=1., log_weights='log', offset=None, chunk_size=None):
+	"""
+	Propagates normalized, noiseless Gabor patches through a weight matrix (ex.propagate_layerwise(ex.normalize(gabor(...), A), W)) without creating the patches: the response to each rank-2 patch (see gabor_factors) is computed from 1-D projections of the weights reshaped to images, and the pixel sums needed for normalization from the sums of the factors
 
-	# 2D Gaussian distribution
-	gauss = np.exp(-((Xm ** 2) + (Ym ** 2)) / (2 * sigma ** 2)) #independent of image size
-	# gauss = np.exp(-((Xm ** 2) + (Ym ** 2)) / (2 * (sigma / float(size)) ** 2)) #relative to image size
+	Args:
+		W (numpy array): weight matrix (pixels x neurons), or stack of weight matrices (runs x pixels x neurons)
+		theta (int, float, list or numpy array): grating orientations in degrees
+		A (float): normalization constant for the images
+		size (int, optional): image side. Default: 28
+		freq, sigma, phase (optional): parameters of the patches (see gabor)
+		SM (bool, optional): whether to pass the activation through the softmax function. Default: False
+		t (float, optional): temperature of the softmax function. Default: 1.0
+		log_weights (str, optional): transfer function of the weights (see ex.propagate_layerwise). Default: 'log'
+		offset (float, optional): value subtracted from the patches (see gabor). Default: None (minimum pixel value of the patches)
+		chunk_size (int, optional): number of patches processed at once; bounds the size of temporary arrays. Default: None (~4M values per chunk)
+
+	returns:
+		(numpy array): activation of the neurons (patches x neurons), or (runs x patches x neurons) for a stack of weight matrices
+	"""
+	stacked = np.ndim(W)==3
+	L = ex.transfer_weights(W if stacked else W[np.newaxis,:,:], log_weights)
+	n_runs, n_pixels, n_neurons = L.shape
+	L_cols = L.reshape(n_runs, size, size, n_neurons).transpose(0,2,1,3).reshape(n_runs, size, size*n_neurons) #columns x (rows x neurons)
+	L_sum = np.sum(L, 1)[:,np.newaxis,:]
+
+	rows, cols = gabor_factors(size=size, freq=freq, theta=theta, sigma=sigma, phase=phase)
+	n_patches = np.size(rows,0)
+	if offset is None: offset = _factors_min(rows, cols)
+	if chunk_size is None: chunk_size = int(np.clip(2**22 / (n_runs*2*size*n_neurons), 1, n_patches))
+	patch_sum = np.sum(np.sum(rows, 2) * np.sum(cols, 2), 1) - n_pixels*offset
+
+	activ = np.empty((n_runs, n_patches, n_neurons))
+	for start in range(0, n_patches, chunk_size):
+		c = slice(start, start+chunk_size)
+		n_c = len(rows[c])
+		proj = np.matmul(cols[c].reshape(n_c*2, size), L_cols).reshape(n_runs, n_c, 2, size, n_neurons) #projection of the columns of the weights on the column factors
+		activ[:,c,:] = np.einsum('nki,rnkij->rnj', rows[c], proj)
+	activ -= offset*L_sum
+	activ *= ((A-n_pixels)/patch_sum)[np.newaxis,:,np.newaxis]
+	activ += L_sum
+
+	if SM: activ = ex.softmax(activ.reshape(-1, n_neurons), t=t).reshape(activ.shape)
+	return activ if stacked else activ[0]
+
+def renew_trainset(images_params, seed):
+	"""
+	Creates a new set of gabor training images around the target orientation; pixel noise and normalization are applied when batches are fetched (see NoiseBank)
 
-	gratings = np.sin(((Xt + Yt) * freq[:,np.newaxis,np.newaxis] * 2 * np.pi) + phaseRad[:,np.newaxis,np.newaxis])
-	gratings *= gauss #add Gaussian
-	if noise_pixel!=0.0:
-		gratings += np.random.normal(0.0, noise_pixel, size=np.shape(gratings)) #add Gaussian noise_pixel
-	gratings -= np.min(gratings)
+	Args:
+		images_params (dict): parameters used to create the images (see ex.load_images)
+		seed (int or list of int): seed of the random number generator used to draw orientations; the same seed always yields the same set
 
-	gratings = np.reshape(gratings, (n_gratings, size**2))
+	returns:
+		(2D numpy array): training images
+		(numpy array): labels of the training images
+	"""
+	rng = np.random.RandomState(seed)
+
+	rnd_orientations = rng.random_sample(images_params['n_train'])*images_params['excentricity']*2 + images_params['target_ori'] - images_params['excentricity']
+	images, labels = ex.generate_gabors(rnd_orientations, images_params['target_ori'], images_params['im_size'], dtype=images_params.get('dtype', 'float64'))
+
+	return images, labels
+
+class TrainsetProducer(object):
+	""" 
+	Double-buffered producer of renewed gabor training sets: the set of the next episode is created in a background thread while the current episode trains. 
+	Each set is created with renew_trainset() from a seed that only depends on the episode, so that prefetched and synchronously created sets are identical.
+	"""
+
+	def __init__(self, images_params, seed, prefetch=True):
+		"""
+		Args:
+			images_params (dict): parameters used to create the images
+			seed (list of int): base seed; the seed of an episode's set is seed + [episode]
+			prefetch (bool, optional): whether to create sets in a background thread (True) or synchronously (False). Default: True
+		"""
+		self.images_params 	= images_params
+		self.seed 			= list(seed)
+		self.prefetch 		= prefetch
+		self._pending 		= {}
+
+	def _produce(self, e, result):
+		""" creates the set of episode e and stores it (or the raised exception) in result """
+		try:
+			result['set'] = renew_trainset(self.images_params, self.seed + [e])
+		except Exception:
+			result['error'] = sys.exc_info()
+
+	def request(self, e):
+		""" starts creating the set of episode e in the background (if prefetching) """
+		if not self.prefetch or e in self._pending:
+			return
+		result = {}
+		thread = threading.Thread(target=self._produce, args=(e, result))
+		thread.daemon = True
+		thread.start()
+		self._pending[e] = (thread, result)
+
+	def get(self, e, e_next=None):
+		"""
+		Returns the set of episode e and starts creating the set of episode e_next
+
+		Args:
+			e (int): episode of the set to return
+			e_next (int, optional): episode of the set to create in the background. Default: None
+
+		returns:
+			(2D numpy array): training images
+			(numpy array): labels of the training images
+		"""
+		if e in self._pending:
+			thread, result = self._pending.pop(e)
+			thread.join()
+			if 'error' in result:
+				raise result['error'][0], result['error'][1], result['error'][2]
+			images, labels = result['set']
+		else:
+			images, labels = renew_trainset(self.images_params, self.seed + [e])
+		if e_next is not None:
+			self.request(e_next)
+
+		return images, labels
+
+	def close(self):
+		""" waits for and discards sets still being created """
+		for thread, _ in self._pending.values():
+			thread.join()
+		self._pending = {}
+
+class NoiseBank(object):
+	"""
+	Source of the pixel noise of gabor images, added together with normalization when a batch of images is fetched.
+	With a bank, noise vectors are drawn once from a seeded generator and each image of an episode is assigned one of them (a bank the size of the dataset reproduces a noise matrix shuffled every episode); without a bank, fresh noise is drawn for every batch.
+	"""
+
+	def __init__(self, n_pixels, noise_pixel, A, n_bank=0, seed=None, rng=None):
+		"""
+		Args:
+			n_pixels (int): number of pixels of the images
+			noise_pixel (float): standard deviation of the pixel noise; no noise is added if 0
+			A (float): normalization constant for the images
+			n_bank (int, optional): number of noise vectors in the bank; noise is drawn lazily for each batch if 0. Default: 0
+			seed (int or list of int, optional): seed of the random number generator of the bank. Default: None
+			rng (numpy RandomState, optional): random number generator to use instead of seeding a new one (e.g. np.random). Default: None
+		"""
+		self.noise_pixel 	= noise_pixel
+		self.A 				= A
+		self.rng 			= rng if rng is not None else np.random.RandomState(seed)
+		self.bank 			= None
+		self._assigned 		= None
+		if noise_pixel > 0.0 and n_bank > 0:
+			self.bank = self.rng.normal(0.0, noise_pixel, size=(n_bank, n_pixels))
+
+	def new_episode(self, n_images):
+		""" assigns a noise vector of the bank to each of the n_images images of a new episode """
+		if self.bank is None:
+			return
+		n_bank = np.size(self.bank, 0)
+		if n_images <= n_bank:
+			self._assigned = self.rng.permutation(n_bank)[:n_images]
+		else:
+			self._assigned = self.rng.randint(n_bank, size=n_images)
+
+	def fetch(self, images, start=0, stop=None, idx=None):
+		"""
+		Returns a noisy and normalized copy of the images at positions start to stop of the episode; the images themselves are not modified
+
+		Args:
+			images (2D numpy array): images of the episode
+			start (int, optional): position of the first image of the batch. Default: 0
+			stop (int, optional): position after the last image of the batch. Default: None (last image)
+			idx (numpy array, optional): order of the images in the episode, as indices into images; images are taken in their stored order if None. Default: None
+
+		returns:
+			(2D numpy array): noisy, normalized images of the batch
+		"""
+		if idx is not None:
+			batch = images[idx[start:stop]]
+			n_images = len(idx)
+		else:
+			batch = images[start:stop]
+			n_images = len(images)
+		if self.noise_pixel > 0.0:
+			if self.bank is None:
+				noise = self.rng.normal(0.0, self.noise_pixel, size=np.shape(batch))
+			elif self._assigned is not None and len(self._assigned) >= n_images:
+				noise = self.bank[self._assigned[start:stop]]
+			else:
+				noise = self.bank[self.rng.randint(np.size(self.bank, 0), size=len(batch))]
+			batch = batch + noise
+
+		return ex.normalize(batch, self.A)
+
+_probe_cache = collections.OrderedDict() #probe sets, from the oldest to the most recently created
+_probe_cache_limit = 2**24 #largest total number of probe pixels kept in the cache, the oldest probe sets being evicted first; larger noiseless probe sets are propagated analytically (see propagate_gabor)
+
+def probe_gratings(im_size, target_ori, A, ori_step=0.1, noise_pixel=0., noise_trial=1):
+	"""
+	Returns the (cached) normalized gratings used to probe the tuning curves of the neurons, at all orientations around the target orientation. The returned arrays are read-only and shared between calls; the cache holds at most _probe_cache_limit pixels, and probe sets larger than that are not cached
+
+	Args:
+		im_size (int): image side
+		target_ori (float): target orientation; the probed orientations range from target_ori-90 to target_ori+90
+		A (float): normalization constant for the images
+		ori_step (float, optional): step between probed orientations (in degrees). Default: 0.1
+		noise_pixel (float, optional): pixel noise of the gratings; a single noiseless trial is created if 0. Default: 0.0
+		noise_trial (int, optional): number of noisy copies of the gratings. Default: 1
 
+	returns:
+		(numpy array): probed orientations
+		(3D numpy array): normalized gratings (noise trials x orientations x pixels)
+	"""
+	if noise_pixel == 0.0: noise_trial = 1 #noiseless trials are all identical
+	key = (im_size, float(target_ori), float(A), float(ori_step), float(noise_pixel), noise_trial)
+	if key in _probe_cache:
+		return _probe_cache[key]
+	orientations = np.arange(-90.+target_ori, 90.+target_ori, ori_step)
+	gratings = _make_probes(im_size, orientations, A, noise_pixel, noise_trial)
+	orientations.flags.writeable = False
+	gratings.flags.writeable = False
+	if gratings.size <= _probe_cache_limit:
+		while gratings.size + sum(g.size for o, g in _probe_cache.values()) > _probe_cache_limit:
+			_probe_cache.popitem(last=False)
+		_probe_cache[key] = (orientations, gratings)
+	return orientations, gratings
+
+def _make_probes(im_size, orientations, A, noise_pixel=0., noise_trial=1, offset=None):
+	""" creates the normalized probe gratings at the given orientations (noise trials x orientations x pixels); see gabor() for offset """
+	if noise_pixel == 0.0: noise_trial = 1
+	gratings = np.empty((noise_trial, len(orientations), im_size**2))
+	rng = np.random.RandomState(0) #the same noise for all networks that are compared
+	for i in range(noise_trial):
+		gabor(size=im_size, freq=5., theta=orientations, sigma=0.2, phase=0.25, noise_pixel=noise_pixel, out=gratings[i], rng=rng, offset=offset)
+		gratings[i] = ex.normalize(gratings[i], A)
 	return gratings
 
-def tuning_curves(W, t, A, images_params, name, curve_method='basic', plot=True, save_path='', log_weights=False):
+def _probe_responses(gratings, W_all, SM, t):
+	""" responses of the neurons of all runs to the probe gratings, averaged over noise trials (runs x orientations x neurons) """
+	n_trials, n_input, n_pixels = gratings.shape
+	activ = np.matmul(gratings.reshape(n_trials*n_input, n_pixels), W_all) #runs x (trials x orientations) x neurons
+	n_neurons = np.size(activ,2)
+	if SM:
+		activ = ex.softmax(activ.reshape(-1, n_neurons), t=t).reshape(activ.shape)
+	return activ.reshape(np.size(activ,0), n_trials, n_input, n_neurons).mean(1)
+
+def _adaptive_curves(W_all, SM, t, A, im_size, target_ori, ori_step, noise_pixel, noise_trial, coarse_step):
+	"""
+	Probes the tuning curves coarse to fine: a coarse sweep, a parabolic estimate of the peak of each neuron from the coarse sweep, then a hill climb on the fine grid until the best probe of each neuron is a local maximum of its curve. The orientations at which slopes() measures slopes (every 10 degrees, and one step before) are always probed.
+	All probes are shifted by the pixel offset of the noiseless coarse sweep (see gabor), which is within 1e-6 of that of the dense sweep, so that responses to probes created in different batches are comparable. Noiseless probes are propagated without creating the patches (see propagate_gabor)
+
+	returns:
+		(numpy array): orientations of the fine grid
+		(numpy array): responses at the probed orientations of the fine grid, NaN elsewhere (runs x orientations x neurons)
 	"""
-	compute the tuning curve of the neurons
+	orientations = np.arange(-90.+target_ori, 90.+target_ori, ori_step)
+	n_input = len(orientations)
+	n_runs, n_neurons = np.size(W_all,0), np.size(W_all,2)
+	curves = np.full((n_runs, n_input, n_neurons), np.nan)
+	probed = np.zeros(n_input, dtype=bool)
+
+	spacing = n_input / float(int(round(180./coarse_step)))
+	coarse_idx = np.round(np.arange(0, n_input, spacing)).astype(int)
+	offset = _factors_min(*gabor_factors(size=im_size, freq=5., theta=orientations[coarse_idx], sigma=0.2, phase=0.25))
+
+	def probe(idx):
+		idx = np.unique(np.mod(idx, n_input))
+		idx = idx[~probed[idx]]
+		if len(idx) == 0: return
+		if noise_pixel == 0.0:
+			curves[:,idx,:] = propagate_gabor(W_all, orientations[idx], A, size=im_size, SM=SM, t=t, log_weights='lin', offset=offset) #W_all is already transferred
+		else:
+			curves[:,idx,:] = _probe_responses(_make_probes(im_size, orientations[idx], A, noise_pixel, noise_trial, offset), W_all, SM, t)
+		probed[idx] = True
+
+	#coarse sweep and probes for slopes
+	slope_idx = np.arange(0, n_input, n_input/18)
+	probe(np.concatenate([coarse_idx, slope_idx, slope_idx-1]))
+
+	#parabolic estimate of the peak from the coarse sweep
+	k = np.argmax(np.where(np.isnan(curves[:,coarse_idx,:]), -np.inf, curves[:,coarse_idx,:]), 1)
+	r_idx, n_idx = np.arange(n_runs)[:,np.newaxis], np.arange(n_neurons)[np.newaxis,:]
+	y0, y1, y2 = [curves[r_idx, coarse_idx[np.mod(k+d, len(coarse_idx))], n_idx] for d in [-1,0,1]]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		shift = np.clip(np.nan_to_num(0.5*(y0-y2)/(y0-2*y1+y2)), -1., 1.)
+	peak = np.round(coarse_idx[k] + shift*spacing).astype(int)
+	probe(np.concatenate([peak.ravel()-1, peak.ravel(), peak.ravel()+1]))
+
+	#hill climb until the best probe of each neuron is a local maximum
+	while True:
+		best = np.argmax(np.where(np.isnan(curves), -np.inf, curves), 1).ravel()
+		neighbours = np.mod(np.concatenate([best-1, best+1]), n_input)
+		if np.all(probed[neighbours]): break
+		probe(neighbours)
+
+	return orientations, curves
+
+def tuning_curves(W, t, A, images_params, name, curve_method='basic', plot=True, save_path='', log_weights=False, probing='dense', coarse_step=3.):
+	"""
+	compute the tuning curve of the neurons; the responses of all runs (and of all weight sets) to all probe gratings are computed in a single contraction.
+	Accuracy of adaptive probing (probing='adaptive'), compared to dense probing: the slopes measured by slopes() agree within 1e-5 of the largest slope; the preferred orientations are the same except for neurons whose tuning curve has its peak away from the highest point of the coarse sweep (e.g. two peaks), which get a local peak
 
 	Args:
-		W (dict): dictionary of weight matrices (each element of the dictionary is a weight matrix from an individual run)
+		W (numpy array or list): weight matrices of the runs (runs x input neurons x hidden neurons), or list of such arrays (e.g. naive and trained weights) evaluated together
 		t (float): temperature of the softmax function used during training
+		A (float): normalization constant for the images
 		images_params (dict): dictionary of image parameters
 		name (str): name of the network, used for saving figures
 		curve_method (str, optional): way of computing the tuning curves. Can be: 'basic' (w/o noise, w/ softmax), 'no_softmax' (w/o noise, w/o softmax), 'with_noise' (w/ noise, w/ softmax)
-		plot (bool, optional): whether or not to create plots
+		plot (bool, optional): whether or not to create plots (of the last weight set if W is a list)
 		save_path (str, optional): path to save plots
+		log_weights (str, optional): transfer function of the weights (see ex.propagate_layerwise)
+		probing (str, optional): how to probe the orientations. Can be: 'dense' (all orientations, every 0.1 degree), 'adaptive' (coarse sweep refined around the peak of each neuron, see _adaptive_curves; about 100 probes plus 3 per neuron and run, e.g. 12x fewer for one run of 16 neurons). See above for the accuracy of adaptive probing. Default: 'dense'
+		coarse_step (float, optional): step of the coarse sweep of adaptive probing (in degrees). Default: 3.0
 
 	returns:
-		(dict): the tuning curves for each neuron of each run
+		(numpy array or list): the tuning curves for each neuron of each run (runs x orientations x neurons), NaN at orientations not probed; a list with an array for each weight set if W is a list
+		(numpy array or list): the preferred orientation of each neuron of each run, relative to the target orientation (runs x neurons); a list with an array for each weight set if W is a list
 	"""
 
 	# t=0.2 ##<----------uses different t as the one used during training-------------------
 
-	if plot:
-		if save_path=='': save_path=os.path.join('output', name)
-		if not os.path.exists(os.path.join(save_path, 'TCs')):
-			os.makedirs(os.path.join(save_path, 'TCs'))
-
 	if curve_method not in ['basic', 'no_softmax', 'with_noise']:
 		print '!!! invalid method - using \'basic\' method !!!'
 		curve_method='basic'
@@ -94,58 +459,80 @@ def tuning_curves(W, t, A, images_params, name, curve_method='basic', plot=True,
 	noise_pixel = 0.0 #images_params['noise_pixel']
 	noise_trial = 10#100
 	ori_step = 0.1
-	n_input = int(180/ori_step)
-	n_runs = np.size(W,0)
-	im_size = images_params['im_size']
-	n_neurons = np.size(W,2)
-
-	orientations = np.arange(-90.+images_params['target_ori'], 90.+images_params['target_ori'], ori_step)
+	target_ori = images_params['target_ori']
 	SM = False if curve_method=='no_softmax' else True
-	test_input = []
+
+	W_sets = list(W) if isinstance(W, (list, tuple)) else [W]
+	n_runs = [np.size(W_set,0) for W_set in W_sets]
+	W_all = ex.transfer_weights(np.concatenate(W_sets), log_weights)
 	if curve_method != 'with_noise':
-		gratings = gabor(size=im_size, freq=5., theta=orientations, sigma=0.2, phase=0.25, noise_pixel=0.0)
-		gratings = ex.normalize(gratings, A)
-		test_input.append(gratings)
+		noise_pixel, noise_trial = 0.0, 1
+
+	if probing=='dense' and noise_pixel == 0.0 and (180./ori_step)*images_params['im_size']**2 > _probe_cache_limit:
+		orientations = np.arange(-90.+target_ori, 90.+target_ori, ori_step)
+		curves_all = propagate_gabor(W_all, orientations, A, size=images_params['im_size'], SM=SM, t=t, log_weights='lin') #W_all is already transferred
+		pref_ori_all = orientations[np.argmax(curves_all, 1)]
+	elif probing=='dense':
+		orientations, gratings = probe_gratings(images_params['im_size'], target_ori, A, ori_step, noise_pixel, noise_trial)
+		curves_all = _probe_responses(gratings, W_all, SM, t)
+		pref_ori_all = orientations[np.argmax(curves_all, 1)]
+	elif probing=='adaptive':
+		orientations, curves_all = _adaptive_curves(W_all, SM, t, A, images_params['im_size'], target_ori, ori_step, noise_pixel, noise_trial, coarse_step)
+		pref_ori_all = orientations[np.argmax(np.where(np.isnan(curves_all), -np.inf, curves_all), 1)]
 	else:
-		for _ in range(noise_trial):
-			gratings = gabor(size=im_size, freq=5., theta=orientations, sigma=0.2, phase=0.25, noise_pixel=noise_pixel)
-			gratings = ex.normalize(gratings, A)
-			test_input.append(gratings)
+		raise ValueError('invalid probing: ' + str(probing))
+	pref_ori_all = ex.relative_orientations(pref_ori_all, target_ori)
 
-	curves = np.zeros((n_runs, n_input, n_neurons))
-	pref_ori = np.zeros((n_runs, n_neurons))
-	for r in range(n_runs):
-		if plot: 
-			fig, ax = plt.subplots()
-			plt.gca().set_color_cycle(cm.Paired(i) for i in np.linspace(0,0.8,10))
-		for i in range(len(test_input)):
-			curves[r,:,:] += ex.propagate_layerwise(test_input[i], W[r], SM=SM, t=t, log_weights=log_weights)/len(test_input)
-			pref_ori[r, :] = orientations[np.argmax(curves[r,:,:],0)]
-			pref_ori[r, :] = ex.relative_orientations(pref_ori[r, :], images_params['target_ori'])
+	bounds = np.cumsum([0] + n_runs)
+	curves = [curves_all[bounds[i]:bounds[i+1]] for i in range(len(W_sets))]
+	pref_ori = [pref_ori_all[bounds[i]:bounds[i+1]] for i in range(len(W_sets))]
 
-		if plot:
-			pref_ori_sorter = pref_ori[r, :].argsort()
-			
-			ax.plot(np.arange(-90., 90., ori_step), curves[r,:,:][:,pref_ori_sorter], lw=2)
-			ax.vlines(0, 0, np.max(curves[r,:,:])*1.2, colors=u'k', linewidth=1.5, linestyle=':')
+	if plot:
+		plot_tuning_curves(curves[-1], pref_ori[-1], name, ori_step=ori_step, save_path=save_path)
 
-			fig.patch.set_facecolor('white')
-			ax.spines['right'].set_visible(False)
-			ax.spines['top'].set_visible(False)
-			ax.xaxis.set_ticks_position('bottom')
-			ax.yaxis.set_ticks_position('left')
-			ax.set_xlabel('angle from target (deg)', fontsize=18)
-			ax.set_ylabel('response', fontsize=18)
-			ax.set_xlim([-90,90])
-			if curve_method=='no_softmax' and False: ax.set_ylim([119,138])
-			else: ax.set_ylim([np.min(curves[r,:,:])-(np.max(curves[r,:,:])-np.min(curves[r,:,:]))*.1, np.max(curves[r,:,:])+(np.max(curves[r,:,:])-np.min(curves[r,:,:]))*.1])
-			ax.tick_params(axis='both', which='major', direction='out', labelsize=16)
-			plt.tight_layout()
+	if not isinstance(W, (list, tuple)):
+		return curves[0], pref_ori[0]
+	return curves, pref_ori
+
+def plot_tuning_curves(curves, pref_ori, name, ori_step=0.1, save_path=''):
+	"""
+	plots the tuning curves of the neurons of each run, as computed by tuning_curves()
+
+	Args:
+		curves (numpy array): the tuning curves for each neuron of each run
+		pref_ori (numpy array): the preferred orientation of each neuron of each run
+		name (str): name of the network, used for saving figures
+		ori_step (float, optional): step between probed orientations. Default: 0.1
+		save_path (str, optional): path to save plots
+	"""
+	if save_path=='': save_path=os.path.join('output', name)
+	if not os.path.exists(os.path.join(save_path, 'TCs')):
+		os.makedirs(os.path.join(save_path, 'TCs'))
+
+	for r in range(np.size(curves,0)):
+		fig, ax = plt.subplots()
+		plt.gca().set_color_cycle(cm.Paired(i) for i in np.linspace(0,0.8,10))
+		pref_ori_sorter = pref_ori[r, :].argsort()
+		probed = ~np.all(np.isnan(curves[r,:,:]),1) #only some orientations are probed with adaptive probing
+		curve_min, curve_max = np.min(curves[r,probed,:]), np.max(curves[r,probed,:])
 		
-			plt.savefig(os.path.join(save_path, 'TCs', 'TCs_' + name + '_' + str(r).zfill(3) + '.pdf'))
-			plt.close(fig)
+		ax.plot(np.arange(-90., 90., ori_step)[probed], curves[r,probed,:][:,pref_ori_sorter], lw=2)
+		ax.vlines(0, 0, curve_max*1.2, colors=u'k', linewidth=1.5, linestyle=':')
 
-	return curves, pref_ori
+		fig.patch.set_facecolor('white')
+		ax.spines['right'].set_visible(False)
+		ax.spines['top'].set_visible(False)
+		ax.xaxis.set_ticks_position('bottom')
+		ax.yaxis.set_ticks_position('left')
+		ax.set_xlabel('angle from target (deg)', fontsize=18)
+		ax.set_ylabel('response', fontsize=18)
+		ax.set_xlim([-90,90])
+		ax.set_ylim([curve_min-(curve_max-curve_min)*.1, curve_max+(curve_max-curve_min)*.1])
+		ax.tick_params(axis='both', which='major', direction='out', labelsize=16)
+		plt.tight_layout()
+	
+		plt.savefig(os.path.join(save_path, 'TCs', 'TCs_' + name + '_' + str(r).zfill(3) + '.pdf'))
+		plt.close(fig)
 
 def slopes(W, curves, pref_ori, t, target_ori, name, plot=False, save_path=''):
 	"""
@@ -153,7 +540,7 @@ def slopes(W, curves, pref_ori, t, target_ori, name, plot=False, save_path=''):
 
 	Args:
 		W (dict): dictionary of weight matrices (each element of the dictionary is a weight matrix from an individual run)
-		curves (dict): the tuning curves for each neuron of each run; *!!* for now does not support curves if computed with 'with_noise' method)
+		curves (dict): the tuning curves for each neuron of each run; *!!* for now does not support curves if computed with 'with_noise' method); with adaptive probing (see tuning_curves), slopes are NaN except at the orientations probed for slopes, and agree with those of dense probing within 1e-5 of the largest slope
 		pref_ori (dict): the preferred orientation of all neurons in all runs
 		t (float): temperature of the softmax function (t<<1: strong competition; t>=1: weak competition)
 		target_ori (float): target orientation on side of which to discrimate the gabor patches
@@ -2,25 +2,31 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 import helper.assess_network as an
+import external as ex
 import grating as gr
+import sweep_store as ss
+import result_cache as rc
 import plots.plot_vars as pv
 import hebbian_net
-import pypet
 import pickle
 import shutil
 import time
 from scipy import stats
 
 an = reload(an)
+ex = reload(ex)
 gr = reload(gr)
+ss = reload(ss)
+rc = reload(rc)
 pv = reload(pv)
 hebbian_net = reload(hebbian_net)
 
-def launch_exploration(traj, images_dict, labels_dict, images_params, save_path):
-	""" launch all the exploration of the parameters """
+def launch_exploration(traj, data_path, images_params, save_path):
+	""" launch all the exploration of the parameters; datasets are memory-mapped from data_path (see ex.publish_datasets) rather than copied into each worker """
 	parameter_dict = traj.parameters.f_to_dict(short_names=True, fast_access=True)
+	images_dict, labels_dict = ex.load_shared_datasets(data_path)
 	try:
-		test_perf, stat_diff = launch_one_exploration(parameter_dict, images_dict, labels_dict, images_params, save_path)
+		test_perf, stat_diff, _ = launch_one_exploration(parameter_dict, images_dict, labels_dict, images_params, save_path)
 	except ValueError:
 		test_perf = [-1.]
 		stat_diff = [-1.]	
@@ -28,22 +34,33 @@ def launch_exploration(traj, images_dict, labels_dict, images_params, save_path)
 	traj.f_add_result('test_perf', test_perf=test_perf)
 	traj.f_add_result('stat_diff', stat_diff=stat_diff)
 
-def launch_one_exploration(parameter_dict, images_dict, labels_dict, images_params, save_path):
-	""" launch one instance of the network """
+def launch_one_exploration(parameter_dict, images_dict, labels_dict, images_params, save_path, weights_dtype=None, cache=False, net=None):
+	""" launch one instance of the network; the network is saved in the results store of save_path (see ss.save_net), with weights optionally quantized to weights_dtype. If cache, a network already trained with the same parameters and data is taken from the result cache instead of being trained again, and newly trained networks are added to it as references to the results store (see rc.store). If net is given, its training is continued (e.g. from a paused shared prefix) instead of creating a new network from parameter_dict """
 
-	net = hebbian_net.Network(pypet=True, **parameter_dict)
+	if net is None:
+		net = hebbian_net.Network(pypet=True, **parameter_dict)
 
-	net.train(images_dict, labels_dict, images_params)
+	cache_key = rc.config_key(net, images_params, images_dict, labels_dict) if cache else None
+	if rc.has_result(cache_key, weights_dtype=weights_dtype):
+		net = rc.load_net(cache_key, net.name, pypet=True, pypet_name=net.pypet_name, mmap_mode='r')
+	else:
+		net.train(images_dict, labels_dict, images_params)
 
 	# CM_all, perf_all = net.test(images_dict['test'], labels_dict['test'])
 
-	p_file = open(os.path.join(save_path, 'networks', net.name), 'w')
-	pickle.dump(net, p_file)
-	p_file.close()
+	results = save_one_exploration(net, save_path, weights_dtype)
+	rc.store(cache_key, net, ref=save_path, weights_dtype=weights_dtype) #the cache refers to the network saved in the results store
+
+	return results
+
+def save_one_exploration(net, save_path, weights_dtype=None):
+	""" saves a trained network in the results store of save_path and returns its test performance, slope differences and training info """
+	ss.save_net(save_path, net, weights_dtype=weights_dtype)
 
 	stat_diff = plot_one_slope_diff(net, save_path)
+	info = {'runtime': net.runtime, 'n_epi_trained': np.sum(net.perf_train_prog!=-1, 1)}
 
-	return net.perf_all, stat_diff
+	return net.perf_all, stat_diff, info
 
 def add_parameters(traj, parameter_dict):
 	for k in parameter_dict.keys():
@@ -74,23 +91,10 @@ def plot_results(folder_path=''):
 		folder_path = '/Users/raphaelholca/Dropbox/hebbian_net/output/test_pypet_0/'
 		# folder_path = '/Users/raphaelholca/Mountpoint/hebbianRL/output/proba_two_lin/'
 
-	traj_name = 'explore_perf'
-	traj = pypet.load_trajectory(traj_name, filename=os.path.join(folder_path, 'explore_perf.hdf5'), force=True)
-	traj.v_auto_load = True
-
-	perf_all = []
-	for run in traj.f_iter_runs():
-		perf_all.append(traj.results[run].test_perf)
+	perf_all, _, param = load_results(folder_path)
 	perf_all = np.array(perf_all)
 	perf = np.mean(perf_all,1)
 
-	param_traj = traj.f_get_explored_parameters()
-	param = {}
-	for k in param_traj:
-		if k[11:] != 'name':
-			xplr_values = np.array(param_traj[k].f_get_range())
-			param[k[11:]] = xplr_values
-
 	arg_best = np.argmax(perf)
 
 	best_param = {}
@@ -170,12 +174,13 @@ def plot_one_slope_diff(net, save_path):
 		t = net.t_hid
 		target_ori = net.images_params['target_ori']
 
+		#compute tuning curves of the naive and trained networks together
+		[curves_naive, curves], [pref_ori_naive, pref_ori] = gr.tuning_curves([hid_W_naive, hid_W_trained], t, net.A, net.images_params, name, curve_method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
+
 		#compute RFs info for the naive network
-		curves_naive, pref_ori_naive = gr.tuning_curves(hid_W_naive, t, net.images_params, name, curve_method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
 		slopes_naive = gr.slopes(hid_W_naive, curves_naive, pref_ori_naive, t, target_ori, name, plot=False, save_path=plot_path)
 
 		#compute RFs info for the trained network
-		curves, pref_ori = gr.tuning_curves(hid_W_trained, t, net.images_params, name, curve_method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
 		slopes = gr.slopes(hid_W_trained, curves, pref_ori, t, target_ori, name, plot=False, save_path=plot_path)
 		
 		stat_diff = gr.slope_difference(slopes_naive['all_dist_from_target'], slopes_naive['all_slope_at_target'], slopes['all_dist_from_target'], slopes['all_slope_at_target'], name, plot=True, slope_binned=True, save_path=plot_path)
@@ -192,8 +197,7 @@ def plot_all_slope_diffs(save_path):
 	if not os.path.exists(plot_path):
 		os.makedirs(plot_path)
 	for n in sorted(os.listdir(net_path)):
-		n_file = open(os.path.join(net_path, n), 'r')
-		net = pickle.load(n_file)
+		net = ss.load_net(save_path, n)
 
 		name = net.name
 		hid_W_naive = net.hid_W_naive
@@ -201,20 +205,20 @@ def plot_all_slope_diffs(save_path):
 		t = net.t_hid
 		target_ori = net.images_params['target_ori']
 
+		#compute tuning curves of the naive and trained networks together
+		[curves_naive, curves], [pref_ori_naive, pref_ori] = gr.tuning_curves([hid_W_naive, hid_W_trained], t, net.A, net.images_params, name, curve_method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
+
 		#compute RFs info for the naive network
-		curves_naive, pref_ori_naive = gr.tuning_curves(hid_W_naive, t, target_ori, name, method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
 		slopes_naive = gr.slopes(hid_W_naive, curves_naive, pref_ori_naive, t, target_ori, name, plot=False, save_path=plot_path)
 
 		#compute RFs info for the trained network
-		curves, pref_ori = gr.tuning_curves(hid_W_trained, t, target_ori, name, method='no_softmax', plot=False, save_path=plot_path, log_weights=net.log_weights)
 		slopes = gr.slopes(hid_W_trained, curves, pref_ori, t, target_ori, name, plot=False, save_path=plot_path)
 		
 		print n
 		_ = gr.slope_difference(slopes_naive['all_dist_from_target'], slopes_naive['all_slope_at_target'], slopes['all_dist_from_target'], slopes['all_slope_at_target'], name, plot=True, slope_binned=True, save_path=plot_path)
 
 def launch_assess(save_path, file_name, images, labels, curve_method='with_noise', slope_binned=False):
-	net_file = open(os.path.join(save_path, 'networks', file_name), 'r')
-	best_net = pickle.load(net_file)
+	best_net = ss.load_net(save_path, file_name)
 	an.assess(best_net, curve_method=curve_method, slope_binned=slope_binned, save_path=os.path.join(save_path, 'best_net'), images=images, labels=labels)
 
 def bar_plot(best_param_all, best_perf_all=None):
@@ -270,18 +274,33 @@ def bar_plot(best_param_all, best_perf_all=None):
 
 	return fig, ax
 
-def import_traj(folder_path, file_name, order_face=None, traj_name='explore_perf'):
-	print "importing data..."
+def load_results(folder_path, file_name='explore_perf', traj_name='explore_perf'):
+	"""
+	Loads the results of a parameter exploration, either from a native sweep (see sweep.run_sweep) or from a pypet trajectory
+
+	Args:
+		folder_path (str): folder of the exploration
+		file_name (str, optional): name of the pypet hdf5 file (w/o extension). Default: 'explore_perf'
+		traj_name (str, optional): name of the pypet trajectory. Default: 'explore_perf'
+
+	returns:
+		(list): performance of all runs of each configuration
+		(list): slope differences of each configuration
+		(dict): explored values of each parameter for each configuration
+	"""
+	import sweep
+	if sweep.has_results(folder_path):
+		return sweep.load_results(folder_path)
+
+	import pypet
 	traj = pypet.load_trajectory(traj_name, filename=os.path.join(folder_path, file_name+'.hdf5'), force=True)
 	traj.v_auto_load = True
 
-	perc_correct = np.array([])
-	perc_correct_all = []
+	perf_all = []
 	stat_diff = []
 	ok_runs = []
 	for run in traj.f_iter_runs():
-		perc_correct = np.append(perc_correct, np.mean(traj.results[run].test_perf))
-		perc_correct_all.append(traj.results[run].test_perf)
+		perf_all.append(traj.results[run].test_perf)
 		stat_diff.append(traj.results[run].stat_diff)
 		ok_runs.append(int(run[4:]))
 
@@ -289,9 +308,19 @@ def import_traj(folder_path, file_name, order_face=None, traj_name='explore_perf
 	param = {}
 	for k in param_traj:
 		if k[11:] != 'name':
-			xplr_values = np.array(param_traj[k].f_get_range())[ok_runs]
-			if len(np.unique(xplr_values)) > 1:
-				param[k[11:]] = xplr_values
+			param[k[11:]] = np.array(param_traj[k].f_get_range())[ok_runs]
+
+	return perf_all, stat_diff, param
+
+def import_traj(folder_path, file_name, order_face=None, traj_name='explore_perf'):
+	print "importing data..."
+	perc_correct_all, stat_diff, param_all = load_results(folder_path, file_name, traj_name)
+	perc_correct = np.array([np.mean(p) for p in perc_correct_all])
+
+	param = {}
+	for k in param_all.keys():
+		if len(np.unique(param_all[k])) > 1:
+			param[k] = param_all[k]
 
 	return perc_correct, np.array(perc_correct_all), np.array(stat_diff), param
 
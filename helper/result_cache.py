@@ -0,0 +1,160 @@
+""" Support functions to cache the trained networks of past simulations, keyed by a hash of everything that determines the result of training: the parameters of the Network, the parameters and content of the datasets and the version of the training code """
+
+import os
+import sys
+import shutil
+import pickle
+import hashlib
+import numpy as np
+import external as ex
+import sweep_store as ss
+
+ex = reload(ex)
+ss = reload(ss)
+
+cache_path = os.path.join('output', 'result_cache')
+ignored_args = ['name', 'pypet_name', 'pypet', 'verbose'] #arguments of the Network that do not affect the result of training
+code_modules = ['hebbian_net', 'helper.external', 'helper.grating', 'helper.bayesian_decoder', 'helper.assess_network'] #modules whose source determines the result of training
+_code_version = {}
+
+def _canonical(obj):
+	""" converts obj to a hashable representation that does not depend on the order of dictionary keys nor on the type of numbers """
+	if isinstance(obj, dict):
+		return ('dict',) + tuple(sorted([(str(k), _canonical(v)) for k, v in obj.items()]))
+	elif isinstance(obj, np.ndarray):
+		return ('ndarray', obj.dtype.str, obj.shape, hashlib.sha1(np.ascontiguousarray(obj).view(np.uint8)).hexdigest())
+	elif isinstance(obj, (list, tuple)):
+		return ('list',) + tuple([_canonical(v) for v in obj])
+	elif isinstance(obj, (bool, np.bool_)):
+		return bool(obj)
+	elif isinstance(obj, (int, long, np.integer)):
+		return int(obj)
+	elif isinstance(obj, (float, np.floating)):
+		return repr(float(obj))
+	elif obj is None or isinstance(obj, basestring):
+		return obj
+	else:
+		return repr(obj)
+
+def code_version():
+	""" hash of the source code of the modules used for training (see code_modules) """
+	if 'version' not in _code_version:
+		sha = hashlib.sha1()
+		for module_name in code_modules:
+			module = sys.modules.get(module_name) or sys.modules.get(module_name.split('.')[-1])
+			if module is None:
+				module = __import__(module_name, fromlist=['_'])
+			with open(os.path.splitext(module.__file__)[0] + '.py', 'rb') as f:
+				sha.update(f.read())
+		_code_version['version'] = sha.hexdigest()
+
+	return _code_version['version']
+
+def config_key(net, images_params, images_dict, labels_dict):
+	"""
+	Computes the cache key of a Network before training
+
+	Args:
+		net (Network): Network to train, as created by its constructor
+		images_params (dict): parameters used to create the images
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+
+	returns:
+		(str): key of the Network; None if the result of training is not reproducible (no seed)
+	"""
+	args = {k: v for k, v in net._init_args.items() if k not in ignored_args}
+	if args['seed'] is None:
+		return None
+
+	init_file = args['init_file']
+	if init_file != '' and init_file is not None and init_file != 'NO_INIT':
+		net_file = os.path.join('output', init_file, 'Network')
+		args['init_file'] = (init_file, os.path.getsize(net_file), os.path.getmtime(net_file)) if os.path.isfile(net_file) else init_file
+
+	datasets = {k: (ex.dataset_fingerprint(images_dict[k], content=True) if images_dict[k] is not None else None, _canonical(labels_dict[k])) for k in images_dict.keys()}
+	key = (_canonical(args), _canonical(images_params), _canonical(datasets), code_version())
+
+	return hashlib.sha1(repr(key)).hexdigest()
+
+def _load_entry(key, folder=None):
+	""" entry of key in the cache; None if there is none """
+	entry_path = os.path.join(folder or cache_path, key, 'entry.pkl')
+	if not os.path.isfile(entry_path):
+		return None
+	with open(entry_path, 'rb') as f:
+		return pickle.load(f)
+
+def has_result(key, folder=None, weights_dtype=None):
+	"""
+	Whether the cache contains the Network of key. An entry that refers to a Network saved in a results store (see store) is only valid while that Network is unchanged, and only if its weights are stored at full precision or in weights_dtype
+
+	Args:
+		key (str): key of the Network (see config_key)
+		folder (str, optional): folder of the cache; cache_path if None. Default: None
+		weights_dtype (str, optional): data type of the weights accepted for the Network, e.g. 'float16'; full precision only if None. Default: None
+
+	returns:
+		(bool): whether a valid entry exists
+	"""
+	entry = _load_entry(key, folder) if key is not None else None
+	if entry is None:
+		return False
+	if 'ref' not in entry:
+		return True
+	net_file = os.path.join(entry['ref'], ss.networks_folder, entry['name'])
+
+	return entry['weights_dtype'] in [None, weights_dtype] and os.path.isfile(net_file) and os.path.getmtime(net_file) == entry['ref_mtime']
+
+def store(key, net, folder=None, ref=None, weights_dtype=None):
+	"""
+	Adds a trained Network to the cache; the entry is written to a temporary folder moved into place, so that concurrent writers and readers never see a partial entry. A Network already saved in a results store (e.g. by a sweep) is not copied: its entry only refers to it, so that the cache grows by a few bytes per configuration
+
+	Args:
+		key (str): key of the Network (see config_key); nothing is stored if None
+		net (Network): trained Network
+		folder (str, optional): folder of the cache; cache_path if None. Default: None
+		ref (str, optional): folder of the results store in which net is saved (see ss.save_net); the Network is saved in the cache if None. Default: None
+		weights_dtype (str, optional): data type in which the weights of net are saved in ref (see ss.save_net); full precision if None. Default: None
+	"""
+	if key is None or has_result(key, folder, weights_dtype): return
+	folder = folder or cache_path
+	tmp_path = os.path.join(folder, '.' + key + '.tmp%d' % os.getpid())
+	entry = {'name': net.name, 'runtime': net.runtime, 'code_version': code_version()}
+	if ref is None:
+		ss.save_net(tmp_path, net)
+	else:
+		if not os.path.isdir(tmp_path):
+			os.makedirs(tmp_path)
+		entry.update({'ref': os.path.abspath(ref), 'ref_mtime': os.path.getmtime(os.path.join(ref, ss.networks_folder, net.name)), 'weights_dtype': weights_dtype})
+	with open(os.path.join(tmp_path, 'entry.pkl'), 'wb') as f:
+		pickle.dump(entry, f, protocol=2)
+	shutil.rmtree(os.path.join(folder, key), ignore_errors=True) #stale entry (e.g. referring to a Network since overwritten)
+	try:
+		os.rename(tmp_path, os.path.join(folder, key))
+	except OSError: #stored concurrently
+		shutil.rmtree(tmp_path, ignore_errors=True)
+
+def load_net(key, name, pypet=False, pypet_name='', folder=None, mmap_mode=None):
+	"""
+	Loads a trained Network from the cache and renames it
+
+	Args:
+		key (str): key of the Network (see config_key)
+		name (str): new name of the Network
+		pypet (bool, optional): whether the Network is part of a parameter exploration. Default: False
+		pypet_name (str, optional): name of the parameter exploration. Default: ''
+		folder (str, optional): folder of the cache; cache_path if None. Default: None
+		mmap_mode (str, optional): memory-map mode of the arrays of the Network (see np.load); loaded into memory if None. Default: None
+
+	returns:
+		(Network): the Network
+	"""
+	entry = _load_entry(key, folder)
+	net = ss.load_net(entry.get('ref', os.path.join(folder or cache_path, key)), entry['name'], mmap_mode=mmap_mode)
+	del net._stored_arrays
+	net.name = name
+	net.pypet = pypet
+	net.pypet_name = pypet_name if pypet_name != '' else name
+
+	return net
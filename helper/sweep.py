@@ -0,0 +1,715 @@
+""" Support functions to explore the parameters of the hebbian neural network with a native process pool (alternative to pypet); configurations are scheduled dynamically, longest expected first, and results are streamed to disk as they finish """
+
+import os
+import sys
+import time
+import copy
+import pickle
+import datetime
+import itertools
+import traceback
+import multiprocessing
+import Queue
+import select
+import shutil
+import warnings
+import numpy as np
+import hebbian_net
+from scipy import stats
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+import external as ex
+import pypet_helper as pp
+import sweep_store as ss
+import result_cache as rc
+
+hebbian_net = reload(hebbian_net)
+ex = reload(ex)
+pp = reload(pp)
+ss = reload(ss)
+rc = reload(rc)
+
+_prefix_snapshots = {} #networks paused at the end of a shared prefix, inherited by the worker processes forked after they are trained (see run_sweep)
+
+def expand_configs(parameter_dict, explore_dict, mode='cartesian'):
+	"""
+	Creates the parameters of all configurations of a sweep
+
+	Args:
+		parameter_dict (dict): static parameters of the Network
+		explore_dict (dict): explored parameters, with a list of values for each parameter
+		mode (str, optional): 'cartesian' to explore all combinations of the values, 'list' to explore the i-th values of all parameters together (lists must be of the same length). Default: 'cartesian'
+
+	returns:
+		(list): parameters of each configuration (dict), with a unique 'name'
+		(dict): explored values of each parameter for each configuration
+	"""
+	keys = sorted(explore_dict.keys())
+	if mode=='cartesian':
+		combinations = list(itertools.product(*[explore_dict[k] for k in keys]))
+	elif mode=='list':
+		if len(set([len(explore_dict[k]) for k in keys])) > 1:
+			raise ValueError('explored parameters must have the same number of values in \'list\' mode')
+		combinations = zip(*[explore_dict[k] for k in keys])
+	else:
+		raise ValueError( '\'' + mode +  '\' not a legal mode value. Legal values are: \'cartesian\' and \'list\'.')
+
+	explored = {k: [c[ik] for c in combinations] for ik, k in enumerate(keys)}
+	names = pp.set_run_names(explored, parameter_dict['name'])
+
+	configs = []
+	for ic, c in enumerate(combinations):
+		params = parameter_dict.copy()
+		params.update(dict(zip(keys, c)))
+		params['name'] = names[ic]
+		params['pypet_name'] = parameter_dict['name']
+		configs.append(params)
+
+	return configs, explored
+
+def prefix_groups(configs):
+	"""
+	Groups the configurations that only differ in parameters of the perceptual learning period (see Network.perc_params): with the same seed, their critical and fine-tuning periods are identical and can be trained once for the whole group. Configurations whose earlier periods depend on these parameters (classifier 'neural_dopa', pairing protocol) are not grouped
+
+	Args:
+		configs (list): parameters of each configuration (dict)
+
+	returns:
+		(list): indices of the configurations of each group (lists), groups of one configuration included
+	"""
+	groups = {}
+	for ic, params in enumerate(configs):
+		if params['n_epi_crit'] + params['n_epi_fine'] == 0 or params.get('classifier', 'neural_prob')=='neural_dopa' or params.get('pairing_class') is not None:
+			key = ('not_shared', ic)
+		else:
+			key = repr(sorted([(k, v) for k, v in params.items() if k not in hebbian_net.Network.perc_params + ['name']]))
+		groups.setdefault(key, []).append(ic)
+
+	return sorted(groups.values())
+
+def expected_cost(params):
+	""" relative expected training time of a configuration, used to schedule the longest configurations first """
+	n_epi_tot = params['n_epi_crit'] + params['n_epi_fine'] + params['n_epi_perc'] + params['n_epi_post']
+	cost = float(params['n_runs']) * n_epi_tot * params['n_hid_neurons']
+	if params.get('test_each_epi', False): cost *= 2.
+
+	return cost
+
+def run_sweep(parameter_dict, explore_dict, images_dict, labels_dict, images_params, save_path, mode='cartesian', n_processes=None, weights_dtype=None, cache=True, share_prefix=True, verbose=True):
+	"""
+	Trains the Network for all configurations of a sweep on a pool of processes; each finished configuration is written to the results store of save_path (see sweep_store), and a configuration raising an error is recorded as failed without stopping the sweep
+
+	Args:
+		parameter_dict (dict): static parameters of the Network
+		explore_dict (dict): explored parameters, with a list of values for each parameter
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		images_params (dict): parameters used to create the images
+		save_path (str): folder in which to save the results (see pp.check_dir)
+		mode (str, optional): how to combine the explored values (see expand_configs). Default: 'cartesian'
+		n_processes (int, optional): number of worker processes; number of cores if None. Default: None
+		weights_dtype (str, optional): data type in which to store the weights, e.g. 'float16'; original type if None. Default: None
+		cache (bool, optional): whether to take configurations already trained (in this or another sweep, or with launch.py) from the result cache instead of training them again, and to add the newly trained ones to it (see result_cache); an interrupted sweep is thus resumed by launching it again. Default: True
+		share_prefix (bool, optional): whether to train the critical and fine-tuning periods once for each group of configurations that only differ in parameters of the perceptual learning period (see prefix_groups); each configuration then continues from a copy of the paused network of its group, inherited by the worker processes when they are forked. Default: True
+		verbose (bool, optional): whether to report progress and throughput. Default: True
+
+	returns:
+		(list): result of each configuration (dict), in the order of completion
+	"""
+	configs, _ = expand_configs(parameter_dict, explore_dict, mode)
+	if not os.path.isdir(os.path.join(save_path, 'networks')):
+		os.makedirs(os.path.join(save_path, 'networks'))
+	data_path = ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets'))
+
+	n_processes = n_processes or multiprocessing.cpu_count()
+	prefixes = _train_prefixes(configs, images_dict, labels_dict, data_path, images_params, n_processes, cache, weights_dtype) if share_prefix else {}
+
+	explored_keys = sorted(explore_dict.keys())
+	jobs = [(ic, params, explored_keys, data_path, images_params, save_path, weights_dtype, cache, prefixes.get(ic)) for ic, params in enumerate(configs)]
+	jobs.sort(key=lambda job: -expected_cost(job[1])) #longest expected job first; stable for equal costs
+
+	pool = multiprocessing.Pool(processes=min(n_processes, len(jobs))) #forked after the prefixes are trained, so that workers share them
+	records = []
+	tic = time.time()
+	try:
+		for record in pool.imap_unordered(_run_config, jobs, chunksize=1): #dynamic load balancing: a worker takes the next job as soon as it is free
+			ss.write_row(save_path, record)
+			records.append(record)
+			if verbose: _print_progress(record, len(records), len(jobs), time.time()-tic)
+		pool.close()
+		ss.compact(save_path)
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+		shutil.rmtree(data_path, ignore_errors=True)
+		_prefix_snapshots.clear()
+
+	return records
+
+def _train_prefixes(configs, images_dict, labels_dict, data_path, images_params, n_processes, cache, weights_dtype=None):
+	""" trains the shared prefix of each group of configurations (see prefix_groups) on a pool of processes and keeps the paused networks in _prefix_snapshots; returns the group of each configuration that continues from a prefix. Configurations already in the result cache are left out, and the configurations of a group whose prefix fails are trained from scratch """
+	cached = [cache and rc.has_result(rc.config_key(hebbian_net.Network(pypet=True, **params), images_params, images_dict, labels_dict), weights_dtype=weights_dtype) for params in configs]
+	groups = [[ic for ic in g if not cached[ic]] for g in prefix_groups(configs)]
+	groups = [g for g in groups if len(g) > 1]
+	if groups == []: return {}
+
+	pool = multiprocessing.Pool(processes=min(n_processes, len(groups)))
+	try:
+		snapshots = pool.map(_train_prefix, [(configs[g[0]], data_path, images_params) for g in groups], chunksize=1)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+	prefixes = {}
+	for ig, (g, snapshot) in enumerate(zip(groups, snapshots)):
+		if snapshot is None: continue
+		_prefix_snapshots[ig] = snapshot
+		prefixes.update({ic: ig for ic in g})
+
+	return prefixes
+
+def _train_prefix(job):
+	""" trains a Network up to the end of its fine-tuning period in a worker process and returns the paused Network; None if training fails """
+	params, data_path, images_params = job
+	images_dict, labels_dict = ex.load_shared_datasets(data_path)
+	try:
+		net = hebbian_net.Network(pypet=True, **params)
+		net.train(images_dict, labels_dict, images_params, stop_epi=params['n_epi_crit']+params['n_epi_fine'])
+	except Exception:
+		return None
+
+	return net
+
+def _run_config(job):
+	""" trains the Network of one configuration in a worker process; errors are caught and returned as part of the result """
+	index, params, explored_keys, data_path, images_params, save_path, weights_dtype, cache, prefix = job
+	tic = time.time()
+	try:
+		images_dict, labels_dict = ex.load_shared_datasets(data_path)
+		net = None
+		if prefix in _prefix_snapshots: #continue from a copy of the shared prefix
+			net = copy.deepcopy(_prefix_snapshots[prefix])
+			net.update_params(**{k: params[k] for k in hebbian_net.Network.perc_params + ['name', 'pypet_name'] if k in params})
+		record = {'index': index, 'name': params['name'], 'params': params, 'explored': {k: params[k] for k in explored_keys}, 'error': None}
+		record['test_perf'], record['stat_diff'], info = pp.launch_one_exploration(params, images_dict, labels_dict, images_params, save_path, weights_dtype=weights_dtype, cache=cache, net=net)
+		record['n_epi_trained'] = info['n_epi_trained']
+		record['runtime'] = time.time() - tic
+	except Exception:
+		record = _failed_record(index, params, explored_keys, traceback.format_exc(), time.time() - tic)
+
+	return record
+
+def _failed_record(index, params, explored_keys, error, runtime):
+	""" result of a configuration whose training failed with error (str) """
+	return {'index': index, 'name': params['name'], 'params': params, 'explored': {k: params[k] for k in explored_keys}, 'error': error, 'test_perf': np.ones(params['n_runs'])*-1., 'stat_diff': None, 'n_epi_trained': None, 'runtime': runtime}
+
+def _search_worker(conn):
+	""" worker process of run_search: trains the configurations received on conn (see _run_config) and sends back their results, until it receives None """
+	for job in iter(conn.recv, None):
+		conn.send(_run_config(job))
+
+def _start_search_worker():
+	""" starts a worker process of run_search; returns the process and the parent's end of its connection """
+	conn, child_conn = multiprocessing.Pipe()
+	process = multiprocessing.Process(target=_search_worker, args=(child_conn,))
+	process.daemon = True
+	process.start()
+	child_conn.close() #the connection then reaches its end as soon as the worker process dies
+	return process, conn
+
+def halving_rungs(params, n_rungs=3, eta=3):
+	"""
+	Computes the checkpoints of a configuration in a successive-halving sweep: the configuration is trained with a fraction of its runs up to a fraction of its perceptual learning episodes at each rung, both growing by a factor eta from one rung to the next; the last rung trains all runs to the end. The numbers of runs and episodes strictly increase from one rung to the next, down to a minimum of 1 run and 1 episode for the first rungs of configurations with fewer runs or episodes than rungs
+
+	Args:
+		params (dict): parameters of the configuration
+		n_rungs (int, optional): number of rungs. Default: 3
+		eta (int, optional): reduction factor between rungs. Default: 3
+
+	returns:
+		(list): episode before which the runs stop and number of runs trained at each rung (tuples)
+	"""
+	n_epi_pre = params['n_epi_crit'] + params['n_epi_fine']
+	n_epi_tot = n_epi_pre + params['n_epi_perc'] + params['n_epi_post']
+	rungs = [(n_epi_tot, params['n_runs'])]
+	for k in range(n_rungs-2, -1, -1): #from the last rung backward
+		reduction = float(eta**(n_rungs-1-k))
+		stop_next, n_runs_next = rungs[0]
+		stop_epi = min(n_epi_tot, max(n_epi_pre + 1, min(stop_next - 1, n_epi_pre + int(np.ceil((n_epi_tot-n_epi_pre)/reduction)))))
+		n_runs = max(1, min(n_runs_next - 1, int(np.ceil(params['n_runs']/reduction))))
+		rungs.insert(0, (stop_epi, n_runs))
+
+	return rungs
+
+def run_halving(parameter_dict, explore_dict, images_dict, labels_dict, images_params, save_path, mode='cartesian', n_rungs=3, eta=3, n_processes=None, weights_dtype=None, verbose=True):
+	"""
+	Explores the parameters with successive halving: all configurations are trained for a few episodes and runs, and only the best 1/eta of them are promoted to the next rung and resume their training from where they stopped (see halving_rungs); the configurations that complete the last rung are saved as in run_sweep and the pruned ones are recorded with their score and the rung at which they were stopped ('pruned_at'), with a test performance of -1
+
+	Args:
+		parameter_dict (dict): static parameters of the Network
+		explore_dict (dict): explored parameters, with a list of values for each parameter
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		images_params (dict): parameters used to create the images
+		save_path (str): folder in which to save the results (see pp.check_dir)
+		mode (str, optional): how to combine the explored values (see expand_configs). Default: 'cartesian'
+		n_rungs (int, optional): number of rungs. Default: 3
+		eta (int, optional): reduction factor between rungs. Default: 3
+		n_processes (int, optional): number of worker processes; number of cores if None. Default: None
+		weights_dtype (str, optional): data type in which to store the weights, e.g. 'float16'; original type if None. Default: None
+		verbose (bool, optional): whether to report progress and throughput. Default: True
+
+	returns:
+		(list): result of each configuration (dict), in the order of completion
+	"""
+	configs, _ = expand_configs(parameter_dict, explore_dict, mode)
+	for folder in ['networks', 'halving']:
+		if not os.path.isdir(os.path.join(save_path, folder)):
+			os.makedirs(os.path.join(save_path, folder))
+	data_path = ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets'))
+
+	explored_keys = sorted(explore_dict.keys())
+	alive = range(len(configs))
+	n_processes = n_processes or multiprocessing.cpu_count()
+	pool = multiprocessing.Pool(processes=min(n_processes, len(configs)))
+	records = []
+	tic = time.time()
+	try:
+		for rung in range(n_rungs):
+			jobs = [(ic, configs[ic], explored_keys, data_path, images_params, save_path, weights_dtype, rung, halving_rungs(configs[ic], n_rungs, eta)) for ic in alive]
+			jobs.sort(key=lambda job: -expected_cost(job[1]))
+			rung_records = []
+			for record in pool.imap_unordered(_run_rung, jobs, chunksize=1):
+				rung_records.append(record)
+				if rung==n_rungs-1 or record['error'] is not None: #configuration completed or failed
+					ss.write_row(save_path, record)
+					records.append(record)
+					if verbose: _print_progress(record, len(records), len(configs), time.time()-tic)
+
+			#promote the best configurations to the next rung and record the others as pruned
+			if rung < n_rungs-1:
+				ranked = sorted([r for r in rung_records if r['error'] is None], key=lambda r: -r['halving_score'])
+				n_promoted = int(np.ceil(len(ranked)/float(eta)))
+				alive = sorted([r['index'] for r in ranked[:n_promoted]])
+				for record in ranked[n_promoted:]:
+					record['pruned_at'] = rung
+					ss.write_row(save_path, record)
+					records.append(record)
+					os.remove(os.path.join(save_path, 'halving', record['name'] + '.pkl'))
+					if verbose: _print_progress(record, len(records), len(configs), time.time()-tic)
+		pool.close()
+		ss.compact(save_path)
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+		shutil.rmtree(data_path, ignore_errors=True)
+		shutil.rmtree(os.path.join(save_path, 'halving'), ignore_errors=True)
+
+	return records
+
+def _run_rung(job):
+	""" trains the Network of one configuration up to the checkpoint of a rung of successive halving in a worker process, resuming from the state saved at the previous rung; errors are caught and returned as part of the result """
+	index, params, explored_keys, data_path, images_params, save_path, weights_dtype, rung, rungs = job
+	images_dict, labels_dict = ex.load_shared_datasets(data_path)
+	state_file = os.path.join(save_path, 'halving', params['name'] + '.pkl')
+	record = {'index': index, 'name': params['name'], 'params': params, 'explored': {k: params[k] for k in explored_keys}, 'error': None, 'rung': rung}
+	tic = time.time()
+	try:
+		if rung==0:
+			net = hebbian_net.Network(pypet=True, **params)
+		else:
+			with open(state_file, 'rb') as f:
+				net = pickle.load(f)
+		stop_epi, n_runs = rungs[rung]
+		if rung==len(rungs)-1:
+			net.train(images_dict, labels_dict, images_params)
+			record['test_perf'], record['stat_diff'], info = pp.save_one_exploration(net, save_path, weights_dtype)
+			if os.path.isfile(state_file): os.remove(state_file)
+		else:
+			net.train(images_dict, labels_dict, images_params, runs=range(n_runs), stop_epi=stop_epi)
+			with open(state_file, 'wb') as f:
+				pickle.dump(net, f, protocol=2)
+			record['test_perf'] = np.ones(params['n_runs'])*-1.
+			record['stat_diff'] = None
+		perf_prog = net.perf_test_prog if net.test_each_epi else net.perf_train_prog
+		record['halving_score'] = np.mean([p[p!=-1][-1] for p in perf_prog[:n_runs] if (p!=-1).any()] or [-1.]) #last performance reached by each run trained so far
+		record['n_epi_trained'] = np.sum(net.perf_train_prog!=-1, 1)
+		record['runtime'] = net.runtime
+	except Exception:
+		record['test_perf'] = np.ones(params['n_runs'])*-1.
+		record['stat_diff'] = None
+		record['n_epi_trained'] = None
+		record['error'] = traceback.format_exc()
+		record['runtime'] = time.time() - tic
+
+	return record
+
+def compare_to_best(perf_best, perf, confidence=0.95, diff_tol=0.005):
+	"""
+	Compares the performance of the runs of a configuration to that of the best configuration with the confidence interval of the difference of their means (Welch's t-test)
+
+	Args:
+		perf_best (numpy array): performance of the runs of the best configuration
+		perf (numpy array): performance of the runs of the configuration
+		confidence (float, optional): confidence level of the interval. Default: 0.95
+		diff_tol (float, optional): difference in performance below which configurations are considered equivalent. Default: 0.005
+
+	returns:
+		(str): 'different' if the interval excludes 0, 'equivalent' if it lies within +/- diff_tol, 'undecided' otherwise (or if a configuration has less than two runs)
+	"""
+	n_best, n = float(len(perf_best)), float(len(perf))
+	if n_best < 2 or n < 2:
+		return 'undecided'
+	diff = np.mean(perf_best) - np.mean(perf)
+	var_best, var = np.var(perf_best, ddof=1)/n_best, np.var(perf, ddof=1)/n
+	std_err = np.sqrt(var_best + var)
+	if std_err == 0:
+		return 'different' if diff != 0 else 'equivalent'
+	dof = (var_best + var)**2 / (var_best**2/(n_best-1) + var**2/(n-1))
+	half_width = stats.t.ppf((1.+confidence)/2., dof) * std_err
+	if abs(diff) > half_width:
+		return 'different'
+	elif abs(diff) + half_width < diff_tol:
+		return 'equivalent'
+	else:
+		return 'undecided'
+
+def run_adaptive(parameter_dict, explore_dict, images_dict, labels_dict, images_params, save_path, mode='cartesian', min_runs=3, confidence=0.95, diff_tol=0.005, n_processes=None, weights_dtype=None, verbose=True):
+	"""
+	Explores the parameters with an adaptive number of runs per configuration: all configurations are trained for min_runs runs, and runs are then added one at a time to the configurations whose performance cannot yet be told apart from that of the best configuration (see compare_to_best), up to the 'n_runs' of the parameters; the best configuration gets runs for as long as others do. Finished configurations keep their completed runs only (see Network.keep_runs) and are saved as in run_sweep, with the number of runs trained in 'n_runs_trained'
+
+	Args:
+		parameter_dict (dict): static parameters of the Network; 'n_runs' is the maximum number of runs of a configuration
+		explore_dict (dict): explored parameters, with a list of values for each parameter
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		images_params (dict): parameters used to create the images
+		save_path (str): folder in which to save the results (see pp.check_dir)
+		mode (str, optional): how to combine the explored values (see expand_configs). Default: 'cartesian'
+		min_runs (int, optional): number of runs of all configurations. Default: 3
+		confidence (float, optional): confidence level of the comparisons with the best configuration. Default: 0.95
+		diff_tol (float, optional): difference in performance below which configurations are considered equivalent. Default: 0.005
+		n_processes (int, optional): number of worker processes; number of cores if None. Default: None
+		weights_dtype (str, optional): data type in which to store the weights, e.g. 'float16'; original type if None. Default: None
+		verbose (bool, optional): whether to report progress and throughput. Default: True
+
+	returns:
+		(list): result of each configuration (dict), in the order of completion
+	"""
+	configs, _ = expand_configs(parameter_dict, explore_dict, mode)
+	for folder in ['networks', 'adaptive']:
+		if not os.path.isdir(os.path.join(save_path, folder)):
+			os.makedirs(os.path.join(save_path, folder))
+	data_path = ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets'))
+
+	explored_keys = sorted(explore_dict.keys())
+	n_runs = {ic: min(min_runs, params['n_runs']) for ic, params in enumerate(configs)}
+	run_perf = {}
+	active = range(len(configs))
+	finished = []
+	n_processes = n_processes or multiprocessing.cpu_count()
+	pool = multiprocessing.Pool(processes=min(n_processes, len(configs)))
+	records = []
+	tic = time.time()
+	try:
+		while active != [] or finished != []:
+			jobs = [(ic, configs[ic], explored_keys, data_path, images_params, save_path, weights_dtype, n_runs[ic], False) for ic in active]
+			jobs += [(ic, configs[ic], explored_keys, data_path, images_params, save_path, weights_dtype, n_runs[ic], True) for ic in finished]
+			jobs.sort(key=lambda job: -expected_cost(job[1]))
+			for record in pool.imap_unordered(_run_runs, jobs, chunksize=1):
+				if record['error'] is not None and record['index'] in active:
+					active.remove(record['index'])
+				if 'test_perf' in record: #configuration finished or failed
+					ss.write_row(save_path, record)
+					records.append(record)
+					if verbose: _print_progress(record, len(records), len(configs), time.time()-tic)
+				else:
+					run_perf[record['index']] = record['run_perf']
+
+			#finish the configurations that are told apart from the best one or that reached their maximum number of runs, and add a run to the others
+			best = max(run_perf.keys(), key=lambda ic: np.mean(run_perf[ic])) if run_perf != {} else None
+			finished = [ic for ic in active if ic != best and (n_runs[ic] >= configs[ic]['n_runs'] or compare_to_best(run_perf[best], run_perf[ic], confidence, diff_tol) != 'undecided')]
+			active = [ic for ic in active if ic not in finished]
+			if best in active and (active == [best] or n_runs[best] >= configs[best]['n_runs']):
+				finished.append(best)
+				active.remove(best)
+			for ic in active:
+				n_runs[ic] += 1
+		pool.close()
+		ss.compact(save_path)
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+		shutil.rmtree(data_path, ignore_errors=True)
+		shutil.rmtree(os.path.join(save_path, 'adaptive'), ignore_errors=True)
+
+	return records
+
+def _run_runs(job):
+	""" trains the first runs of the Network of one configuration in a worker process, continuing the Network saved by the previous call, and returns their test performance; if finish, the Network is saved with these runs only and the result of the configuration is returned. Errors are caught and returned as part of the result """
+	index, params, explored_keys, data_path, images_params, save_path, weights_dtype, n_runs, finish = job
+	images_dict, labels_dict = ex.load_shared_datasets(data_path)
+	state_file = os.path.join(save_path, 'adaptive', params['name'] + '.pkl')
+	record = {'index': index, 'name': params['name'], 'params': params, 'explored': {k: params[k] for k in explored_keys}, 'error': None}
+	tic = time.time()
+	try:
+		if os.path.isfile(state_file):
+			with open(state_file, 'rb') as f:
+				net = pickle.load(f)
+		else:
+			net = hebbian_net.Network(pypet=True, **params)
+		if not finish:
+			net.train(images_dict, labels_dict, images_params, runs=range(n_runs))
+			with open(state_file, 'wb') as f:
+				pickle.dump(net, f, protocol=2)
+			record['run_perf'] = net.perf_all[:n_runs]
+		else:
+			net.keep_runs(n_runs)
+			record['test_perf'], record['stat_diff'], info = pp.save_one_exploration(net, save_path, weights_dtype)
+			record['n_epi_trained'] = info['n_epi_trained']
+			record['n_runs_trained'] = n_runs
+			record['runtime'] = net.runtime
+			os.remove(state_file)
+	except Exception:
+		record['test_perf'] = np.ones(params['n_runs'])*-1.
+		record['stat_diff'] = None
+		record['n_epi_trained'] = None
+		record['error'] = traceback.format_exc()
+		record['runtime'] = time.time() - tic
+
+	return record
+
+def search_values(search_space, x):
+	"""
+	Converts a point of the unit hypercube to values of the searched parameters
+
+	Args:
+		search_space (dict): bounds of each searched parameter, as (low, high) or (low, high, 'log') to search on a log scale; parameters with integer bounds take integer values
+		x (numpy array): point of the unit hypercube, one dimension per parameter in sorted order
+
+	returns:
+		(dict): value of each parameter, rounded to 4 significant digits
+	"""
+	values = {}
+	for ik, k in enumerate(sorted(search_space.keys())):
+		low, high = search_space[k][:2]
+		if tuple(search_space[k][2:]) == ('log',):
+			v = np.exp(np.log(low) + x[ik]*(np.log(high)-np.log(low)))
+		else:
+			v = low + x[ik]*(high-low)
+		values[k] = int(round(v)) if isinstance(low, int) and isinstance(high, int) else float('%.4g' % v)
+
+	return values
+
+def search_point(search_space, values):
+	""" converts values of the searched parameters to a point of the unit hypercube (inverse of search_values) """
+	x = np.zeros(len(search_space))
+	for ik, k in enumerate(sorted(search_space.keys())):
+		low, high = search_space[k][:2]
+		if tuple(search_space[k][2:]) == ('log',):
+			x[ik] = (np.log(values[k])-np.log(low))/(np.log(high)-np.log(low))
+		else:
+			x[ik] = (values[k]-low)/float(high-low)
+
+	return x
+
+def propose_point(X, y, X_pending, rng, n_candidates=2000, xi=0.01):
+	"""
+	Proposes the next point to evaluate by maximizing the expected improvement of a Gaussian process fitted to the evaluated points; points still being evaluated are given the worst performance observed so far (constant liar), which steers parallel proposals away from each other
+
+	Args:
+		X (numpy array): evaluated points of the unit hypercube (points x dimensions)
+		y (numpy array): performance of the evaluated points
+		X_pending (numpy array): points being evaluated
+		rng (RandomState): random number generator
+		n_candidates (int, optional): number of random candidate points on which the expected improvement is computed. Default: 2000
+		xi (float, optional): minimum improvement sought, trading exploitation for exploration. Default: 0.01
+
+	returns:
+		(numpy array): proposed point
+	"""
+	n_dim = X.shape[1]
+	if len(y) < 2:
+		return rng.random_sample(n_dim)
+	X_fit = np.concatenate((X, np.reshape(X_pending, (-1, n_dim))))
+	y_fit = np.append(y, np.ones(len(X_fit)-len(X))*np.min(y))
+
+	kernel = ConstantKernel(1.0) * Matern(length_scale=np.ones(n_dim)*0.3, length_scale_bounds=(1e-2, 1e1), nu=2.5) + WhiteKernel(noise_level=1e-2, noise_level_bounds=(1e-6, 1e0))
+	gp = GaussianProcessRegressor(kernel, normalize_y=True, n_restarts_optimizer=2, random_state=rng)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		gp.fit(X_fit, y_fit)
+
+	#random candidates and candidates around the best point
+	candidates = np.concatenate((rng.random_sample((n_candidates, n_dim)), np.clip(X[np.argmax(y)] + rng.normal(0, 0.05, (n_candidates/4, n_dim)), 0., 1.)))
+	mean, std = gp.predict(candidates, return_std=True)
+	improvement = mean - np.max(y_fit) - xi
+	with np.errstate(divide='ignore', invalid='ignore'):
+		z = improvement/std
+		expected_improvement = improvement*stats.norm.cdf(z) + std*stats.norm.pdf(z)
+	expected_improvement[std==0] = 0.
+
+	return candidates[np.argmax(expected_improvement)]
+
+def run_search(parameter_dict, search_space, images_dict, labels_dict, images_params, save_path, n_evals=50, n_init=None, time_budget=None, n_processes=None, weights_dtype=None, cache=True, seed=None, verbose=True):
+	"""
+	Searches the parameters with a surrogate model: configurations are first drawn from a latin hypercube, and then proposed one at a time from the expected improvement of a Gaussian process fitted to the completed configurations (see propose_point), as soon as a worker process is free. Every configuration is saved as in run_sweep, with the searched parameters as explored parameters
+
+	Args:
+		parameter_dict (dict): static parameters of the Network
+		search_space (dict): bounds of each searched parameter (see search_values)
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		images_params (dict): parameters used to create the images
+		save_path (str): folder in which to save the results (see pp.check_dir)
+		n_evals (int, optional): maximum number of configurations to train. Default: 50
+		n_init (int, optional): number of configurations drawn from the latin hypercube; 2 per searched parameter + 1 (at least the number of processes) if None. Default: None
+		time_budget (float, optional): time (in seconds) after which no configuration is started anymore; no limit if None. Default: None
+		n_processes (int, optional): number of worker processes; number of cores if None. Default: None
+		weights_dtype (str, optional): data type in which to store the weights, e.g. 'float16'; original type if None. Default: None
+		cache (bool, optional): whether to use the result cache (see run_sweep). Default: True
+		seed (int, optional): seed of the random number generator of the search. Default: None
+		verbose (bool, optional): whether to report progress and throughput. Default: True
+
+	returns:
+		(list): result of each configuration (dict), in the order of completion
+	"""
+	for k, bounds in search_space.items():
+		if not bounds[0] < bounds[1] or tuple(bounds[2:]) not in [(), ('log',)] or (tuple(bounds[2:]) == ('log',) and bounds[0] <= 0):
+			raise ValueError('illegal bounds for \'' + k + '\': ' + str(bounds))
+	keys = sorted(search_space.keys())
+	rng = np.random.RandomState(seed)
+	n_processes = n_processes or multiprocessing.cpu_count()
+	n_init = n_init or max(2*len(keys)+1, n_processes)
+	init_points = (np.argsort(rng.random_sample((n_init, len(keys))), axis=0) + rng.random_sample((n_init, len(keys))))/n_init #latin hypercube
+
+	if not os.path.isdir(os.path.join(save_path, 'networks')):
+		os.makedirs(os.path.join(save_path, 'networks'))
+	data_path = ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets'))
+
+	idle = [] #worker processes waiting for a configuration (process, connection)
+	pending = {} #worker process, parameters and start time of each configuration being trained
+	done = [] #results of configurations that failed before reaching a worker process
+	X, y, X_pending = np.zeros((0, len(keys))), np.zeros(0), {}
+	names = set()
+	records = []
+	tic = time.time()
+	try:
+		while True:
+			#start new configurations while workers are free and within budget
+			while len(X_pending) < n_processes and len(records) + len(X_pending) < n_evals and (time_budget is None or time.time()-tic < time_budget):
+				index = len(records) + len(X_pending)
+				x = init_points[index] if index < n_init else propose_point(X, y, X_pending.values(), rng)
+				values = search_values(search_space, x)
+				params = parameter_dict.copy()
+				params.update(values)
+				params['name'] = pp.set_run_names({k: [values[k]] for k in keys}, parameter_dict['name'])[0]
+				if params['name'] in names: params['name'] += '_' + str(index)
+				params['pypet_name'] = parameter_dict['name']
+				names.add(params['name'])
+				X_pending[index] = search_point(search_space, values)
+				worker = idle.pop() if idle != [] else _start_search_worker()
+				try:
+					worker[1].send((index, params, keys, data_path, images_params, save_path, weights_dtype, cache, None))
+				except Exception: #e.g. the parameters cannot be pickled
+					done.append(_failed_record(index, params, keys, traceback.format_exc(), 0.))
+					idle.append(worker)
+				else:
+					pending[index] = (worker, params, time.time())
+			if X_pending == {}: break
+
+			#wait for a configuration to finish; a configuration whose worker process dies is recorded as failed
+			record = done.pop() if done != [] else _wait_config(pending, keys, idle)
+			x = X_pending.pop(record['index'])
+			if record['error'] is None:
+				record['search_score'] = np.mean(record['test_perf'])
+				X, y = np.concatenate((X, x[np.newaxis,:])), np.append(y, record['search_score'])
+			ss.write_row(save_path, record)
+			records.append(record)
+			if verbose: _print_progress(record, len(records), n_evals, time.time()-tic)
+		for process, conn in idle:
+			conn.send(None)
+			process.join()
+		ss.compact(save_path)
+	except:
+		for process, conn in idle + [worker for worker, params, start in pending.values()]:
+			process.terminate()
+			process.join()
+		raise
+	finally:
+		shutil.rmtree(data_path, ignore_errors=True)
+
+	return records
+
+def _wait_config(pending, explored_keys, idle):
+	"""
+	Waits for a configuration of run_search to finish and removes it from pending; its worker process is returned to idle, or, if it died (e.g. killed for lack of memory), the configuration is recorded as failed
+
+	Args:
+		pending (dict): worker process (process, connection), parameters and start time of each configuration being trained, by index
+		explored_keys (list): names of the searched parameters
+		idle (list): worker processes waiting for a configuration
+
+	returns:
+		(dict): result of the configuration
+	"""
+	index_fd = {worker[1].fileno(): index for index, (worker, params, start) in pending.items()}
+	readable, _, _ = select.select(index_fd.keys(), [], [])
+	index = index_fd[readable[0]]
+	worker, params, tic = pending.pop(index)
+	try:
+		record = worker[1].recv()
+	except (EOFError, IOError):
+		worker[0].join()
+		return _failed_record(index, params, explored_keys, 'worker process %d died while training the configuration (exit code: %s)' % (worker[0].pid, worker[0].exitcode), time.time() - tic)
+	idle.append(worker)
+
+	return record
+
+def _print_progress(record, n_done, n_total, elapsed):
+	""" prints the result of a configuration and the throughput of the sweep """
+	if 'pruned_at' in record:
+		status = 'pruned at rung %d (score: %.2f%%)' % (record['pruned_at'], record['halving_score']*100)
+	elif record['error'] is None:
+		status = 'perf: %.2f%%' % (np.mean(record['test_perf'])*100)
+	else:
+		status = 'FAILED: ' + record['error'].strip().split('\n')[-1]
+	rate = n_done/elapsed
+	print '[%d/%d] %s ; %s ; %.1fs' % (n_done, n_total, record['name'], status, record['runtime'])
+	print '\tthroughput: %.1f configs/hour ; elapsed: %s ; remaining: %s' % (rate*3600., datetime.timedelta(seconds=int(elapsed)), datetime.timedelta(seconds=int((n_total-n_done)/rate)))
+	sys.stdout.flush()
+
+def has_results(folder_path):
+	""" whether folder_path contains the results of a native sweep """
+	return ss.has_results(folder_path)
+
+def load_results(folder_path):
+	"""
+	Loads the results of a native sweep from its results store, in the order of the configurations; weights are not read
+
+	Args:
+		folder_path (str): folder of the sweep
+
+	returns:
+		(list): performance of all runs of each configuration
+		(list): slope differences of each configuration (-1 for failed configurations)
+		(dict): explored values of each parameter for each configuration
+	"""
+	records = ss.load_records(folder_path)
+
+	stat_diff_size = ([len(r['stat_diff']) for r in records if r['stat_diff'] is not None] or [4])[0]
+	perf_all = [np.asarray(r['test_perf']) for r in records]
+	stat_diff = [np.asarray(r['stat_diff']) if r['stat_diff'] is not None else np.ones(stat_diff_size)*-1. for r in records]
+
+	param = {k: np.array([r['explored'][k] for r in records]) for k in records[0]['explored'].keys()}
+
+	return perf_all, stat_diff, param
@@ -0,0 +1,205 @@
+""" Support functions to store the results of parameter explorations: a compact columnar table of configurations and scalar metrics, and a separate store of memory-mappable weight arrays """
+
+import os
+import copy
+import pickle
+import numpy as np
+
+table_file = 'table.npz'
+configs_file = 'configs.pkl'
+rows_folder = 'rows'
+weights_folder = 'weights'
+networks_folder = 'networks'
+min_stored_size = 1024 #arrays of the Network with at least this many elements are saved in the weights store
+
+def _atomic_write(path, write_func, mode='wb'):
+	""" writes a file through write_func(file) to a temporary file renamed into place, so that readers never see a partial file """
+	tmp_path = path + '.tmp%d' % os.getpid()
+	with open(tmp_path, mode) as f:
+		write_func(f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(tmp_path, path)
+
+def write_row(folder, record):
+	"""
+	Saves the result of one configuration as its own row file (atomically), so that results can be written concurrently and as soon as they are available
+
+	Args:
+		folder (str): folder of the exploration
+		record (dict): result of the configuration, with at least keys 'index', 'name', 'params', 'explored', 'test_perf', 'stat_diff', 'runtime' and 'error'
+	"""
+	path = os.path.join(folder, rows_folder)
+	if not os.path.isdir(path):
+		try: os.makedirs(path)
+		except OSError: pass #created concurrently
+	_atomic_write(os.path.join(path, '%08d.pkl' % record['index']), lambda f: pickle.dump(record, f, protocol=2))
+
+def has_results(folder):
+	""" whether folder contains a results store """
+	return os.path.isfile(os.path.join(folder, table_file)) or os.path.isdir(os.path.join(folder, rows_folder))
+
+def load_records(folder):
+	"""
+	Loads the results of all configurations of an exploration, from the compacted table and from rows not compacted yet (rows supersede the table)
+
+	Args:
+		folder (str): folder of the exploration
+
+	returns:
+		(list): result of each configuration (dict), sorted by configuration index
+	"""
+	records = {}
+	if os.path.isfile(os.path.join(folder, table_file)):
+		for record in _columns_to_records(dict(np.load(os.path.join(folder, table_file), allow_pickle=True)), pickle.load(open(os.path.join(folder, configs_file), 'rb'))):
+			records[record['index']] = record
+	for f_name, path in _list_rows(folder):
+		try:
+			record = pickle.load(open(path, 'rb'))
+		except (IOError, OSError): #compacted concurrently
+			continue
+		records[record['index']] = record
+
+	return [records[i] for i in sorted(records.keys())]
+
+def load_table(folder):
+	"""
+	Loads the table of scalar results of an exploration, one row per configuration; weights are not read
+
+	Args:
+		folder (str): folder of the exploration
+
+	returns:
+		(dict): columns of the table: 'index', 'name', 'failed', 'runtime', 'test_perf' (configurations x runs), 'stat_diff', 'n_epi_trained' (episodes trained in each run, < n_epi_tot if stopped early) and 'param_<name>' for each explored parameter; missing values are NaN (-1 for integers)
+	"""
+	columns, _ = _records_to_columns(load_records(folder))
+	return columns
+
+def compact(folder):
+	"""
+	Merges the row files of an exploration into the columnar table and removes them
+
+	Args:
+		folder (str): folder of the exploration
+	"""
+	rows = _list_rows(folder)
+	records = load_records(folder)
+	if records == []: return
+	columns, configs = _records_to_columns(records)
+	_atomic_write(os.path.join(folder, configs_file), lambda f: pickle.dump(configs, f, protocol=2))
+	_atomic_write(os.path.join(folder, table_file), lambda f: np.savez(f, **columns))
+	for _, path in rows:
+		os.remove(path)
+
+def _list_rows(folder):
+	""" returns the name and path of the row files of an exploration """
+	path = os.path.join(folder, rows_folder)
+	if not os.path.isdir(path): return []
+	return [(f, os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.endswith('.pkl')]
+
+def _pad(arrays, fill, dtype=float):
+	""" stacks 1D arrays of different lengths into a 2D array, padded with fill """
+	width = max([len(a) for a in arrays if a is not None] + [0])
+	stacked = np.ones((len(arrays), width), dtype=dtype)*fill
+	for i, a in enumerate(arrays):
+		if a is not None: stacked[i, :len(a)] = a
+
+	return stacked
+
+def _records_to_columns(records):
+	""" converts results records to table columns and to the non-scalar information kept next to the table """
+	columns = {	'index' 		: np.array([r['index'] for r in records], dtype=int),
+				'name' 			: np.array([r['name'] for r in records]),
+				'failed' 		: np.array([r['error'] is not None for r in records]),
+				'runtime' 		: np.array([r['runtime'] for r in records], dtype=float),
+				'test_perf' 	: _pad([np.asarray(r['test_perf'], dtype=float) for r in records], np.nan),
+				'stat_diff' 	: _pad([None if r['stat_diff'] is None else np.asarray(r['stat_diff'], dtype=float) for r in records], np.nan),
+				'n_epi_trained' : _pad([r.get('n_epi_trained') for r in records], -1, dtype=int)
+				}
+	explored_keys = sorted(set([k for r in records for k in r['explored'].keys()]))
+	for k in explored_keys:
+		columns['param_' + k] = np.array([r['explored'][k] if k in r['explored'] else r['params'].get(k) for r in records]) #static value for configurations in which k was not explored
+	configs = {'params': [r['params'] for r in records], 'explored_keys': explored_keys, 'errors': [r['error'] for r in records], 'extra': [{k: v for k, v in r.items() if k not in _columns_keys} for r in records]}
+
+	return columns, configs
+
+_columns_keys = ['index', 'name', 'params', 'explored', 'error', 'runtime', 'test_perf', 'stat_diff', 'n_epi_trained']
+
+def _columns_to_records(columns, configs):
+	""" converts table columns (and the information kept next to the table) back to results records """
+	records = []
+	for i in range(len(columns['index'])):
+		record = {	'index' 		: int(columns['index'][i]),
+					'name' 			: str(columns['name'][i]),
+					'params' 		: configs['params'][i],
+					'explored' 		: {k: columns['param_' + k][i].item() for k in configs['explored_keys']},
+					'error' 		: configs['errors'][i],
+					'runtime' 		: float(columns['runtime'][i]),
+					'test_perf' 	: columns['test_perf'][i][~np.isnan(columns['test_perf'][i])],
+					'stat_diff' 	: None if np.isnan(columns['stat_diff'][i]).all() else columns['stat_diff'][i][~np.isnan(columns['stat_diff'][i])],
+					'n_epi_trained' : columns['n_epi_trained'][i][columns['n_epi_trained'][i]>=0]
+					}
+		record.update(configs['extra'][i])
+		records.append(record)
+
+	return records
+
+def save_net(folder, net, weights_dtype=None):
+	"""
+	Saves a Network as a light pickled object, with its large arrays (weights, trackers) stored separately as .npy files that can be memory-mapped
+
+	Args:
+		folder (str): folder of the exploration
+		net (Network): Network to save
+		weights_dtype (str, optional): data type in which to store the weight matrices (arrays whose name contains '_W'), e.g. 'float16' to quantize them; original type if None. Default: None
+	"""
+	arrays = {k: v for k, v in vars(net).items() if isinstance(v, np.ndarray) and v.size >= min_stored_size}
+	weights_path = os.path.join(folder, weights_folder, net.name)
+	if not os.path.isdir(weights_path):
+		os.makedirs(weights_path)
+	for k, v in arrays.items():
+		if weights_dtype is not None and '_W' in k and v.dtype.kind == 'f':
+			v = v.astype(weights_dtype)
+		_atomic_write(os.path.join(weights_path, k + '.npy'), lambda f: np.save(f, v))
+
+	skeleton = copy.copy(net)
+	for k in arrays.keys():
+		setattr(skeleton, k, None)
+	skeleton._stored_arrays = sorted(arrays.keys())
+	if not os.path.isdir(os.path.join(folder, networks_folder)):
+		os.makedirs(os.path.join(folder, networks_folder))
+	_atomic_write(os.path.join(folder, networks_folder, net.name), lambda f: pickle.dump(skeleton, f, protocol=2))
+
+def load_weights(folder, name, array_name, mmap_mode='r'):
+	"""
+	Loads one array of a saved Network without unpickling the Network
+
+	Args:
+		folder (str): folder of the exploration
+		name (str): name of the Network
+		array_name (str): name of the array, e.g. 'hid_W_trained'
+		mmap_mode (str, optional): memory-map mode of the array (see np.load); loaded into memory if None. Default: 'r'
+
+	returns:
+		(numpy array): the array
+	"""
+	return np.load(os.path.join(folder, weights_folder, name, array_name + '.npy'), mmap_mode=mmap_mode)
+
+def load_net(folder, name, mmap_mode='r'):
+	"""
+	Loads a Network saved with save_net (or pickled whole) and reattaches its stored arrays
+
+	Args:
+		folder (str): folder of the exploration
+		name (str): name of the Network
+		mmap_mode (str, optional): memory-map mode of the stored arrays (see np.load); loaded into memory if None. Default: 'r'
+
+	returns:
+		(Network): the Network
+	"""
+	with open(os.path.join(folder, networks_folder, name), 'rb') as f:
+		net = pickle.load(f)
+	for k in getattr(net, '_stored_arrays', []):
+		setattr(net, k, load_weights(folder, name, k, mmap_mode))
+
+	return net
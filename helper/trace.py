@@ -0,0 +1,157 @@
+""" Support functions to record traces of the signals of the network during training (dopa, reward prediction, decisions, posteriors, activations, ...) in chunked columnar buffers, optionally spilled to disk in the background, and to load them lazily """
+
+import os
+import pickle
+import threading
+import Queue
+import numpy as np
+
+available_signals = ['dopa', 'RP', 'RPE', 'reward', 'ach', 'label', 'decision_greedy', 'decision_explore', 'posterior_greedy', 'posterior_explore', 'activ'] #signals that the Network can record (see Network.train)
+index_signals = ['run', 'episode', 'trial'] #always recorded, to locate each recorded trial
+
+class TraceRecorder(object):
+	"""
+	Records signals of the trials of a Network during training; attach it to a Network with net.recorder = TraceRecorder(...) before training.
+	Each signal is kept as a column of fixed-size chunks: a chunk is preallocated and filled batch by batch, and once full it is kept in memory or, if a folder is given, written to disk by a background thread.
+	The recorded values are read with recorder[signal] (or load_trace(folder) for traces on disk).
+	"""
+
+	def __init__(self, signals=['dopa', 'RPE', 'decision_greedy', 'decision_explore'], every=1, chunk_size=10000, folder=None):
+		"""
+		Args:
+			signals (list, optional): signals to record, from available_signals. Default: ['dopa', 'RPE', 'decision_greedy', 'decision_explore']
+			every (int, optional): records one trial out of every; e.g. 10 to subsample the trials by 10. Default: 1
+			chunk_size (int, optional): number of trials per chunk. Default: 10000
+			folder (str, optional): folder in which to write the chunks; kept in memory if None. Default: None
+		"""
+		unknown = [s for s in signals if s not in available_signals]
+		if unknown != []:
+			raise ValueError('unknown signals: %s' % ', '.join(unknown))
+		self.signals 	= list(signals)
+		self.every 		= every
+		self.chunk_size = chunk_size
+		self.folder 	= folder
+		self._buffers 	= {} 	#chunk being filled, for each signal
+		self._n_filled 	= 0 	#number of trials in the chunks being filled
+		self._chunks 	= {s: [] for s in self.signals + index_signals} #full chunks kept in memory
+		self._n_chunks 	= 0 	#number of chunks completed
+		self._skip 		= 0 	#number of trials to skip before the next recorded trial
+		self._queue 	= None
+		self._writer 	= None
+		if folder is not None:
+			for s in self.signals + index_signals:
+				if not os.path.isdir(os.path.join(folder, s)):
+					os.makedirs(os.path.join(folder, s))
+			with open(os.path.join(folder, 'trace.pkl'), 'wb') as f:
+				pickle.dump({'signals': self.signals, 'every': every}, f, protocol=2)
+
+	def record(self, run, episode, trial, **values):
+		"""
+		Records the signals of a batch of trials
+
+		Args:
+			run (int): run of the batch
+			episode (int): episode of the batch
+			trial (int): index of the first trial of the batch in the episode
+			values (numpy arrays): value of each signal for each trial of the batch (first dimension), including 'label', which sets the number of trials of the batch; signals not recorded are ignored
+		"""
+		n_trials = len(values['label'])
+		idx = np.arange(self._skip, n_trials, self.every)
+		self._skip = (self._skip - n_trials) % self.every
+		if len(idx) == 0: return
+
+		columns = {s: np.asarray(values[s])[idx] for s in self.signals}
+		columns['run'] = np.ones(len(idx), dtype=int)*run
+		columns['episode'] = np.ones(len(idx), dtype=int)*episode
+		columns['trial'] = trial + idx
+		start = 0
+		while start < len(idx):
+			if self._buffers == {}:
+				self._buffers = {s: np.empty((self.chunk_size,) + v.shape[1:], dtype=v.dtype) for s, v in columns.items()}
+			n = min(len(idx) - start, self.chunk_size - self._n_filled)
+			for s, v in columns.items():
+				self._buffers[s][self._n_filled:self._n_filled+n] = v[start:start+n]
+			self._n_filled += n
+			start += n
+			if self._n_filled == self.chunk_size:
+				self._store_chunk()
+
+	def flush(self):
+		""" stores the trials recorded in the chunk being filled and, for traces on disk, waits until all chunks are written """
+		if self._n_filled > 0:
+			self._store_chunk()
+		if self._queue is not None:
+			self._queue.join()
+
+	def _store_chunk(self):
+		""" stores the chunks being filled (in memory or on disk) and starts new ones """
+		chunks = {s: b[:self._n_filled] for s, b in self._buffers.items()}
+		if self.folder is None:
+			for s, c in chunks.items():
+				self._chunks[s].append(c)
+		else:
+			if self._writer is None:
+				self._queue = Queue.Queue()
+				self._writer = threading.Thread(target=_write_chunks, args=(self.folder, self._queue))
+				self._writer.daemon = True
+				self._writer.start()
+			self._queue.put((self._n_chunks, chunks))
+		self._n_chunks += 1
+		self._buffers = {}
+		self._n_filled = 0
+
+	def __getitem__(self, signal):
+		""" recorded values of signal (or of an index signal: 'run', 'episode', 'trial'), for all recorded trials """
+		if self.folder is not None:
+			self.flush()
+			return load_trace(self.folder)[signal]
+		chunks = self._chunks[signal] + ([self._buffers[signal][:self._n_filled]] if self._n_filled > 0 else [])
+		return np.concatenate(chunks) if chunks != [] else np.empty(0)
+
+	def __getstate__(self):
+		""" traces on disk are flushed and the background writer is not pickled (e.g. with the Network) """
+		self.flush()
+		state = self.__dict__.copy()
+		state['_queue'] = None
+		state['_writer'] = None
+		return state
+
+def _write_chunks(folder, queue):
+	""" writes the chunks put in queue to folder, one .npy file per signal and chunk """
+	while True:
+		i_chunk, chunks = queue.get()
+		for s, c in chunks.items():
+			np.save(os.path.join(folder, s, '%06d.npy' % i_chunk), c)
+		queue.task_done()
+
+class Trace(object):
+	""" trace recorded on disk by a TraceRecorder; signals are read only when accessed, with trace[signal] """
+
+	def __init__(self, folder, mmap_mode='r'):
+		"""
+		Args:
+			folder (str): folder of the trace
+			mmap_mode (str, optional): memory-map mode of the chunks (see np.load). Default: 'r'
+		"""
+		self.folder = folder
+		self.mmap_mode = mmap_mode
+		with open(os.path.join(folder, 'trace.pkl'), 'rb') as f:
+			info = pickle.load(f)
+		self.signals = info['signals']
+		self.every = info['every']
+
+	def chunks(self, signal):
+		""" memory-mapped chunks of signal, in order of recording """
+		path = os.path.join(self.folder, signal)
+		return [np.load(os.path.join(path, f), mmap_mode=self.mmap_mode) for f in sorted(os.listdir(path)) if f.endswith('.npy')]
+
+	def __getitem__(self, signal):
+		""" values of signal (or of an index signal: 'run', 'episode', 'trial') for all recorded trials """
+		if signal not in self.signals + index_signals:
+			raise KeyError(signal)
+		chunks = self.chunks(signal)
+		return np.concatenate(chunks) if chunks != [] else np.empty(0)
+
+def load_trace(folder, mmap_mode='r'):
+	""" opens a trace recorded on disk by a TraceRecorder (see Trace) """
+	return Trace(folder, mmap_mode)
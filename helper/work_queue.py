@@ -0,0 +1,211 @@
+""" Support functions to explore the parameters of the hebbian neural network with a work queue on a shared file system: configurations are written as job files that any number of worker processes, on one or several machines mounting the same folder, claim by atomically renaming them; workers keep their lease alive with heartbeats and leases that expire are put back in the queue """
+
+import os
+import time
+import socket
+import pickle
+import shutil
+import threading
+import multiprocessing
+import numpy as np
+import external as ex
+import sweep as sw
+import sweep_store as ss
+
+ex = reload(ex)
+sw = reload(sw)
+ss = reload(ss)
+
+queue_folder = 'queue'
+states = ['pending', 'leased', 'done']
+
+def submit_sweep(parameter_dict, explore_dict, images_dict, labels_dict, images_params, save_path, mode='cartesian', weights_dtype=None, cache=True):
+	"""
+	Writes the configurations of a sweep as jobs in the work queue of save_path, and the datasets next to it, for workers to train them (see run_worker)
+
+	Args:
+		parameter_dict (dict): static parameters of the Network
+		explore_dict (dict): explored parameters, with a list of values for each parameter
+		images_dict (dict): dictionary of 2D image arrays, with keys: 'train', 'test', 'task'
+		labels_dict (dict): dictionary of label arrays of the images
+		images_params (dict): parameters used to create the images
+		save_path (str): folder in which to save the results (see pp.check_dir); must be on a file system shared by the workers
+		mode (str, optional): how to combine the explored values (see sw.expand_configs). Default: 'cartesian'
+		weights_dtype (str, optional): data type in which to store the weights, e.g. 'float16'; original type if None. Default: None
+		cache (bool, optional): whether to use the result cache (see sw.run_sweep). Default: True
+
+	returns:
+		(int): number of jobs submitted
+	"""
+	configs, _ = sw.expand_configs(parameter_dict, explore_dict, mode)
+	for folder in ['networks'] + [os.path.join(queue_folder, s) for s in states]:
+		if not os.path.isdir(os.path.join(save_path, folder)):
+			os.makedirs(os.path.join(save_path, folder))
+	ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets'))
+
+	explored_keys = sorted(explore_dict.keys())
+	order = sorted(range(len(configs)), key=lambda ic: -sw.expected_cost(configs[ic])) #job files are claimed in name order: longest expected job first
+	for rank, ic in enumerate(order):
+		job = {'index': ic, 'params': configs[ic], 'explored_keys': explored_keys, 'images_params': images_params, 'weights_dtype': weights_dtype, 'cache': cache}
+		job_path = os.path.join(save_path, queue_folder, 'pending', '%06d_%08d.job' % (rank, ic))
+		with open(job_path + '.tmp', 'wb') as f: #written under another name and renamed, so that workers never claim a partial job
+			pickle.dump(job, f, protocol=2)
+		os.rename(job_path + '.tmp', job_path)
+
+	return len(configs)
+
+def queue_status(save_path):
+	""" returns the number of pending, leased and done jobs in the work queue of save_path (dict) """
+	return {s: len(os.listdir(os.path.join(save_path, queue_folder, s))) for s in states}
+
+def claim(save_path, worker_id):
+	"""
+	Claims the first pending job of the work queue by renaming its file to the leased jobs; the rename is atomic, so each job is claimed by exactly one worker
+
+	Args:
+		save_path (str): folder of the sweep
+		worker_id (str): identifier of the worker, appended to the name of the lease
+
+	returns:
+		(dict): the job; None if no job is pending
+		(str): path of the lease
+	"""
+	pending_path = os.path.join(save_path, queue_folder, 'pending')
+	for job_name in sorted(os.listdir(pending_path)):
+		if not job_name.endswith('.job'): continue
+		lease_path = os.path.join(save_path, queue_folder, 'leased', job_name + '@' + worker_id)
+		try:
+			os.utime(os.path.join(pending_path, job_name), None) #the lease starts now (the modification time is kept by the rename)
+			os.rename(os.path.join(pending_path, job_name), lease_path)
+		except OSError: #claimed by another worker
+			continue
+		with open(lease_path, 'rb') as f:
+			return pickle.load(f), lease_path
+
+	return None, None
+
+def complete(lease_path):
+	""" moves a leased job to the done jobs; returns False if the lease was lost (expired and requeued) """
+	job_name = os.path.basename(lease_path).split('@')[0]
+	done_path = os.path.join(os.path.dirname(os.path.dirname(lease_path)), 'done', job_name)
+	try:
+		os.rename(lease_path, done_path)
+	except OSError:
+		return False
+
+	return True
+
+def requeue_expired(save_path, lease_timeout):
+	"""
+	Puts back in the queue the leased jobs whose lease has not been renewed for lease_timeout seconds (e.g. their worker died); times are those of the shared file system, so that clocks of the machines need not agree
+
+	Args:
+		save_path (str): folder of the sweep
+		lease_timeout (float): time (in seconds) after which a lease expires
+
+	returns:
+		(int): number of jobs requeued
+	"""
+	leased_path = os.path.join(save_path, queue_folder, 'leased')
+	now = _file_system_time(save_path)
+	n_requeued = 0
+	for lease_name in os.listdir(leased_path):
+		lease_path = os.path.join(leased_path, lease_name)
+		try:
+			if now - os.path.getmtime(lease_path) < lease_timeout: continue
+			os.rename(lease_path, os.path.join(save_path, queue_folder, 'pending', lease_name.split('@')[0]))
+			n_requeued += 1
+		except OSError: #completed or requeued concurrently
+			continue
+
+	return n_requeued
+
+def _file_system_time(save_path):
+	""" current time of the file system holding save_path """
+	clock_path = os.path.join(save_path, queue_folder, '.clock_%s_%d' % (socket.gethostname(), os.getpid()))
+	with open(clock_path, 'w'):
+		pass
+	now = os.path.getmtime(clock_path)
+	os.remove(clock_path)
+
+	return now
+
+def _heartbeat(lease_path, interval, stop):
+	""" renews a lease every interval seconds until stop is set or the lease is lost """
+	while not stop.wait(interval):
+		try:
+			os.utime(lease_path, None)
+		except OSError:
+			return
+
+def run_worker(save_path, lease_timeout=600., heartbeat_interval=60., poll_interval=10., verbose=True):
+	"""
+	Trains the jobs of the work queue of save_path until no job is pending or leased; each result is written to the results store of save_path (see ss.write_row). A configuration trained twice (after its lease expired) overwrites its own result
+
+	Args:
+		save_path (str): folder of the sweep
+		lease_timeout (float, optional): time (in seconds) after which the lease of a job that is not renewed expires. Default: 600
+		heartbeat_interval (float, optional): time (in seconds) between renewals of the lease of the job being trained. Default: 60
+		poll_interval (float, optional): time (in seconds) between checks of the queue when no job is pending but some are leased. Default: 10
+		verbose (bool, optional): whether to report the jobs trained. Default: True
+
+	returns:
+		(int): number of jobs trained by the worker
+	"""
+	worker_id = '%s.%d' % (socket.gethostname(), os.getpid())
+	data_path = os.path.join(save_path, 'datasets')
+	n_trained = 0
+	while True:
+		requeue_expired(save_path, lease_timeout)
+		job, lease_path = claim(save_path, worker_id)
+		if job is None:
+			status = queue_status(save_path)
+			if status['pending'] + status['leased'] == 0: break
+			time.sleep(poll_interval)
+			continue
+
+		stop = threading.Event()
+		heartbeat = threading.Thread(target=_heartbeat, args=(lease_path, heartbeat_interval, stop))
+		heartbeat.daemon = True
+		heartbeat.start()
+		try:
+			record = sw._run_config((job['index'], job['params'], job['explored_keys'], data_path, job['images_params'], save_path, job['weights_dtype'], job['cache'], None))
+			ss.write_row(save_path, record)
+		finally:
+			stop.set()
+			heartbeat.join()
+		completed = complete(lease_path)
+		n_trained += 1
+		if verbose:
+			status = 'perf: %.2f%%' % (np.mean(record['test_perf'])*100) if record['error'] is None else 'FAILED'
+			print '[%s] %s ; %s ; %.1fs%s' % (worker_id, record['name'], status, record['runtime'], '' if completed else ' (lease lost)')
+
+	return n_trained
+
+def run_workers(save_path, n_processes=None, **kwargs):
+	""" runs n_processes local workers on the work queue of save_path (see run_worker) and waits for them to finish; number of cores if n_processes is None """
+	n_processes = n_processes or multiprocessing.cpu_count()
+	workers = [multiprocessing.Process(target=run_worker, args=(save_path,), kwargs=kwargs) for _ in range(n_processes)]
+	for w in workers:
+		w.start()
+	for w in workers:
+		w.join()
+
+def finish_sweep(save_path):
+	"""
+	Compacts the results of a sweep whose jobs are all done and removes its work queue and datasets
+
+	Args:
+		save_path (str): folder of the sweep
+
+	returns:
+		(bool): whether the sweep was finished (False if jobs are still pending or leased)
+	"""
+	status = queue_status(save_path)
+	if status['pending'] + status['leased'] > 0:
+		return False
+	ss.compact(save_path)
+	shutil.rmtree(os.path.join(save_path, queue_folder), ignore_errors=True)
+	shutil.rmtree(os.path.join(save_path, 'datasets'), ignore_errors=True)
+
+	return True
@@ -14,11 +14,13 @@ import datetime
 import hebbian_net
 import helper.external as ex
 import helper.assess_network as an
+import helper.result_cache as rc
 from pdb import set_trace
 
 hebbian_net = reload(hebbian_net)
 ex = reload(ex)
 an = reload(an)
+rc = reload(rc)
 
 """ create Hebbian neural network """
 net = hebbian_net.Network(	dHigh 				= 4.0,#4.0, #6.0,#2.0,#4.0,
@@ -75,6 +77,7 @@ net = hebbian_net.Network(	dHigh 				= 4.0,#4.0, #6.0,#2.0,#4.0,
 							pdf_method 			= 'fit',
 							classifier			= 'neural_prob',
 							RF_classifier 		= 'svm',
+							RF_probing 			= 'dense',
 							pairing_class 		= None,	
 							test_each_epi		= True,
 							early_stop 			= False,
@@ -114,7 +117,14 @@ images_dict, labels_dict, ori_dict, images_params = ex.load_images(	protocol 		=
 																						}
 																	)
 
-net.train(images_dict, labels_dict, images_params)
+""" train the network, or take it from the result cache if it was already trained with the same parameters, data and code """
+cache_key = rc.config_key(net, images_params, images_dict, labels_dict)
+if rc.has_result(cache_key):
+	net = rc.load_net(cache_key, net.name)
+	print 'network taken from the result cache (key: ' + cache_key + ')'
+else:
+	net.train(images_dict, labels_dict, images_params)
+	rc.store(cache_key, net)
 
 CM_all, perf_all = net.test(images_dict['test'], labels_dict['test'])
 
@@ -13,6 +13,7 @@ if 'mnt' in os.getcwd(): matplotlib.use('Agg') #to avoid sending plots to screen
 import numpy as np
 import datetime
 import time
+import shutil
 import pypet
 import helper.external as ex
 import helper.pypet_helper as pp
@@ -156,8 +157,10 @@ traj.f_explore(explore_dict)
 
 """ launch simulation with pypet for parameter exploration """
 tic = time.time()
-env.f_run(pp.launch_exploration, images_dict, labels_dict, images_params, save_path)
+data_path = ex.publish_datasets(images_dict, labels_dict, os.path.join(save_path, 'datasets')) #workers memory-map the datasets instead of receiving copies
+env.f_run(pp.launch_exploration, data_path, images_params, save_path)
 toc = time.time()
+shutil.rmtree(data_path)
 
 """ save parameters to file """
 save_file = os.path.join(save_path, parameter_dict['name'] + '_params.txt')
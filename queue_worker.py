@@ -0,0 +1,18 @@
+"""
+This code runs workers on the work queue of a parameter exploration of the hebbian neural network object (see helper/work_queue.py). It can be started on any number of machines that mount the folder of the exploration.
+
+usage: python queue_worker.py <folder of the exploration> [<number of worker processes>]
+"""
+
+import os
+import sys
+import matplotlib
+if 'mnt' in os.getcwd(): matplotlib.use('Agg') #to avoid sending plots to screen when working on the servers
+import helper.work_queue as wq
+
+wq = reload(wq)
+
+save_path = sys.argv[1]
+n_processes = int(sys.argv[2]) if len(sys.argv) > 2 else None #number of cores if None
+
+wq.run_workers(save_path, n_processes, lease_timeout=600., heartbeat_interval=60.)